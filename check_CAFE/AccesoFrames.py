@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Acceso por ventanas a las imágenes.
+Objetivo: Leer de una imagen .fits únicamente las ventanas que se van a estudiar, en lugar de cargar
+          y trasponer la imagen completa. Los datos de las imágenes sin comprimir se proyectan en memoria
+          (memmap) sin aplicar BSCALE/BZERO, de modo que solo se leen del disco las zonas del fichero que
+          contienen las ventanas, y el escalado se aplica después únicamente a las ventanas.
+          Las ventanas se devuelven con el mismo convenio de ejes que la matriz traspuesta de las rutinas,
+          es decir, matriz[x,y], donde x es el eje NAXIS1 de la cabecera e y el eje NAXIS2.
+          También se pueden recorrer varias imágenes a la vez por bloques de filas (ver leerBloques), para
+          combinarlas sin tenerlas completas en memoria.
+"""
+
+import os
+import numpy as np
+import Instrumentacion
+
+"""
+Memoria máxima (en MB) de cada bloque de filas leído a la vez de una lista de imágenes (ver leerBloques)
+"""
+MEMORIA_BLOQUE=int(os.environ.get("CAFE_BLOQUE_MB","64"))
+
+"""
+Funcion que aplica a los datos sin escalar de una ventana los valores BSCALE y BZERO de la cabecera,
+obteniendo el mismo tipo de datos que devuelve astropy al leer la imagen completa.
+"""
+def escalar(datos, cabecera):
+    bscale=cabecera.get("BSCALE",1)
+    bzero=cabecera.get("BZERO",0)
+    bitpix=cabecera["BITPIX"]
+    if bscale==1 and bzero==0:
+        return datos
+    # Enteros sin signo almacenados como enteros con signo desplazados (BZERO=2**(BITPIX-1))
+    if bscale==1 and bitpix>8 and bzero==2**(bitpix-1):
+        tipo=np.dtype("uint"+str(bitpix))
+        return (datos.astype(np.int64)+bzero).astype(tipo)
+    if bitpix in (8,16,-32):
+        tipo=np.float32
+    else:
+        tipo=np.float64
+    return (datos*tipo(bscale)+tipo(bzero)).astype(tipo)
+
+"""
+Funcion que lee de una imagen .fits la pila de ventanas cuadradas de lado tam, con esquina superior
+izquierda en (venX[i], venY[i]) según el convenio de la matriz traspuesta. Devuelve una matriz
+(N, tam, tam) equivalente a tomar matriz[venX:venX+tam, venY:venY+tam] de la matriz traspuesta
+para cada ventana. Las imágenes comprimidas se leen completas.
+"""
+def leerVentanas(rutaFich, venX, venY, tam):
+    from astropy.io import fits
+    rango=np.arange(tam)
+    # En el fichero las filas corresponden al eje Y y las columnas al eje X de la matriz traspuesta
+    filas=np.asarray(venY,dtype=int)[:,None]+rango
+    columnas=np.asarray(venX,dtype=int)[:,None]+rango
+    hdulist=fits.open(rutaFich,memmap=True,do_not_scale_image_data=True)
+    try:
+        hdu=hdulist[0]
+        # En las imágenes comprimidas la imagen está en la primera extensión
+        if hdu.data is None:
+            hdu=hdulist[1]
+        # Solo se leen del disco las páginas del fichero que contienen las ventanas
+        datos=hdu.data[filas[:,:,None],columnas[:,None,:]]
+        ventanas=escalar(datos,hdu.header)
+    finally:
+        hdulist.close()
+    Instrumentacion.contar('ficherosLeidos')
+    # Trasponemos cada ventana para seguir el convenio matriz[x,y]
+    return np.ascontiguousarray(ventanas.transpose(0,2,1))
+
+"""
+Funcion que lee de una imagen .fits las franjas de ancho columnas consecutivas (eje x de la matriz traspuesta)
+que comienzan en cada una de las posiciones de inicios. Devuelve una lista con una matriz (ancho, NAXIS2) por
+franja, equivalente a tomar matriz[inicio:inicio+ancho,:] de la matriz traspuesta (si la franja se sale de la
+imagen tiene menos columnas). La imagen se proyecta en memoria en modo de solo lectura, de modo que varios
+procesos que leen franjas de la misma imagen comparten sus páginas en memoria en lugar de tener cada uno
+una copia de la imagen completa.
+"""
+def leerFranjas(rutaFich, inicios, ancho):
+    from astropy.io import fits
+    hdulist=fits.open(rutaFich,memmap=True,do_not_scale_image_data=True,mode='readonly')
+    try:
+        hdu=hdulist[0]
+        # En las imágenes comprimidas la imagen está en la primera extensión
+        if hdu.data is None:
+            hdu=hdulist[1]
+        # Pasamos cada franja al convenio matriz[x,y]
+        franjas=[np.ascontiguousarray(escalar(hdu.data[:,inicio:inicio+ancho],hdu.header).T) for inicio in inicios]
+    finally:
+        hdulist.close()
+    Instrumentacion.contar('ficherosLeidos')
+    return franjas
+
+"""
+Funcion que devuelve las dimensiones (NAXIS2, NAXIS1) de una imagen .fits sin leer sus datos
+"""
+def getDimensiones(rutaFich):
+    from astropy.io import fits
+    hdulist=fits.open(rutaFich,memmap=True,do_not_scale_image_data=True,mode='readonly')
+    try:
+        # En las imágenes comprimidas la imagen está en la primera extensión
+        hdu=hdulist[0] if hdulist[0].data is not None else hdulist[1]
+        return hdu.data.shape
+    finally:
+        hdulist.close()
+
+"""
+Funcion (generador) que recorre a la vez una lista de imágenes .fits por bloques de filas del fichero (eje y de la
+matriz traspuesta). Para cada bloque devuelve la fila inicial, la fila final y la pila (imágenes x filas x NAXIS1)
+con los datos escalados de todas las imágenes, como reales de 64 bits. El número de filas de cada bloque se calcula
+para que la pila no supere memoriaMaxima MB (por defecto MEMORIA_BLOQUE), de modo que la memoria necesaria no
+depende del número de imágenes. Las imágenes se proyectan en memoria y solo se leen del disco las filas de cada
+bloque. La pila se reutiliza en cada bloque, por lo que se debe copiar lo que se quiera conservar.
+Todas las imágenes deben tener las mismas dimensiones. Las imágenes comprimidas se leen completas.
+"""
+def leerBloques(ficheros, memoriaMaxima=None):
+    from astropy.io import fits
+    if memoriaMaxima is None:
+        memoriaMaxima=MEMORIA_BLOQUE
+    hdulists=[]
+    try:
+        hdus=[]
+        for rutaFich in ficheros:
+            hdulists.append(fits.open(rutaFich,memmap=True,do_not_scale_image_data=True,mode='readonly'))
+            # En las imágenes comprimidas la imagen está en la primera extensión
+            hdus.append(hdulists[-1][0] if hdulists[-1][0].data is not None else hdulists[-1][1])
+            Instrumentacion.contar('ficherosLeidos')
+        numFilas,numColumnas=hdus[0].data.shape
+        for rutaFich,hdu in zip(ficheros,hdus):
+            if hdu.data.shape!=(numFilas,numColumnas):
+                raise ValueError("La imagen "+rutaFich+" no tiene las mismas dimensiones que "+ficheros[0])
+        filasBloque=int(max(1,min(numFilas,memoriaMaxima*1024*1024//(len(hdus)*numColumnas*8))))
+        pila=np.empty((len(hdus),filasBloque,numColumnas))
+        for inicio in range(0,numFilas,filasBloque):
+            fin=min(inicio+filasBloque,numFilas)
+            for i,hdu in enumerate(hdus):
+                pila[i,:fin-inicio]=escalar(hdu.data[inicio:fin],hdu.header)
+            yield inicio,fin,pila[:,:fin-inicio]
+    finally:
+        for hdulist in hdulists:
+            hdulist.close()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Ajuste por lotes.
+Objetivo: Ajustar de una sola vez un conjunto de N curvas 1-D a un mismo modelo no lineal
+          mediante el algoritmo de Levenberg-Marquardt vectorizado con NumPy.
+          Cada curva mantiene su propio factor de amortiguamiento, de modo que el resultado
+          de cada ajuste es independiente del resto de curvas del lote.
+"""
+
+import numpy as np
+
+"""
+Número máximo de iteraciones del algoritmo para cada curva del lote
+"""
+MAX_ITER=200
+
+"""
+Tolerancia relativa en la variación de chi cuadrado y de los parámetros para dar por convergido un ajuste
+"""
+TOLERANCIA=1e-10
+
+"""
+Factor de amortiguamiento inicial. Un valor alto hace que los primeros pasos sean cortos
+(descenso por gradiente), evitando que las curvas con el máximo lejos del centro de la ventana
+salten a otro mínimo local.
+"""
+LAMBDA_INICIAL=1.
+
+"""
+Funcion que ajusta un lote de curvas con el algoritmo de Levenberg-Marquardt.
+Se recibe por parámetros:
+- funcion: modelo f(x,p) que devuelve una matriz (N,M) a partir de x (N,M) y p (N,P)
+- jacobiano: derivadas del modelo j(x,p) que devuelve una matriz (N,M,P)
+- x: matriz (N,M) con las abscisas de cada curva
+- Y: matriz (N,M) con las ordenadas de cada curva
+- p0: matriz (N,P) con los valores iniciales de los parámetros
+La función devuelve la matriz (N,P) con los parámetros ajustados y un vector (N,) que indica
+si el ajuste de cada curva ha convergido con valores finitos.
+"""
+def levenbergMarquardt(funcion, jacobiano, x, Y, p0, maxIter=MAX_ITER, tol=TOLERANCIA):
+    x=np.asarray(x,dtype=np.float64)
+    Y=np.asarray(Y,dtype=np.float64)
+    p=np.array(p0,dtype=np.float64)
+    numCurvas,numParam=p.shape
+    # Factor de amortiguamiento para cada curva
+    lam=np.empty(numCurvas)
+    lam.fill(LAMBDA_INICIAL)
+    # Residuos y chi cuadrado iniciales
+    r=Y-funcion(x,p)
+    chi2=np.sum(r**2,axis=1)
+    # Curvas que aún se están ajustando y curvas que han convergido
+    activas=np.isfinite(chi2)
+    convergido=np.zeros(numCurvas,dtype=bool)
+    identidad=np.eye(numParam)
+    for it in range(maxIter):
+        idx=np.where(activas)[0]
+        if len(idx)==0:
+            break
+        xa=x[idx]
+        pa=p[idx]
+        J=jacobiano(xa,pa)
+        # Sistema normal (J^T J + lambda*diag(J^T J)) dp = J^T r para cada curva
+        JTJ=np.einsum('nmp,nmq->npq',J,J)
+        g=np.einsum('nmp,nm->np',J,r[idx])
+        diagonal=np.einsum('npp->np',JTJ)
+        diagonal=np.maximum(diagonal,1e-12*np.max(diagonal,axis=1)[:,None]+1e-300)
+        A=JTJ+(lam[idx][:,None]*diagonal)[:,:,None]*identidad
+        dp=np.empty_like(pa)
+        validos=np.isfinite(A).all(axis=(1,2)) & np.isfinite(g).all(axis=1)
+        try:
+            dp[validos]=np.linalg.solve(A[validos],g[validos][:,:,None])[:,:,0]
+        except np.linalg.LinAlgError:
+            # Si alguna matriz es singular resolvemos curva a curva
+            for k in np.where(validos)[0]:
+                try:
+                    dp[k]=np.linalg.solve(A[k],g[k])
+                except np.linalg.LinAlgError:
+                    validos[k]=False
+        dp[~validos]=0.0
+        pn=pa+dp
+        with np.errstate(all='ignore'):
+            rn=Y[idx]-funcion(xa,pn)
+            chin=np.sum(rn**2,axis=1)
+        # Aceptamos el paso en las curvas en las que disminuye chi cuadrado
+        mejora=validos & np.isfinite(chin) & (chin<=chi2[idx])
+        aceptadas=idx[mejora]
+        cambioChi=chi2[aceptadas]-chin[mejora]
+        cambioPar=np.max(np.abs(dp[mejora])/(np.abs(pn[mejora])+tol),axis=1)
+        p[aceptadas]=pn[mejora]
+        r[aceptadas]=rn[mejora]
+        chi2[aceptadas]=chin[mejora]
+        lam[aceptadas]=np.maximum(lam[aceptadas]/10.,1e-12)
+        rechazadas=idx[~mejora]
+        lam[rechazadas]=lam[rechazadas]*10.
+        # Criterios de convergencia
+        fin=(cambioChi<=tol*chi2[aceptadas]) | (cambioPar<=tol)
+        convergido[aceptadas[fin]]=True
+        activas[aceptadas[fin]]=False
+        # Si el amortiguamiento es enorme ya no es posible mejorar: estamos en el mínimo
+        estancadas=rechazadas[lam[rechazadas]>1e10]
+        convergido[estancadas]=np.isfinite(chi2[estancadas])
+        activas[estancadas]=False
+    convergido=convergido & np.isfinite(p).all(axis=1)
+    return p,convergido
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Caché de resultados.
+Objetivo: No repetir el procesado de un fichero (arco, flat o bias) cuyo resultado ya se ha calculado.
+          Cada resultado se guarda con una clave obtenida a partir de la huella de los ficheros de los
+          que depende: el propio fichero, las imágenes de referencia, los ficheros de configuración
+          (spots.txt, ordenes_input.txt), el código de la rutina que lo calcula y el de los módulos comunes
+          que utilizan las rutinas (DEPENDENCIAS). La huella de un fichero
+          es su tamaño, su fecha de modificación y un resumen MD5 rápido de su contenido: el fichero completo
+          si es pequeño y, en las imágenes, la cabecera y una muestra de los datos repartida por todo el fichero,
+          de modo que comprobar la caché no obliga a leer todos los píxeles.
+          Junto con el valor devuelto se guarda el contenido de los ficheros de salida (.spot, _dat.txt),
+          que solo se vuelven a escribir si han cambiado o no existen.
+          Los resultados se almacenan en el directorio Cache_dat, un fichero por clave, por lo que varios
+          procesos pueden usar la caché a la vez. Se puede borrar en cualquier momento.
+          Con la variable de entorno CAFE_CACHE=0 no se utiliza la caché.
+"""
+
+import os
+import os.path
+import sys
+import hashlib
+import cPickle
+import Instrumentacion
+
+"""
+Directorio donde se guardan los resultados
+"""
+DIR_CACHE="./Cache_dat"
+
+"""
+Indica si se utiliza la caché
+"""
+USAR_CACHE=os.environ.get("CAFE_CACHE","1")=="1"
+
+"""
+Versión del formato de la caché. Al cambiarla se invalidan todos los resultados guardados.
+"""
+VERSION_CACHE=1
+
+"""
+Tamaño de los bloques (en bytes) en los que se lee un fichero para calcular su resumen
+"""
+TAM_BLOQUE=1<<20
+
+"""
+Tamaño máximo (en bytes) de los ficheros cuyo resumen se calcula con todo su contenido. De los ficheros mayores
+(las imágenes) se resumen los primeros TAM_CABECERA bytes, que contienen la cabecera, y NUM_MUESTRAS bloques de
+TAM_MUESTRA bytes repartidos uniformemente por el resto del fichero (el último incluye el final del fichero).
+"""
+TAM_COMPLETO=1<<20
+TAM_CABECERA=1<<16
+NUM_MUESTRAS=64
+TAM_MUESTRA=1<<12
+
+"""
+Módulos comunes de los que dependen los resultados de todas las rutinas (ajuste, lectura de las imágenes,
+día juliano y combinación de imágenes). Al cambiar su código se invalidan los resultados guardados.
+"""
+DEPENDENCIAS=["AjusteLote","AccesoFrames","CatalogoCabeceras","CombinacionFrames"]
+
+"""
+Huellas ya calculadas en el proceso, por ruta, tamaño y fecha de modificación, para no volver a leer
+las imágenes de referencia en cada tarea
+"""
+_huellas={}
+
+"""
+Funcion que devuelve el resumen MD5 del contenido de un fichero: de todo el contenido si no supera TAM_COMPLETO
+bytes, y en otro caso de la cabecera y de una muestra de los datos (ver TAM_COMPLETO)
+"""
+def resumen(rutaFich):
+    resumenFich=hashlib.md5()
+    tamanio=os.path.getsize(rutaFich)
+    infile=open(rutaFich,'rb')
+    if tamanio<=TAM_COMPLETO:
+        bloque=infile.read(TAM_BLOQUE)
+        while bloque:
+            resumenFich.update(bloque)
+            bloque=infile.read(TAM_BLOQUE)
+    else:
+        resumenFich.update(infile.read(TAM_CABECERA))
+        for i in range(NUM_MUESTRAS):
+            infile.seek(TAM_CABECERA+(tamanio-TAM_CABECERA-TAM_MUESTRA)*i//(NUM_MUESTRAS-1))
+            resumenFich.update(infile.read(TAM_MUESTRA))
+    infile.close()
+    return resumenFich.hexdigest()
+
+"""
+Funcion que devuelve la huella de un fichero: tamaño, fecha de modificación y resumen MD5 del contenido
+"""
+def huella(rutaFich):
+    estado=os.stat(rutaFich)
+    clave=(os.path.abspath(rutaFich),estado.st_size,estado.st_mtime)
+    if clave not in _huellas:
+        _huellas[clave]=(estado.st_size,repr(estado.st_mtime),resumen(rutaFich))
+    return _huellas[clave]
+
+"""
+Funcion que devuelve el fichero fuente del módulo en el que está definida una función
+"""
+def getFuente(funcion):
+    fichero=sys.modules[funcion.__module__].__file__
+    if fichero.endswith(".pyc") or fichero.endswith(".pyo"):
+        fichero=fichero[:-1]
+    return fichero
+
+"""
+Funcion que devuelve los ficheros fuente de los módulos de DEPENDENCIAS, que están en el mismo directorio que este
+"""
+def getFuentesDependencias():
+    directorio=os.path.dirname(os.path.abspath(getFuente(getFuentesDependencias)))
+    return [os.path.join(directorio,modulo+".py") for modulo in DEPENDENCIAS]
+
+"""
+Funcion que calcula la clave de un resultado a partir de la función, de la huella de los ficheros
+de entrada, del código de la función y de los módulos comunes, y de los argumentos con los que se llama
+"""
+def getClave(funcion, entradas, args):
+    ficheros=list(entradas)+[getFuente(funcion)]+getFuentesDependencias()
+    descripcion=(VERSION_CACHE,funcion.__module__,funcion.__name__,
+                 [(os.path.normpath(f),huella(f)) for f in ficheros],args)
+    return hashlib.md5(repr(descripcion)).hexdigest()
+
+"""
+Funcion que devuelve el nombre del fichero donde se guarda el resultado de una clave
+"""
+def getFicheroCache(clave):
+    return os.path.join(DIR_CACHE,clave+".pkl")
+
+"""
+Funcion que lee el resultado guardado de una clave. Devuelve None si no existe o no se puede leer.
+"""
+def leerResultado(clave):
+    fichero=getFicheroCache(clave)
+    if not os.path.exists(fichero):
+        return None
+    try:
+        infile=open(fichero,'rb')
+        try:
+            return cPickle.load(infile)
+        finally:
+            infile.close()
+    except Exception:
+        return None
+
+"""
+Funcion que guarda el resultado de una clave: el valor devuelto y el contenido de los ficheros de salida.
+Se escribe en un fichero temporal que después se renombra, para que otro proceso nunca lea
+un resultado a medio escribir.
+"""
+def guardarResultado(clave, valor, salidas):
+    if not os.path.isdir(DIR_CACHE):
+        try:
+            os.makedirs(DIR_CACHE)
+        except OSError:
+            # Otro proceso lo ha creado a la vez
+            pass
+    ficheros={}
+    for salida in salidas:
+        infile=open(salida,'rb')
+        ficheros[salida]=infile.read()
+        infile.close()
+    fichero=getFicheroCache(clave)
+    temporal=fichero+"."+str(os.getpid())
+    outfile=open(temporal,'wb')
+    cPickle.dump({'valor':valor, 'salidas':ficheros},outfile,cPickle.HIGHEST_PROTOCOL)
+    outfile.close()
+    os.rename(temporal,fichero)
+
+"""
+Funcion que escribe los ficheros de salida de un resultado guardado que no existan o hayan cambiado
+"""
+def restaurarSalidas(resultado):
+    for salida,contenido in resultado['salidas'].items():
+        if os.path.exists(salida):
+            infile=open(salida,'rb')
+            igual=infile.read()==contenido
+            infile.close()
+            if igual:
+                continue
+        outfile=open(salida,'wb')
+        outfile.write(contenido)
+        outfile.close()
+
+"""
+Funcion que devuelve una tupla con el valor guardado de funcion(*args), si los ficheros de entrada no han
+cambiado, y escribe sus ficheros de salida. Si no está en la caché devuelve None. Se utiliza cuando el valor
+se calcula fuera de ejecutar (por ejemplo, a partir de una imagen leída por adelantado) y se guarda con guardar.
+"""
+def consultar(funcion, entradas, *args):
+    if not USAR_CACHE:
+        return None
+    resultado=leerResultado(getClave(funcion,entradas,args))
+    if resultado is None:
+        return None
+    restaurarSalidas(resultado)
+    Instrumentacion.contar('cacheAciertos')
+    return (resultado['valor'],)
+
+"""
+Funcion que guarda en la caché el valor de funcion(*args) calculado fuera de ejecutar
+"""
+def guardar(funcion, entradas, salidas, valor, *args):
+    if USAR_CACHE:
+        guardarResultado(getClave(funcion,entradas,args),valor,salidas)
+        Instrumentacion.contar('cacheFallos')
+
+"""
+Funcion que ejecuta funcion(*args) reutilizando el resultado guardado si los ficheros de entrada
+no han cambiado. Se recibe por parámetros:
+- funcion: función que se ejecuta
+- entradas: lista de ficheros de los que depende el resultado (además del código de la función)
+- salidas: lista de ficheros que escribe la función y que se guardan junto con el resultado
+- args: argumentos de la función
+Devuelve el valor devuelto por la función.
+"""
+def ejecutar(funcion, entradas, salidas, *args):
+    guardado=consultar(funcion,entradas,*args)
+    if guardado is not None:
+        return guardado[0]
+    valor=funcion(*args)
+    guardar(funcion,entradas,salidas,valor,*args)
+    return valor
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Catálogo de cabeceras.
+Objetivo: Leer una única vez la cabecera primaria de cada fichero .fits de una noche y
+          almacenar en una tabla el nombre del fichero, su tipo, el tiempo de exposición,
+          la fecha y el día juliano. El catálogo se guarda en el propio directorio de la noche
+          junto con el tamaño y la fecha de modificación de cada fichero, de modo que en las
+          siguientes ejecuciones solo se vuelven a leer los ficheros nuevos o modificados.
+"""
+
+import numpy as np
+import os.path
+from os import listdir
+import Instrumentacion
+
+"""
+Nombre del fichero donde se almacena el catálogo dentro del directorio de la noche
+"""
+FICH_CATALOGO="catalogo_cabeceras.txt"
+
+"""
+Columnas de la tabla del catálogo:
+- fichero: nombre del fichero dentro del directorio
+- tipo: tipo del fichero obtenido de la cabecera OBJECT ([arc], [flat], [Bias] o [science])
+- exptime: tiempo de exposición
+- date: fecha de la cabecera DATE
+- juldate: día juliano obtenido a partir de DATE
+- tamanio y mtime: tamaño y fecha de modificación del fichero cuando se leyó su cabecera
+Las longitudes de los campos de texto son las mínimas: si algún valor es más largo, el campo se amplía
+(ver crearCatalogo), de modo que nunca se recorta el nombre de un fichero.
+"""
+TIPO_CATALOGO=np.dtype([('fichero','S64'),('tipo','S16'),('exptime','f8'),('date','S32'),
+                        ('juldate','f8'),('tamanio','i8'),('mtime','f8')])
+
+"""
+Funcion que crea la tabla del catálogo a partir de sus filas, ampliando los campos de texto de TIPO_CATALOGO
+hasta la longitud del valor más largo
+"""
+def crearCatalogo(filas):
+    filas=list(filas)
+    campos=[]
+    for i,nombre in enumerate(TIPO_CATALOGO.names):
+        tipo=TIPO_CATALOGO[nombre]
+        if tipo.kind=='S':
+            tipo=np.dtype('S'+str(max([tipo.itemsize]+[len(fila[i]) for fila in filas])))
+        campos.append((nombre,tipo))
+    return np.array(filas,dtype=campos)
+
+"""
+Catálogos ya cargados en memoria, indexados por directorio
+"""
+_catalogos={}
+
+"""
+Funcion que obtiene el tipo de fichero a partir del valor de la cabecera OBJECT.
+Si comienza por corchete el tipo es lo que hay hasta el corchete de cierre, en otro caso es ciencia.
+"""
+def getTipo(objeto):
+    if len(objeto)>0 and objeto[0]=='[':
+        tipo=objeto[:objeto.index(']')+1]
+    else:
+        tipo='[science]'
+    return tipo
+
+"""
+Funcion que obtiene el día juliano a partir del valor de la cabecera DATE
+"""
+def fechaJuliana(date):
+    import astropy.time
+    from dateutil import parser
+    dt = parser.parse(date)
+    time = astropy.time.Time(dt)
+    return time.jd
+
+"""
+Funcion que lee la cabecera primaria de un fichero y devuelve su fila en el catálogo
+"""
+def leerCabecera(rutaFich):
+    from astropy.io import fits
+    cabecera=fits.getheader(rutaFich,0)
+    Instrumentacion.contar('cabecerasLeidas')
+    estado=os.stat(rutaFich)
+    objeto=str(cabecera.get("OBJECT",""))
+    date=str(cabecera.get("DATE",""))
+    exptime=cabecera.get("EXPTIME")
+    if exptime is None:
+        exptime=np.nan
+    if len(date)>0:
+        juldate=fechaJuliana(date)
+    else:
+        juldate=np.nan
+    return (os.path.basename(rutaFich),getTipo(objeto),float(exptime),date,juldate,estado.st_size,estado.st_mtime)
+
+"""
+Funcion que carga el catálogo almacenado en el fichero del directorio.
+Devuelve un diccionario con la fila de cada fichero, o un diccionario vacío si no existe.
+"""
+def cargarCatalogo(directorio):
+    filas={}
+    fichero=os.path.join(directorio,FICH_CATALOGO)
+    if os.path.exists(fichero):
+        infile=open(fichero,'r')
+        for line in infile:
+            #Ignoramos las lineas que comiencen por @, puesto que se trata de un comentario en el fichero
+            if line[0]!='@':
+                campo=line.rstrip("\n").split(",")
+                filas[campo[0]]=(campo[0],campo[1],float(campo[2]),campo[3],float(campo[4]),int(campo[5]),float(campo[6]))
+        infile.close()
+    return filas
+
+"""
+Funcion que escribe el catálogo en el fichero del directorio. Se escribe en un fichero temporal propio del proceso
+que después se renombra, para que una ejecución interrumpida u otro proceso (la vigilancia o el reprocesado por
+lotes) nunca dejen ni lean un catálogo a medio escribir.
+"""
+def guardarCatalogo(directorio, catalogo):
+    fichero=os.path.join(directorio,FICH_CATALOGO)
+    temporal=fichero+"."+str(os.getpid())
+    outfile=open(temporal,"w")
+    outfile.write("@fichero,tipo,exptime,date,juldate,tamanio,mtime\n")
+    for fila in catalogo:
+        outfile.write(fila['fichero']+","+fila['tipo']+","+repr(float(fila['exptime']))+","+fila['date']+","+
+                      repr(float(fila['juldate']))+","+str(fila['tamanio'])+","+repr(float(fila['mtime']))+"\n")
+    outfile.close()
+    os.rename(temporal,fichero)
+
+"""
+Funcion que devuelve el catálogo de cabeceras de los ficheros .fits de un directorio.
+Se reutilizan las filas almacenadas de los ficheros cuyo tamaño y fecha de modificación no han cambiado,
+y solo se lee la cabecera de los ficheros nuevos o modificados. Si hay cambios se vuelve a guardar el catálogo.
+Los ficheros aparecen en el mismo orden en el que los devuelve listdir.
+"""
+def getCatalogo(directorio):
+    guardadas=cargarCatalogo(directorio)
+    filas=[]
+    cambios=False
+    for fichero in listdir(directorio):
+        rutaFich=directorio+"/"+fichero
+        if os.path.isfile(rutaFich) and fichero.endswith(".fits"):
+            estado=os.stat(rutaFich)
+            fila=guardadas.pop(fichero,None)
+            if fila is None or fila[5]!=estado.st_size or fila[6]!=estado.st_mtime:
+                fila=leerCabecera(rutaFich)
+                cambios=True
+            filas.append(fila)
+    # Si ha desaparecido algún fichero también hay que actualizar el catálogo
+    if cambios or len(guardadas)>0 or not os.path.exists(os.path.join(directorio,FICH_CATALOGO)):
+        catalogo=crearCatalogo(filas)
+        guardarCatalogo(directorio,catalogo)
+    else:
+        catalogo=crearCatalogo(filas)
+    _catalogos[os.path.normpath(directorio)]=catalogo
+    return catalogo
+
+"""
+Funcion que lee la cabecera de un único fichero nuevo o modificado y la añade al catálogo de su directorio,
+sin revisar el resto de ficheros. Devuelve la fila del fichero en el catálogo.
+"""
+def actualizarFichero(rutaFich):
+    directorio=os.path.normpath(os.path.dirname(rutaFich) or ".")
+    nombre=os.path.basename(rutaFich)
+    if directorio in _catalogos:
+        filas=[tuple(fila) for fila in _catalogos[directorio]]
+    else:
+        filas=cargarCatalogo(directorio).values()
+    filas=[fila for fila in filas if fila[0]!=nombre]
+    filas.append(leerCabecera(rutaFich))
+    catalogo=crearCatalogo(filas)
+    guardarCatalogo(directorio,catalogo)
+    _catalogos[directorio]=catalogo
+    return catalogo[-1]
+
+"""
+Funcion que devuelve la lista de rutas de los ficheros de un tipo determinado ([arc], [flat], [Bias]...)
+"""
+def getFicheros(directorio, tipo):
+    catalogo=getCatalogo(directorio)
+    return [directorio+"/"+fila['fichero'] for fila in catalogo if fila['tipo']==tipo]
+
+"""
+Funcion que busca un fichero en un catálogo y devuelve su fila si su tamaño y fecha de modificación no han cambiado,
+o None en otro caso
+"""
+def buscarEntrada(catalogo, rutaFich, nombre):
+    indice=np.where(catalogo['fichero']==nombre)[0]
+    if len(indice)==0:
+        return None
+    fila=catalogo[indice[0]]
+    estado=os.stat(rutaFich)
+    if fila['tamanio']!=estado.st_size or fila['mtime']!=estado.st_mtime:
+        return None
+    return fila
+
+"""
+Funcion que devuelve la fila del catálogo correspondiente a un fichero.
+Si el fichero no está en el catálogo cargado en memoria se busca en el catálogo almacenado en el directorio, que
+puede haber escrito otro proceso (por ejemplo, los procesos del planificador se crean antes de que la rutina master
+obtenga el catálogo de la noche). Solo si tampoco está, o el fichero ha cambiado, se lee directamente su cabecera.
+"""
+def getEntrada(rutaFich):
+    directorio=os.path.normpath(os.path.dirname(rutaFich) or ".")
+    nombre=os.path.basename(rutaFich)
+    if directorio in _catalogos:
+        fila=buscarEntrada(_catalogos[directorio],rutaFich,nombre)
+        if fila is not None:
+            return fila
+    guardadas=cargarCatalogo(directorio)
+    if len(guardadas)>0:
+        _catalogos[directorio]=crearCatalogo(guardadas.values())
+        fila=buscarEntrada(_catalogos[directorio],rutaFich,nombre)
+        if fila is not None:
+            return fila
+    return crearCatalogo([leerCabecera(rutaFich)])[0]
+
+"""
+Funcion que obtiene el día juliano de una imagen fit a partir del catálogo
+"""
+def getDiaJuliano(rutaFich):
+    return float(getEntrada(rutaFich)['juldate'])
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Combinación de imágenes.
+Objetivo: Combinar píxel a píxel una lista de imágenes (por ejemplo los flats de una noche) en una imagen
+          master. Las imágenes se recorren a la vez por bloques de filas (ver AccesoFrames.leerBloques), de modo
+          que la memoria necesaria no depende del número de imágenes.
+          Las imágenes se combinan con la mediana ("mediana") o con la media después de descartar de forma
+          iterativa los valores que se alejan de la mediana más de RECORTE_SIGMA desviaciones típicas ("sigma").
+"""
+
+import os
+import numpy as np
+import AccesoFrames
+
+"""
+Métodos de combinación
+"""
+METODOS=("mediana","sigma")
+
+"""
+Número de desviaciones típicas a partir del cual se descarta un valor y número máximo de iteraciones
+de la combinación con descarte de valores ("sigma")
+"""
+RECORTE_SIGMA=3.
+ITERACIONES_RECORTE=3
+
+"""
+Funcion que devuelve la mediana de una pila de imágenes (imágenes x filas x columnas). Da el mismo resultado
+que np.median, pero ordenar la pila es más rápido que la selección parcial de np.median a lo largo del primer eje.
+"""
+def mediana(pila):
+    ordenados=np.sort(pila,axis=0)
+    return (ordenados[(len(pila)-1)//2]+ordenados[len(pila)//2])/2.
+
+"""
+Funcion que devuelve la mediana de una pila de imágenes (imágenes x filas x columnas) sin tener en cuenta los
+valores descartados (NaN). Se ordena la pila, de modo que los NaN quedan al final, y se toman los valores
+centrales de los válidos de cada píxel.
+"""
+def medianaValidos(datos):
+    ordenados=np.sort(datos,axis=0)
+    validos=np.sum(~np.isnan(datos),axis=0)[np.newaxis]
+    bajo=np.take_along_axis(ordenados,(validos-1)//2,axis=0)[0]
+    alto=np.take_along_axis(ordenados,validos//2,axis=0)[0]
+    return (bajo+alto)/2.
+
+"""
+Funcion que devuelve los valores que se descartan de una pila de imágenes (con NaN en los ya descartados): los que
+se alejan de la mediana de su píxel más del umbral indicado. Con un número par de valores la mediana es la media de
+los dos centrales, que pueden alejarse ambos de ella más del umbral (por ejemplo con dos bias y un rayo cósmico);
+si se descartarían todos los valores de un píxel, no se descarta ninguno.
+"""
+def getDescartes(datos, centro, umbral):
+    descartar=np.abs(datos-centro)>umbral
+    return descartar&~np.all(descartar|np.isnan(datos),axis=0)
+
+"""
+Funcion que calcula la media y la desviación típica (muestral) de cada píxel de una pila de imágenes después de
+descartar los valores que se alejan de la mediana más de recorte desviaciones típicas. Se repite hasta que no se
+descarta ningún valor o hasta un máximo de iteraciones. Nunca se descartan todos los valores de un píxel (ver
+getDescartes), por lo que cada píxel tiene al menos un valor válido (con un único valor la desviación típica es NaN).
+Con pocas imágenes un valor anómalo aumenta tanto la desviación típica del píxel que no se llega a descartar, por lo
+que opcionalmente se indica la desviación típica esperada (sigmaFija, por ejemplo el ruido de lectura), que se
+utiliza en lugar de la de cada píxel para descartar los valores.
+Después de la primera iteración solo se repite el cálculo en los píxeles en los que se ha descartado algún valor,
+ya que en el resto la media y la desviación típica son las de todos los valores.
+"""
+def estadisticasRecortadas(pila, recorte=RECORTE_SIGMA, iteraciones=ITERACIONES_RECORTE, sigmaFija=None):
+    numValores=len(pila)
+    sigma=np.std(pila,axis=0)
+    descartar=getDescartes(pila,mediana(pila),recorte*(sigma if sigmaFija is None else sigmaFija))
+    pixeles=np.any(descartar,axis=0)
+    media=np.mean(pila,axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        desviacion=sigma*np.sqrt(numValores/(numValores-1.)) if numValores>1 else sigma*np.nan
+        if not np.any(pixeles):
+            return media,desviacion
+        datos=pila[:,pixeles]
+        datos[descartar[:,pixeles]]=np.nan
+        for iteracion in range(iteraciones-1):
+            descartar=getDescartes(datos,medianaValidos(datos),recorte*(np.nanstd(datos,axis=0) if sigmaFija is None else sigmaFija))
+            if not np.any(descartar):
+                break
+            datos[descartar]=np.nan
+        validos=np.sum(~np.isnan(datos),axis=0)
+        media[pixeles]=np.nanmean(datos,axis=0)
+        desviacion[pixeles]=np.where(validos>1,np.nanstd(datos,axis=0)*np.sqrt(validos/np.maximum(validos-1.,1.)),np.nan)
+    return media,desviacion
+
+"""
+Funcion que combina una pila de imágenes con la media después de descartar los valores que se alejan de la
+mediana más de recorte desviaciones típicas (ver estadisticasRecortadas)
+"""
+def mediaRecortada(pila, recorte=RECORTE_SIGMA, iteraciones=ITERACIONES_RECORTE):
+    return estadisticasRecortadas(pila,recorte,iteraciones)[0]
+
+"""
+Funcion que combina una pila de imágenes (imágenes x filas x columnas) con el método indicado
+"""
+def combinarPila(pila, metodo):
+    if metodo=="mediana":
+        return mediana(pila)
+    return mediaRecortada(pila)
+
+"""
+Funcion que combina una lista de imágenes .fits con el método indicado, recorriéndolas por bloques de filas.
+Opcionalmente se indica la memoria máxima (en MB) de cada bloque (por defecto AccesoFrames.MEMORIA_BLOQUE).
+Devuelve la imagen combinada (NAXIS2 x NAXIS1, con la misma orientación que en el fichero).
+"""
+def combinar(ficheros, metodo, memoriaMaxima=None):
+    if metodo not in METODOS:
+        raise ValueError("Método de combinación desconocido: "+str(metodo)+" (debe ser "+" o ".join(METODOS)+")")
+    bloques=[combinarPila(pila,metodo) for inicio,fin,pila in AccesoFrames.leerBloques(ficheros,memoriaMaxima)]
+    return np.concatenate(bloques)
+
+"""
+Funcion que escribe una imagen combinada en un fichero .fits con la cabecera de la primera imagen de la lista
+(de la que se toman la fecha y el tipo de imagen), indicando el número de imágenes combinadas y el método.
+Se escribe en un fichero temporal que después se renombra, para que nunca se lea un fichero a medio escribir.
+"""
+def escribir(rutaFich, master, ficheros, metodo):
+    from astropy.io import fits
+    cabecera=fits.getheader(ficheros[0])
+    for clave in ("BSCALE","BZERO"):
+        cabecera.remove(clave,ignore_missing=True)
+    cabecera['NCOMBINE']=(len(ficheros),"Numero de imagenes combinadas")
+    cabecera['COMBMETH']=(metodo,"Metodo de combinacion")
+    temporal=rutaFich+".tmp"
+    # Los datos se escriben como reales de 32 bits big-endian, que es el formato del fichero, de modo que una
+    # imagen proyectada en memoria con ese tipo se escribe sin copiarla
+    fits.PrimaryHDU(np.asarray(master,dtype='>f4'),header=cabecera).writeto(temporal,overwrite=True)
+    os.rename(temporal,rutaFich)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Cubo de historial.
+Objetivo: Guardar en un único fichero binario los resultados de todas las imágenes de todas las noches
+          (los spots de cada arco o el ajuste de los ordenes de cada flat), para poder obtener la evolución
+          de cualquier spot u orden a lo largo de las noches sin volver a leer los ficheros de cada noche.
+          Cada cubo es un directorio con los ficheros:
+          - tipo.npy: array vacío con el tipo de las filas del cubo.
+          - datos.dat: una fila por imagen con su día juliano (juldateImagen), el nombre del fichero y, por cada campo
+            de los resultados, la columna completa de la imagen (igual que en ResultadosNoche).
+            Las filas de cada noche se añaden al final del fichero y se lee con memory mapping.
+          - indice.txt: una linea por cada noche añadida con la noche, la primera fila y el número de filas.
+          Si se vuelve a añadir una noche solo cuenta su última entrada del índice; las filas anteriores
+          se ignoran en las consultas y se eliminan al compactar el cubo.
+          Las noches se añaden desde un único proceso (la rutina master, la vigilancia o, al final del
+          reprocesado por lotes, el proceso principal), por lo que no se bloquea el fichero.
+SINTAXIS: python CuboHistorial.py [-c] spots|ordenes
+          Reconstruye el cubo a partir de los ficheros de resultados existentes, o lo compacta con -c.
+"""
+
+import sys
+import os
+import os.path
+import numpy as np
+import ResultadosNoche
+
+"""
+Nombres de los ficheros de cada cubo
+"""
+FICH_TIPO="tipo.npy"
+FICH_DATOS="datos.dat"
+FICH_INDICE="indice.txt"
+
+"""
+Funcion que devuelve el tipo de las filas de un cubo a partir del tipo y del número de filas de los
+resultados de una imagen: día juliano de la imagen más la fila de ResultadosNoche, con la longitud
+indicada para el nombre del fichero
+"""
+def getTipoCubo(tipoResultado, numFilas, longitud=64):
+    return np.dtype([('juldateImagen',np.float64)]+ResultadosNoche.getTipoNoche(tipoResultado,numFilas,longitud).descr)
+
+"""
+Funcion que devuelve el tipo en el que se pueden guardar sin pérdidas las filas de dos tipos de cubo
+(por ejemplo intensidades enteras y reales, o nombres de fichero más largos), o None si no tienen los
+mismos campos con las mismas dimensiones
+"""
+def getTipoComun(tipo, tipoNuevo):
+    if tipo.names!=tipoNuevo.names:
+        return None
+    campos=[]
+    for nombre in tipo.names:
+        base,baseNueva=tipo[nombre].base,tipoNuevo[nombre].base
+        if tipo[nombre].shape!=tipoNuevo[nombre].shape or (base.kind=='S')!=(baseNueva.kind=='S'):
+            return None
+        campos.append((nombre,np.promote_types(base,baseNueva),tipo[nombre].shape))
+    return np.dtype(campos)
+
+"""
+Funcion que devuelve el tipo de las filas de un cubo, o None si el cubo no existe
+"""
+def getTipo(directorio):
+    fichero=os.path.join(directorio,FICH_TIPO)
+    if not os.path.exists(fichero):
+        return None
+    return np.load(fichero).dtype
+
+"""
+Funcion que devuelve el número de filas completas del fichero de datos de un cubo
+"""
+def getNumFilas(directorio, tipo):
+    fichero=os.path.join(directorio,FICH_DATOS)
+    if not os.path.exists(fichero):
+        return 0
+    return os.path.getsize(fichero)//tipo.itemsize
+
+"""
+Funcion que lee el índice de un cubo y devuelve un diccionario con la primera fila y el número
+de filas de cada noche. Si una noche aparece varias veces se toma la última.
+"""
+def leerIndice(directorio):
+    indice={}
+    fichero=os.path.join(directorio,FICH_INDICE)
+    if os.path.exists(fichero):
+        infile=open(fichero,'r')
+        for line in infile:
+            campo=line.strip().split(",")
+            #Ignoramos las lineas que comiencen por @, puesto que se trata de un comentario en el fichero
+            if len(campo)==3 and campo[0][0]!='@':
+                indice[campo[0]]=(int(campo[1]),int(campo[2]))
+        infile.close()
+    return indice
+
+"""
+Funcion que abre con memory mapping los datos de un cubo. Devuelve un array vacío si no tiene datos
+y None si el cubo no existe.
+"""
+def abrir(directorio):
+    tipo=getTipo(directorio)
+    if tipo is None:
+        return None
+    numFilas=getNumFilas(directorio,tipo)
+    if numFilas==0:
+        return np.zeros(0,dtype=tipo)
+    return np.memmap(os.path.join(directorio,FICH_DATOS),dtype=tipo,mode='r',shape=(numFilas,))
+
+"""
+Funcion que escribe el tipo de un cubo nuevo
+"""
+def crearCubo(directorio, tipo):
+    if not os.path.isdir(directorio):
+        os.makedirs(directorio)
+    outfile=open(os.path.join(directorio,FICH_TIPO),'wb')
+    np.save(outfile,np.zeros(0,dtype=tipo))
+    outfile.close()
+    outfile=open(os.path.join(directorio,FICH_INDICE),'w')
+    outfile.write("@noche,inicio,numero\n")
+    outfile.close()
+
+"""
+Funcion que añade al cubo las imágenes de una noche. Se recibe la lista de ficheros, la lista con el
+día juliano de cada uno y la lista con sus resultados (arrays estructurados con el mismo tipo y número
+de filas). Si el cubo no existe se crea con el tipo de los resultados. Si los resultados no caben sin
+pérdidas en el tipo del cubo, el cubo se migra antes al tipo común (ver getTipoComun); si no tienen sus
+campos se lanza ValueError. Si la última entrada de la noche en el cubo tiene los mismos datos no se
+añade de nuevo.
+"""
+def anadirNoche(directorio, noche, ficheros, juldates, resultados):
+    if len(resultados)==0:
+        return
+    tipoNuevo=getTipoCubo(resultados[0].dtype,len(resultados[0]),max(len(fichero) for fichero in ficheros))
+    tipo=getTipo(directorio)
+    if tipo is None:
+        crearCubo(directorio,tipoNuevo)
+        tipo=tipoNuevo
+    elif tipo!=tipoNuevo:
+        tipoComun=getTipoComun(tipo,tipoNuevo)
+        if tipoComun is None:
+            raise ValueError("Los resultados de la noche "+noche+" no tienen los campos del cubo "+directorio)
+        if tipoComun!=tipo:
+            migrar(directorio,tipoComun)
+            tipo=tipoComun
+    # Convertimos los resultados al tipo del cubo
+    agrupados=ResultadosNoche.agrupar(ficheros,resultados)
+    datos=np.zeros(len(resultados),dtype=tipo)
+    datos['juldateImagen']=juldates
+    for nombre in agrupados.dtype.names:
+        datos[nombre]=agrupados[nombre]
+    indice=leerIndice(directorio)
+    if noche in indice:
+        inicio,numero=indice[noche]
+        if abrir(directorio)[inicio:inicio+numero].tostring()==datos.tostring():
+            return
+    # Si se interrumpió la escritura de una noche anterior, descartamos la fila incompleta
+    inicio=getNumFilas(directorio,tipo)
+    fichDatos=os.path.join(directorio,FICH_DATOS)
+    if os.path.exists(fichDatos) and os.path.getsize(fichDatos)!=inicio*tipo.itemsize:
+        outfile=open(fichDatos,'r+b')
+        outfile.truncate(inicio*tipo.itemsize)
+        outfile.close()
+    # Primero se escriben los datos y después la entrada del índice, de modo que nunca se consultan filas incompletas
+    outfile=open(fichDatos,'ab')
+    outfile.write(datos.tostring())
+    outfile.close()
+    outfile=open(os.path.join(directorio,FICH_INDICE),'a')
+    outfile.write(noche+","+str(inicio)+","+str(len(datos))+"\n")
+    outfile.close()
+
+"""
+Funcion que devuelve las filas del cubo de las noches entre nocheInicial y nocheFinal (ambas incluidas,
+y sin límite si no se indican), ordenadas por día juliano
+"""
+def getFilas(directorio, nocheInicial=None, nocheFinal=None):
+    cubo=abrir(directorio)
+    if cubo is None:
+        return np.zeros(0,dtype=int)
+    filas=[np.arange(inicio,inicio+numero) for noche,(inicio,numero) in leerIndice(directorio).items()
+           if (nocheInicial is None or noche>=nocheInicial) and (nocheFinal is None or noche<=nocheFinal)]
+    if len(filas)==0:
+        return np.zeros(0,dtype=int)
+    filas=np.concatenate(filas)
+    filas=filas[filas<len(cubo)]
+    return filas[np.argsort(cubo['juldateImagen'][filas],kind='mergesort')]
+
+"""
+Funcion que devuelve la serie temporal de un campo del cubo. Se recibe por parámetros:
+- campo: nombre del campo (por ejemplo posX)
+- columnas: índices de las filas de los resultados (por ejemplo de los spots) que se consultan. Si no se
+  indican se devuelven todas.
+- nocheInicial, nocheFinal: noches entre las que se consulta (ambas incluidas)
+Devuelve el vector con el día juliano de cada imagen y la matriz con los valores, con una fila por
+cada columna consultada y una columna por imagen ordenadas por día juliano (spots x arcos).
+"""
+def serie(directorio, campo, columnas=None, nocheInicial=None, nocheFinal=None):
+    cubo=abrir(directorio)
+    filas=getFilas(directorio,nocheInicial,nocheFinal)
+    if len(filas)==0:
+        return np.zeros(0),np.zeros((0,0))
+    valores=cubo[campo][filas]
+    if columnas is not None:
+        valores=valores[:,columnas]
+    return np.array(cubo['juldateImagen'][filas]),np.moveaxis(valores,0,-1)
+
+"""
+Funcion que vuelve a escribir todas las filas del cubo con un tipo nuevo, conservando el índice.
+Se escribe en un directorio temporal que después sustituye al cubo.
+"""
+def migrar(directorio, tipo):
+    import shutil
+    cubo=abrir(directorio)
+    temporal=directorio.rstrip("/")+".tmp"
+    if os.path.isdir(temporal):
+        shutil.rmtree(temporal)
+    crearCubo(temporal,tipo)
+    datos=np.zeros(len(cubo),dtype=tipo)
+    for nombre in tipo.names:
+        datos[nombre]=cubo[nombre]
+    outfile=open(os.path.join(temporal,FICH_DATOS),'wb')
+    outfile.write(datos.tostring())
+    outfile.close()
+    shutil.copyfile(os.path.join(directorio,FICH_INDICE),os.path.join(temporal,FICH_INDICE))
+    del cubo
+    shutil.rmtree(directorio)
+    os.rename(temporal,directorio)
+
+"""
+Funcion que vuelve a escribir el cubo solo con la última entrada de cada noche, ordenado por noche.
+Se escribe en un directorio temporal que después sustituye al cubo.
+"""
+def compactar(directorio):
+    import shutil
+    cubo=abrir(directorio)
+    if cubo is None:
+        return
+    indice=leerIndice(directorio)
+    temporal=directorio.rstrip("/")+".tmp"
+    if os.path.isdir(temporal):
+        shutil.rmtree(temporal)
+    crearCubo(temporal,cubo.dtype)
+    outfile=open(os.path.join(temporal,FICH_DATOS),'wb')
+    lineas=[]
+    fila=0
+    for noche in sorted(indice):
+        inicio,numero=indice[noche]
+        outfile.write(cubo[inicio:inicio+numero].tostring())
+        lineas.append(noche+","+str(fila)+","+str(numero)+"\n")
+        fila=fila+numero
+    outfile.close()
+    outfile=open(os.path.join(temporal,FICH_INDICE),'a')
+    outfile.write("".join(lineas))
+    outfile.close()
+    del cubo
+    shutil.rmtree(directorio)
+    os.rename(temporal,directorio)
+
+
+if __name__=="__main__":
+    import Rutina01_v01
+    import Rutina02_v01
+    cubos={'spots':(Rutina01_v01.DIR_CUBO,Rutina01_v01.reconstruirCubo),
+           'ordenes':(Rutina02_v01.DIR_CUBO,Rutina02_v01.reconstruirCubo)}
+    parametros=sys.argv[1:]
+    compactarCubo=len(parametros)>0 and parametros[0]=="-c"
+    if compactarCubo:
+        parametros=parametros[1:]
+    if len(parametros)==1 and parametros[0] in cubos:
+        directorio,reconstruir=cubos[parametros[0]]
+        if getTipo(directorio) is None:
+            print "El cubo "+directorio+" no existe"
+        elif compactarCubo:
+            compactar(directorio)
+            print "Cubo "+directorio+" compactado"
+        else:
+            reconstruir()
+    else:
+        print "SINTAXIS: python CuboHistorial.py [-c] "+"|".join(sorted(cubos))
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Historial de las noches.
+Objetivo: Almacenar las entradas de los ficheros Master de las rutinas (una por noche) en una base de datos
+          SQLite indexada por el día juliano, en lugar de recorrer el fichero de texto completo cada vez que
+          se comprueba si existe una noche o se pinta el historial de los últimos 180 días.
+          Cada fichero Master (por ejemplo ./Rut04_dat/bias_master.txt) tiene su base de datos en el mismo
+          directorio y con el mismo nombre, pero con extensión .db (./Rut04_dat/bias_master.db).
+          La primera columna (el día juliano) es la clave: al guardar una noche que ya existe se sustituye
+          su entrada. El fichero Master de texto se vuelve a escribir, ordenado por día juliano, para que se
+          pueda seguir consultando directamente, pero no en cada cambio: los ficheros Master modificados se
+          exportan una sola vez al terminar cada tarea o etapa del planificador, antes de lanzar un plot y al
+          terminar el proceso (ver exportarPendientes).
+          La primera vez que se abre el historial de un fichero Master que ya existe se importan sus entradas.
+          También se pueden importar a mano los ficheros Master existentes (si una noche está repetida en
+          el fichero se conserva la primera entrada, igual que hacían las rutinas).
+SINTAXIS: python HistorialNoches.py [fichMaster1 fichMaster2 ...]
+          Sin parámetros se importan todos los ficheros ./Rut0X_dat/*_master.txt y ./Rut03_dat/log_snr.txt
+"""
+
+import sys
+import os
+import os.path
+import glob
+import atexit
+import sqlite3
+import numpy as np
+
+"""
+Nombre de la tabla donde se almacenan las entradas de cada historial
+"""
+TABLA="historial"
+
+"""
+Tiempo máximo (en segundos) que se espera a que otro proceso libere la base de datos
+"""
+TIEMPO_ESPERA=30.0
+
+"""
+Ficheros Master modificados en el proceso cuyo fichero de texto aún no se ha vuelto a escribir
+"""
+_pendientes=set()
+
+"""
+Funcion que devuelve el nombre de la base de datos del historial de un fichero Master
+"""
+def getFicheroHistorial(fichMaster):
+    return os.path.splitext(fichMaster)[0]+".db"
+
+"""
+Funcion que convierte un valor de un fichero Master de texto en entero o real, si es posible
+"""
+def convertirValor(texto):
+    for tipo in (int,float):
+        try:
+            return tipo(texto)
+        except ValueError:
+            pass
+    return texto
+
+"""
+Funcion que escribe un valor en el fichero Master de texto. Los reales se escriben con repr,
+que es el mismo formato que utilizan las rutinas (str de los reales de numpy).
+"""
+def formatearValor(valor):
+    if isinstance(valor,float):
+        return repr(valor)
+    return str(valor)
+
+"""
+Funcion que crea la tabla del historial con las columnas indicadas. La primera es la clave.
+"""
+def crearTabla(conexion, columnas):
+    definicion=",".join('"'+c+'"' for c in columnas)
+    conexion.execute('CREATE TABLE IF NOT EXISTS '+TABLA+' ('+definicion+', PRIMARY KEY ("'+columnas[0]+'"))')
+
+"""
+Funcion que devuelve las columnas de la tabla del historial, o None si la tabla todavía no existe
+"""
+def getColumnas(conexion):
+    columnas=[fila[1] for fila in conexion.execute('PRAGMA table_info('+TABLA+')')]
+    return columnas or None
+
+"""
+Funcion que añade al historial las entradas de un fichero Master de texto, sin sustituir
+las noches que ya existan. Si la tabla no existe se crea con las columnas de la cabecera del fichero.
+"""
+def importarFichero(conexion, fichMaster):
+    infile=open(fichMaster,'r')
+    columnas=None
+    filas=[]
+    for line in infile:
+        line=line.strip()
+        if line.startswith('@'):
+            columnas=[c.strip() for c in line[1:].split(',')]
+        elif len(line)>0:
+            filas.append([convertirValor(v.strip()) for v in line.split(',')])
+    infile.close()
+    if getColumnas(conexion) is None:
+        crearTabla(conexion,columnas)
+    columnas=getColumnas(conexion)
+    conexion.executemany('INSERT OR IGNORE INTO '+TABLA+' VALUES ('+",".join("?"*len(columnas))+')',
+                         [f for f in filas if len(f)==len(columnas)])
+    return len(filas)
+
+"""
+Funcion que abre el historial de un fichero Master. Si la tabla no existe, se importan las entradas
+del fichero Master de texto o, si tampoco existe, se crea con las columnas indicadas.
+"""
+def conectar(fichMaster, columnas=None):
+    conexion=sqlite3.connect(getFicheroHistorial(fichMaster),timeout=TIEMPO_ESPERA)
+    conexion.text_factory=str
+    if getColumnas(conexion) is None:
+        with conexion:
+            if os.path.exists(fichMaster):
+                importarFichero(conexion,fichMaster)
+            elif columnas is not None:
+                crearTabla(conexion,columnas)
+    return conexion
+
+"""
+Funcion que importa un fichero Master de texto en su historial. Devuelve el número de entradas leídas.
+"""
+def importarMaster(fichMaster):
+    conexion=conectar(fichMaster)
+    with conexion:
+        n=importarFichero(conexion,fichMaster)
+    exportarMaster(conexion,fichMaster)
+    conexion.close()
+    return n
+
+"""
+Funcion que vuelve a escribir el fichero Master de texto con todas las entradas del historial,
+ordenadas por día juliano. Se escribe en un fichero temporal propio del proceso que después se renombra,
+para que nunca se lea un fichero a medio escribir. Mientras se escribe se bloquea la base de datos, de modo
+que varios procesos (la rutina master, la vigilancia o el reprocesado por lotes) no pueden sustituir el
+fichero por uno con entradas más antiguas que las del último cambio.
+"""
+def exportarMaster(conexion, fichMaster):
+    columnas=getColumnas(conexion)
+    temporal=fichMaster+"."+str(os.getpid())
+    conexion.execute('BEGIN IMMEDIATE')
+    try:
+        outfile=open(temporal,"w")
+        outfile.write("@"+",".join(columnas)+"\n")
+        for fila in conexion.execute('SELECT * FROM '+TABLA+' ORDER BY "'+columnas[0]+'"'):
+            outfile.write(",".join(formatearValor(v) for v in fila)+"\n")
+        outfile.close()
+        os.rename(temporal,fichMaster)
+    finally:
+        conexion.commit()
+
+"""
+Funcion que vuelve a escribir los ficheros Master de texto modificados en el proceso desde la última exportación.
+Se llama al terminar cada tarea y cada etapa del planificador, antes de lanzar un plot y al terminar el proceso.
+"""
+def exportarPendientes():
+    while len(_pendientes)>0:
+        fichMaster=_pendientes.pop()
+        conexion=conectar(fichMaster)
+        exportarMaster(conexion,fichMaster)
+        conexion.close()
+
+atexit.register(exportarPendientes)
+
+"""
+Funcion que devuelve True si existe en el historial una entrada con la clave (día juliano) indicada
+"""
+def existeNoche(fichMaster, noche):
+    if not os.path.exists(getFicheroHistorial(fichMaster)) and not os.path.exists(fichMaster):
+        return False
+    conexion=conectar(fichMaster)
+    columnas=getColumnas(conexion)
+    existe=columnas is not None and conexion.execute('SELECT 1 FROM '+TABLA+' WHERE "'+columnas[0]+'"=?',(noche,)).fetchone() is not None
+    conexion.close()
+    return existe
+
+"""
+Funcion que guarda en el historial varias entradas (listas de valores en el orden de las columnas).
+Si ya existe una entrada con la misma clave se sustituye. El fichero Master de texto se actualiza
+más tarde (ver exportarPendientes).
+"""
+def guardarNoches(fichMaster, columnas, filas):
+    conexion=conectar(fichMaster,columnas)
+    with conexion:
+        conexion.executemany('INSERT OR REPLACE INTO '+TABLA+' VALUES ('+",".join("?"*len(columnas))+')',filas)
+    conexion.close()
+    _pendientes.add(fichMaster)
+
+"""
+Funcion que guarda en el historial la entrada de una noche, sustituyéndola si ya existe
+"""
+def guardarNoche(fichMaster, columnas, fila):
+    guardarNoches(fichMaster,columnas,[fila])
+
+"""
+Funcion que devuelve las columnas y las entradas del historial cuya clave (día juliano) está entre
+jdInicial y jdFinal (ambos incluidos, y sin límite si no se indican), ordenadas por día juliano
+"""
+def leerFilas(fichMaster, jdInicial=None, jdFinal=None):
+    conexion=conectar(fichMaster)
+    columnas=getColumnas(conexion)
+    if columnas is None:
+        conexion.close()
+        return [],[]
+    clave='"'+columnas[0]+'"'
+    condiciones=[]
+    parametros=[]
+    if jdInicial is not None:
+        condiciones.append(clave+'>=?')
+        parametros.append(jdInicial)
+    if jdFinal is not None:
+        condiciones.append(clave+'<=?')
+        parametros.append(jdFinal)
+    consulta='SELECT * FROM '+TABLA
+    if len(condiciones)>0:
+        consulta+=' WHERE '+' AND '.join(condiciones)
+    filas=conexion.execute(consulta+' ORDER BY '+clave,parametros).fetchall()
+    conexion.close()
+    return columnas,filas
+
+"""
+Funcion que devuelve una lista con un array de numpy por cada columna del historial, con las entradas
+entre jdInicial y jdFinal. Se utiliza para pintar el historial de las últimas noches.
+"""
+def leerColumnas(fichMaster, jdInicial=None, jdFinal=None):
+    columnas,filas=leerFilas(fichMaster,jdInicial,jdFinal)
+    if len(filas)==0:
+        return [np.array([]) for c in columnas]
+    return [np.array(valores) for valores in zip(*filas)]
+
+
+if __name__=="__main__":
+    ficheros=sys.argv[1:]
+    if len(ficheros)==0:
+        ficheros=sorted(glob.glob("./Rut0*_dat/*_master.txt"))+glob.glob("./Rut03_dat/log_snr.txt")
+    for fichMaster in ficheros:
+        if os.path.exists(fichMaster):
+            print "Importando "+fichMaster+" en "+getFicheroHistorial(fichMaster)+": "+str(importarMaster(fichMaster))+" entradas"
+        else:
+            print "El fichero "+fichMaster+" no existe"
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Instrumentación de las rutinas.
+Objetivo: Medir el tiempo real, el tiempo de CPU y el pico de memoria (RSS) de cada etapa y de cada
+          fichero procesado, y llevar la cuenta de los ajustes realizados, los ajustes fallidos y los
+          ficheros leídos. Al terminar la noche se escribe un informe en formato JSON en el directorio
+          de trabajo, junto a los directorios RutXX_dat, con el nombre informe_noche.json.
+          Si se define la variable de entorno CAFE_PERFIL=1, además se guarda un perfil de cProfile
+          de cada etapa en el fichero perfil_noche_etapa.prof, que se puede consultar con pstats.
+          Cada proceso lleva su propio registro. Las medidas de las tareas que se ejecutan en los procesos
+          del pool se devuelven al proceso principal junto con el resultado de la tarea (ver Planificador).
+"""
+
+import os
+import time
+import json
+import resource
+import datetime
+import threading
+from contextlib import contextmanager
+
+"""
+Indica si se debe guardar un perfil de cProfile de cada etapa
+"""
+PERFILAR=os.environ.get("CAFE_PERFIL","0")=="1"
+
+"""
+Registro de medidas del proceso:
+- etapas, ficheros y tareas: listas con las medidas de cada etapa, de cada fichero y de cada tarea
+- contadores: número de ajustes, ajustes fallidos, ficheros leídos...
+"""
+_registro={'etapas':[], 'ficheros':[], 'tareas':[], 'contadores':{}}
+
+"""
+Funcion que devuelve el tiempo de CPU (usuario + sistema) consumido por el proceso
+"""
+def tiempoCPU():
+    tiempos=os.times()
+    return tiempos[0]+tiempos[1]
+
+"""
+Funcion que devuelve el pico de memoria residente (RSS) del proceso en MB
+"""
+def memoriaMaxima():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+"""
+Funcion que mide el tiempo real, el tiempo de CPU y el pico de memoria del bloque de código
+que se ejecuta dentro de ella (with Instrumentacion.medir(tipo,nombre):) y añade la medida al registro.
+El tipo indica la lista del registro: 'etapas', 'ficheros' o 'tareas'.
+Los valores adicionales (por ejemplo, la función que procesa el fichero) se añaden a la medida.
+"""
+@contextmanager
+def medir(tipo, nombre, **valores):
+    inicio=time.time()
+    cpu=tiempoCPU()
+    medida={'nombre':nombre, 'pid':os.getpid()}
+    medida.update(valores)
+    try:
+        yield medida
+    finally:
+        medida['tiempo']=round(time.time()-inicio,6)
+        medida['cpu']=round(tiempoCPU()-cpu,6)
+        medida['rssMax']=round(memoriaMaxima(),1)
+        _registro[tipo].append(medida)
+
+"""
+Funcion que añade al registro una medida obtenida fuera de medir (por ejemplo, la de una etapa
+cuyas tareas se han ejecutado en varios procesos)
+"""
+def registrar(tipo, medida):
+    _registro[tipo].append(medida)
+
+"""
+Cerrojo de los contadores, que también se actualizan desde los hilos de lectura anticipada (ver LecturaAnticipada)
+"""
+_cerrojo=threading.Lock()
+
+"""
+Funcion que suma n al contador indicado
+"""
+def contar(contador, n=1):
+    with _cerrojo:
+        _registro['contadores'][contador]=_registro['contadores'].get(contador,0)+int(n)
+
+"""
+Funcion que devuelve el registro del proceso y lo vacía. Se utiliza en los procesos del pool
+para devolver al proceso principal las medidas de cada tarea.
+"""
+def extraer():
+    registro={'etapas':list(_registro['etapas']), 'ficheros':list(_registro['ficheros']),
+              'tareas':list(_registro['tareas']), 'contadores':dict(_registro['contadores'])}
+    reiniciar()
+    return registro
+
+"""
+Funcion que vacía el registro del proceso
+"""
+def reiniciar():
+    for lista in ('etapas','ficheros','tareas'):
+        del _registro[lista][:]
+    _registro['contadores'].clear()
+
+"""
+Funcion que añade al registro del proceso las medidas de otro registro (por ejemplo, el de una tarea)
+"""
+def combinar(registro):
+    for lista in ('etapas','ficheros','tareas'):
+        _registro[lista].extend(registro[lista])
+    for contador,n in registro['contadores'].items():
+        contar(contador,n)
+
+"""
+Funcion que devuelve el nombre del fichero de perfil de una etapa de la noche
+"""
+def getFicheroPerfil(noche, etapa):
+    return "./perfil_"+noche+"_"+etapa+".prof"
+
+"""
+Funcion que escribe el informe JSON de la noche con las medidas del registro del proceso.
+Se recibe por parámetros la noche, el instante de inicio de la ejecución y, opcionalmente,
+otros valores que se añaden al informe (por ejemplo, el número de procesos).
+El tiempo de CPU total incluye el de los procesos hijos que ya han terminado (los del pool).
+Devuelve el nombre del fichero escrito.
+"""
+def escribirInforme(noche, inicio, **valores):
+    tiempos=os.times()
+    informe={'noche':noche,
+             'fecha':datetime.datetime.fromtimestamp(inicio).isoformat(),
+             'total':{'tiempo':round(time.time()-inicio,6), 'cpu':round(sum(tiempos[0:4]),6),
+                      'rssMax':round(memoriaMaxima(),1)}}
+    informe.update(valores)
+    informe['contadores']=dict(_registro['contadores'])
+    informe['etapas']=_registro['etapas']
+    informe['ficheros']=_registro['ficheros']
+    informe['tareas']=_registro['tareas']
+    fichero="./informe_"+noche+".json"
+    outfile=open(fichero,"w")
+    json.dump(informe,outfile,indent=1,sort_keys=True)
+    outfile.write("\n")
+    outfile.close()
+    return fichero
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Lectura anticipada de imágenes.
+Objetivo: Solapar la lectura de las imágenes de una lista con su procesado. Mientras se procesa una imagen,
+          un conjunto de hilos va leyendo las siguientes, de modo que el disco (o el archivo montado por NFS)
+          no está parado durante los ajustes y la CPU no está parada durante las lecturas. Los hilos pasan
+          casi todo el tiempo esperando al disco, y durante la lectura no retienen el GIL, por lo que no
+          compiten con el ajuste de la imagen actual.
+          Se leen como máximo PROFUNDIDAD imágenes por adelantado, y sin superar MEMORIA_MAXIMA MB entre
+          las imágenes leídas pendientes de procesar y la que se está procesando (se estima con el tamaño
+          de cada fichero). Las imágenes se entregan siempre en el orden de la lista, y si falla la lectura
+          de una imagen el error se produce al llegar a ella, igual que sin lectura anticipada.
+          Con la variable de entorno CAFE_LECTURA=0 cada imagen se lee justo antes de procesarla.
+"""
+
+import os
+import os.path
+import collections
+
+"""
+Número de imágenes que se leen por adelantado (y número de hilos de lectura)
+"""
+PROFUNDIDAD=int(os.environ.get("CAFE_LECTURA","2"))
+
+"""
+Memoria máxima (en MB) de las imágenes leídas pendientes de procesar, incluida la que se está procesando
+"""
+MEMORIA_MAXIMA=int(os.environ.get("CAFE_LECTURA_MB","512"))
+
+"""
+Funcion que devuelve el tamaño estimado (en bytes) de una imagen leída: el tamaño del fichero
+"""
+def getTamanio(fichero):
+    try:
+        return os.path.getsize(fichero)
+    except OSError:
+        return 0
+
+"""
+Funcion (generador) que devuelve, en el orden de la lista, cada fichero junto con el resultado de leer(fichero),
+leyendo por adelantado las imágenes siguientes en otros hilos. Se recibe por parámetros:
+- leer: función que lee un fichero y devuelve sus datos
+- ficheros: lista de ficheros
+- profundidad: número máximo de imágenes leídas por adelantado (por defecto PROFUNDIDAD)
+- memoriaMaxima: memoria máxima en MB (por defecto MEMORIA_MAXIMA). Una imagen que por sí sola supera
+  el límite se lee cuando no queda ninguna otra en memoria.
+"""
+def anticipar(leer, ficheros, profundidad=None, memoriaMaxima=None):
+    if profundidad is None:
+        profundidad=PROFUNDIDAD
+    if memoriaMaxima is None:
+        memoriaMaxima=MEMORIA_MAXIMA
+    ficheros=list(ficheros)
+    if profundidad<=0 or len(ficheros)<=1:
+        for fichero in ficheros:
+            yield fichero,leer(fichero)
+        return
+    from multiprocessing.pool import ThreadPool
+    limite=memoriaMaxima*1024*1024
+    pool=ThreadPool(profundidad)
+    # Lecturas lanzadas y pendientes de procesar: (fichero, tamaño, resultado)
+    pendientes=collections.deque()
+    estado={'siguiente':0, 'memoria':0}
+    # Lanza la lectura de las imágenes siguientes mientras no se supere la profundidad ni la memoria
+    def lanzar():
+        while estado['siguiente']<len(ficheros) and len(pendientes)<profundidad:
+            fichero=ficheros[estado['siguiente']]
+            tamanio=getTamanio(fichero)
+            if estado['memoria']>0 and estado['memoria']+tamanio>limite:
+                break
+            pendientes.append((fichero,tamanio,pool.apply_async(leer,(fichero,))))
+            estado['memoria']=estado['memoria']+tamanio
+            estado['siguiente']=estado['siguiente']+1
+    try:
+        while True:
+            lanzar()
+            if len(pendientes)==0:
+                break
+            fichero,tamanio,resultado=pendientes.popleft()
+            datos=resultado.get()
+            # Mientras se procesa esta imagen se leen las siguientes
+            lanzar()
+            yield fichero,datos
+            datos=None
+            estado['memoria']=estado['memoria']-tamanio
+    finally:
+        pool.terminate()
+        pool.join()
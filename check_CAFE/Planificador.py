@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Planificador de etapas.
+Objetivo: Ejecutar las etapas de la rutina master como un pequeño grafo de dependencias.
+          Cada etapa se compone de una lista de tareas independientes (por ejemplo, una por fichero)
+          que se reparten entre los procesos de un pool, y de una función final que se ejecuta
+          en el proceso principal con los resultados de todas sus tareas.
+          Una etapa solo comienza cuando todas las etapas de las que depende han terminado.
+          Cada etapa y cada tarea se miden con Instrumentacion.
+          Con varios procesos se captura la salida de cada etapa (la de su inicio, la de sus tareas en los
+          procesos del pool y la de su función final) y se muestra en el orden de la lista de etapas, de modo
+          que los mensajes de cada rutina aparecen bajo su cabecera igual que en la ejecución en serie.
+"""
+
+import os
+import sys
+import time
+import cProfile
+import pstats
+import StringIO
+import multiprocessing
+import Instrumentacion
+import HistorialNoches
+
+"""
+Tiempo de espera (en segundos) entre cada comprobación del estado de las tareas en curso
+"""
+ESPERA=0.05
+
+"""
+Funcion que crea una etapa del grafo. Se recibe por parámetros:
+- nombre: identificador de la etapa
+- dependencias: lista con los nombres de las etapas que deben terminar antes que esta
+- tareas: función sin parámetros que devuelve la lista de tareas (funcion, argumentos) de la etapa.
+          Se evalúa en el momento de lanzar la etapa, de modo que puede usar los ficheros generados
+          por las etapas anteriores. Las funciones deben estar definidas a nivel de módulo.
+- final: función que recibe la lista de resultados de las tareas, en el mismo orden, y se ejecuta
+         en el proceso principal al terminar todas ellas.
+- inicio: función sin parámetros que se ejecuta en el proceso principal antes de lanzar las tareas.
+"""
+def etapa(nombre, dependencias=[], tareas=None, final=None, inicio=None):
+    return {'nombre':nombre, 'dependencias':list(dependencias), 'tareas':tareas, 'final':final, 'inicio':inicio}
+
+"""
+Funcion que devuelve el fichero .fits que procesa una tarea, o None si no procesa ningún fichero
+"""
+def getFicheroTarea(args):
+    for arg in args:
+        if isinstance(arg,str) and arg.endswith(".fits"):
+            return arg
+    return None
+
+"""
+Funcion que ejecuta una tarea en un proceso del pool y vacía la salida estándar,
+para que los mensajes de la tarea no se queden en el buffer del proceso.
+Se mide la tarea con Instrumentacion y, si se indica un fichero de perfil, se ejecuta con cProfile.
+Si capturar es True, los mensajes de la tarea no se muestran sino que se devuelven junto con el resultado
+(si la tarea falla se muestran antes de propagar el error).
+Devuelve el resultado de la tarea, su tiempo de CPU, el registro de medidas del proceso y los mensajes
+capturados (None si no se capturan).
+"""
+def ejecutarTarea(funcion, args, perfil=None, capturar=False):
+    if capturar:
+        salida=sys.stdout
+        sys.stdout=StringIO.StringIO()
+        try:
+            valor,cpu,registro,texto=ejecutarTarea(funcion,args,perfil)
+            return valor,cpu,registro,sys.stdout.getvalue()
+        except:
+            salida.write(sys.stdout.getvalue())
+            raise
+        finally:
+            sys.stdout=salida
+            sys.stdout.flush()
+    try:
+        fichero=getFicheroTarea(args)
+        if fichero is None:
+            medicion=Instrumentacion.medir('tareas',funcion.__name__)
+        else:
+            medicion=Instrumentacion.medir('ficheros',fichero,funcion=funcion.__name__)
+        with medicion as medida:
+            if perfil is None:
+                valor=funcion(*args)
+            else:
+                perfilador=cProfile.Profile()
+                try:
+                    valor=perfilador.runcall(funcion,*args)
+                finally:
+                    perfilador.dump_stats(perfil)
+        return valor,medida['cpu'],Instrumentacion.extraer(),None
+    finally:
+        # Escribimos los ficheros Master de texto que haya modificado la tarea, ya que los procesos del pool
+        # terminan sin ejecutar las funciones de salida
+        HistorialNoches.exportarPendientes()
+        sys.stdout.flush()
+
+"""
+Funcion que comprueba que las dependencias de todas las etapas existen
+"""
+def comprobarGrafo(etapas):
+    nombres=[e['nombre'] for e in etapas]
+    for e in etapas:
+        for d in e['dependencias']:
+            if d not in nombres:
+                raise ValueError("La etapa "+e['nombre']+" depende de una etapa inexistente: "+d)
+
+"""
+Funcion que ejecuta en el proceso principal una parte de la etapa (inicio, obtención de tareas o final),
+sumando su tiempo de CPU al de la etapa y, si se está perfilando la etapa, guardando su perfil
+"""
+def ejecutarPrincipal(estado, funcion, *args):
+    cpu=Instrumentacion.tiempoCPU()
+    try:
+        if estado['perfil'] is None:
+            return funcion(*args)
+        perfilador=cProfile.Profile()
+        try:
+            return perfilador.runcall(funcion,*args)
+        finally:
+            perfilador.dump_stats(getPerfilParcial(estado))
+    finally:
+        estado['cpu']+=Instrumentacion.tiempoCPU()-cpu
+
+"""
+Funcion que devuelve un nombre nuevo de fichero de perfil parcial para la etapa.
+Los perfiles parciales se combinan en el perfil de la etapa al terminar.
+"""
+def getPerfilParcial(estado):
+    parcial=estado['perfil']+"."+str(len(estado['parciales']))
+    estado['parciales'].append(parcial)
+    return parcial
+
+"""
+Funcion que obtiene las tareas de una etapa y ejecuta su función de inicio.
+Devuelve el estado de la etapa, con el que se mide su duración, y la lista de tareas
+(funcion, argumentos, fichero de perfil).
+"""
+def lanzarEtapa(e, noche=None):
+    estado={'inicio':time.time(), 'cpu':0.0, 'perfil':None, 'parciales':[]}
+    if Instrumentacion.PERFILAR and noche is not None:
+        estado['perfil']=Instrumentacion.getFicheroPerfil(noche,e['nombre'])
+    if e['inicio'] is not None:
+        ejecutarPrincipal(estado,e['inicio'])
+    if e['tareas'] is None:
+        return estado,[]
+    tareas=ejecutarPrincipal(estado,e['tareas'])
+    if estado['perfil'] is None:
+        return estado,[(funcion,args,None) for funcion,args in tareas]
+    return estado,[(funcion,args,getPerfilParcial(estado)) for funcion,args in tareas]
+
+"""
+Funcion que cierra una etapa: añade al registro las medidas de sus tareas, ejecuta su función final
+con los resultados, escribe los ficheros Master de texto modificados (ver HistorialNoches.exportarPendientes),
+registra la medida de la etapa y combina sus perfiles parciales.
+"""
+def terminarEtapa(e, estado, salidas):
+    valores=[]
+    for valor,cpu,registro,texto in salidas:
+        Instrumentacion.combinar(registro)
+        estado['cpu']+=cpu
+        valores.append(valor)
+    if e['final'] is not None:
+        ejecutarPrincipal(estado,e['final'],valores)
+    HistorialNoches.exportarPendientes()
+    Instrumentacion.registrar('etapas',{'nombre':e['nombre'], 'tareas':len(salidas),
+                                        'tiempo':round(time.time()-estado['inicio'],6),
+                                        'cpu':round(estado['cpu'],6),
+                                        'rssMax':round(Instrumentacion.memoriaMaxima(),1)})
+    if estado['perfil'] is not None:
+        parciales=[p for p in estado['parciales'] if os.path.exists(p)]
+        if len(parciales)>0:
+            pstats.Stats(*parciales).dump_stats(estado['perfil'])
+        for parcial in parciales:
+            os.remove(parcial)
+
+"""
+Funcion que ejecuta todas las etapas en el proceso principal, en el orden de la lista
+"""
+def ejecutarSerie(etapas, noche=None):
+    terminadas=set()
+    pendientes=list(etapas)
+    while len(pendientes)>0:
+        # Tomamos la primera etapa de la lista cuyas dependencias hayan terminado
+        listas=[e for e in pendientes if set(e['dependencias'])<=terminadas]
+        if len(listas)==0:
+            raise ValueError("El grafo de etapas contiene un ciclo")
+        e=listas[0]
+        pendientes.remove(e)
+        estado,tareas=lanzarEtapa(e,noche)
+        salidas=[ejecutarTarea(funcion,args,perfil) for funcion,args,perfil in tareas]
+        terminarEtapa(e,estado,salidas)
+        terminadas.add(e['nombre'])
+
+"""
+Funcion que ejecuta en el proceso principal una parte de una etapa capturando sus mensajes, que se añaden
+a la lista de mensajes de la etapa en textos. Devuelve el resultado de la función.
+"""
+def capturarSalida(textos, e, funcion, *args):
+    salida=sys.stdout
+    sys.stdout=StringIO.StringIO()
+    try:
+        return funcion(*args)
+    finally:
+        textos.setdefault(e['nombre'],[]).append(sys.stdout.getvalue())
+        sys.stdout=salida
+
+"""
+Funcion que muestra los mensajes capturados de las etapas terminadas, en el orden de la lista de etapas
+(que es el orden en el que se ejecutan en serie), a partir de la etapa siguiente. Los mensajes de una etapa
+solo se muestran cuando han terminado ella y todas las anteriores. Devuelve el índice de la primera etapa
+cuyos mensajes quedan pendientes. Si todas es True se muestran los de todas las etapas, hayan terminado o no.
+"""
+def mostrarSalidas(etapas, textos, terminadas, siguiente, todas=False):
+    while siguiente<len(etapas) and (todas or etapas[siguiente]['nombre'] in terminadas):
+        sys.stdout.write("".join(textos.pop(etapas[siguiente]['nombre'],[])))
+        siguiente=siguiente+1
+    sys.stdout.flush()
+    return siguiente
+
+"""
+Funcion que ejecuta el grafo de etapas. Si numProcesos es 1 las etapas se ejecutan en serie
+en el proceso principal. En otro caso se crea un pool con numProcesos procesos y se lanzan
+a la vez todas las etapas cuyas dependencias hayan terminado; sus mensajes se capturan y se muestran
+en el mismo orden que en serie (ver mostrarSalidas).
+Si se indica la noche, con CAFE_PERFIL=1 se guarda un perfil de cada etapa (ver Instrumentacion).
+"""
+def ejecutar(etapas, numProcesos, noche=None):
+    comprobarGrafo(etapas)
+    if numProcesos<=1:
+        ejecutarSerie(etapas,noche)
+        return
+    pool=multiprocessing.Pool(numProcesos)
+    try:
+        terminadas=set()
+        pendientes=list(etapas)
+        enCurso=[]
+        # Mensajes capturados de cada etapa e índice de la primera etapa cuyos mensajes no se han mostrado
+        textos={}
+        siguiente=0
+        while len(pendientes)>0 or len(enCurso)>0:
+            # Lanzamos las etapas cuyas dependencias han terminado
+            for e in list(pendientes):
+                if set(e['dependencias'])<=terminadas:
+                    pendientes.remove(e)
+                    estado,tareas=capturarSalida(textos,e,lanzarEtapa,e,noche)
+                    resultados=[pool.apply_async(ejecutarTarea,(funcion,args,perfil,True)) for funcion,args,perfil in tareas]
+                    enCurso.append((e,estado,resultados))
+            if len(enCurso)==0 and len(pendientes)>0:
+                raise ValueError("El grafo de etapas contiene un ciclo")
+            # Cerramos las etapas cuyas tareas han terminado todas
+            avance=False
+            for e,estado,resultados in list(enCurso):
+                if all(r.ready() for r in resultados):
+                    enCurso.remove((e,estado,resultados))
+                    salidas=[r.get() for r in resultados]
+                    textos.setdefault(e['nombre'],[]).extend(texto for valor,cpu,registro,texto in salidas)
+                    capturarSalida(textos,e,terminarEtapa,e,estado,salidas)
+                    terminadas.add(e['nombre'])
+                    siguiente=mostrarSalidas(etapas,textos,terminadas,siguiente)
+                    avance=True
+            if not avance:
+                time.sleep(ESPERA)
+        pool.close()
+    except:
+        # Mostramos los mensajes capturados hasta el error antes de propagarlo
+        mostrarSalidas(etapas,textos,terminadas,siguiente,True)
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
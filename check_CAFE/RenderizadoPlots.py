@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Renderizado de los plots.
+Objetivo: Sacar los plots (el de la noche y los historiales de las rutinas 01, 02 y 04) del camino crítico
+          de la rutina master. Cada plot se dibuja en un proceso independiente con el backend Agg de
+          matplotlib, que se lanza en segundo plano: la rutina master imprime los resultados de las
+          comprobaciones y termina sin esperar a que se escriban los PDF.
+          Junto a cada PDF se guarda un fichero .huella con el resumen MD5 de los datos a partir de los
+          que se dibujó (el fichero binario de la noche o el fichero Master), del código de la rutina
+          y del día del historial. Si al volver a lanzar el plot la huella no ha cambiado y el PDF existe,
+          no se vuelve a dibujar.
+          Si el plot falla, el error se escribe en un fichero .error junto al PDF.
+          Con la variable de entorno CAFE_PLOTS_FONDO=0 los plots se dibujan en el propio proceso.
+SINTAXIS: python RenderizadoPlots.py modulo funcion fichPdf huella [argumentos]
+          Es la orden con la que se lanza cada plot; no es necesario ejecutarla a mano.
+"""
+
+import os
+import os.path
+import sys
+import hashlib
+import datetime
+import subprocess
+import traceback
+import CacheResultados
+import HistorialNoches
+import Instrumentacion
+
+"""
+Indica si los plots se dibujan en procesos en segundo plano
+"""
+FONDO=os.environ.get("CAFE_PLOTS_FONDO","1")=="1"
+
+"""
+Versión del formato de las huellas. Al cambiarla se vuelven a dibujar todos los plots.
+"""
+VERSION_HUELLA=1
+
+"""
+Funcion que devuelve el resumen MD5 del contenido de un fichero (el mismo que en la caché de resultados, que
+en los ficheros grandes solo lee una muestra), o None si no existe.
+A diferencia de la caché de resultados no se usa la fecha de modificación, puesto que el fichero
+binario de la noche y los ficheros Master se vuelven a escribir en cada ejecución.
+"""
+def resumen(rutaFich):
+    if not os.path.exists(rutaFich):
+        return None
+    return CacheResultados.resumen(rutaFich)
+
+"""
+Funcion que devuelve el día juliano (entero) de hoy, calculado igual que en los plots de historial
+(que pintan los últimos 180 días), sin necesidad de importar astropy
+"""
+def getDiaJulianoHoy():
+    return 2451545+(datetime.datetime.now()-datetime.datetime(2000,1,1,12)).days
+
+"""
+Funcion que calcula la huella de un plot a partir de la función que lo dibuja, sus argumentos,
+el contenido de los ficheros de datos y del código, y los valores adicionales de los que depende
+"""
+def getHuella(funcion, args, entradas, extra):
+    ficheros=list(entradas)+[CacheResultados.getFuente(funcion),CacheResultados.getFuente(getHuella)]
+    descripcion=(VERSION_HUELLA,funcion.__module__,funcion.__name__,args,
+                 [(os.path.normpath(f),resumen(f)) for f in ficheros],extra)
+    return hashlib.md5(repr(descripcion)).hexdigest()
+
+"""
+Funcion que devuelve el nombre del fichero donde se guarda la huella de un PDF
+"""
+def getFicheroHuella(fichPdf):
+    return fichPdf+".huella"
+
+"""
+Funcion que devuelve el nombre del fichero donde se guarda el error de un plot
+"""
+def getFicheroError(fichPdf):
+    return fichPdf+".error"
+
+"""
+Funcion que devuelve True si el PDF existe y se dibujó con los mismos datos
+"""
+def actualizado(fichPdf, huella):
+    fichHuella=getFicheroHuella(fichPdf)
+    if not os.path.exists(fichPdf) or not os.path.exists(fichHuella):
+        return False
+    infile=open(fichHuella,'r')
+    guardada=infile.read().strip()
+    infile.close()
+    return guardada==huella
+
+"""
+Funcion que elimina un fichero si existe
+"""
+def eliminar(fichero):
+    if os.path.exists(fichero):
+        os.remove(fichero)
+
+"""
+Funcion que dibuja un plot en el proceso actual: ejecuta modulo.funcion(*args) y, si termina bien,
+guarda la huella junto al PDF. Si falla, escribe el error en el fichero .error y lo vuelve a lanzar.
+La huella anterior se elimina antes de dibujar, para que un PDF a medio escribir nunca se dé por actualizado.
+Los plots se dibujan siempre con el backend Agg, que no necesita pantalla (por ejemplo en el reprocesado por lotes
+o con CAFE_PLOTS_FONDO=0 en un servidor). Si pyplot ya se ha importado en el proceso el backend no se cambia.
+"""
+def renderizar(modulo, nombreFuncion, args, fichPdf, huella):
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    eliminar(getFicheroHuella(fichPdf))
+    try:
+        funcion=getattr(__import__(modulo),nombreFuncion)
+        funcion(*args)
+    except Exception:
+        outfile=open(getFicheroError(fichPdf),'w')
+        outfile.write(traceback.format_exc())
+        outfile.close()
+        raise
+    finally:
+        # Cerramos las figuras para no acumularlas si se dibujan varios plots en el mismo proceso
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+    eliminar(getFicheroError(fichPdf))
+    outfile=open(getFicheroHuella(fichPdf),'w')
+    outfile.write(huella+"\n")
+    outfile.close()
+
+"""
+Funcion que lanza un plot si sus datos han cambiado desde que se dibujó el PDF. Se recibe por parámetros:
+- funcion: función (definida a nivel de módulo) que dibuja el plot y escribe el PDF
+- args: argumentos de la función (cadenas de texto, ya que se pasan por la línea de órdenes)
+- fichPdf: fichero PDF que escribe la función
+- entradas: lista de ficheros a partir de los que se dibuja el plot
+- extra: valores adicionales de los que depende el plot (por ejemplo el día del historial)
+- esperar: si es True el plot se dibuja en el proceso actual, aunque se haya indicado CAFE_PLOTS_FONDO
+Devuelve el proceso que dibuja el plot en segundo plano, o None si no se ha lanzado ningún proceso.
+"""
+def lanzar(funcion, args, fichPdf, entradas, extra=(), esperar=False):
+    # Los ficheros Master de texto de los que depende el plot deben estar actualizados antes de calcular la huella
+    HistorialNoches.exportarPendientes()
+    args=tuple(args)
+    huella=getHuella(funcion,args,entradas,extra)
+    if actualizado(fichPdf,huella):
+        Instrumentacion.contar('plotsOmitidos')
+        print "Plot "+fichPdf+" sin cambios"
+        return None
+    Instrumentacion.contar('plotsGenerados')
+    if esperar or not FONDO:
+        renderizar(funcion.__module__,funcion.__name__,args,fichPdf,huella)
+        return None
+    print "Generando "+fichPdf+" en segundo plano"
+    sys.stdout.flush()
+    entorno=dict(os.environ)
+    entorno['MPLBACKEND']='Agg'
+    nulo=open(os.devnull,'r+')
+    try:
+        # El proceso se lanza en su propia sesión, de modo que sigue dibujando aunque la rutina master
+        # termine o se interrumpa con Ctrl-C
+        return subprocess.Popen([sys.executable,CacheResultados.getFuente(lanzar),funcion.__module__,
+                                 funcion.__name__,fichPdf,huella]+list(args),
+                                stdin=nulo,stdout=nulo,stderr=nulo,env=entorno,
+                                close_fds=True,preexec_fn=os.setsid)
+    finally:
+        nulo.close()
+
+"""
+Funcion que espera a que terminen los procesos lanzados con lanzar. Devuelve el número de plots que han fallado.
+"""
+def esperar(procesos):
+    return sum(1 for proceso in procesos if proceso is not None and proceso.wait()!=0)
+
+
+if __name__=="__main__":
+    if len(sys.argv)>=5:
+        try:
+            renderizar(sys.argv[1],sys.argv[2],tuple(sys.argv[5:]),sys.argv[3],sys.argv[4])
+        except Exception:
+            sys.exit(1)
+    else:
+        print "SINTAXIS: python RenderizadoPlots.py modulo funcion fichPdf huella [argumentos]"
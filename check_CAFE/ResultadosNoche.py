@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Resultados de la noche en formato binario.
+Objetivo: Guardar en un único fichero por noche y rutina los resultados de todos los ficheros de la noche
+          (los spots de cada arco o el ajuste de los órdenes de cada flat), sin redondear, en lugar de
+          leer y escribir un fichero de texto por imagen.
+          Los resultados de cada imagen son un array estructurado de numpy con el mismo número de filas
+          para todas las imágenes de la noche (200 spots, 34 columnas del CCD). En el fichero se guarda
+          una fila por imagen con el nombre del fichero y, por cada campo, la columna completa de la imagen
+          (por ejemplo posX con los 200 spots), en formato .npy de numpy.
+          El fichero se lee con memory mapping, de modo que datos['posX'] es directamente la matriz
+          (imágenes x spots) y solo se leen del disco las columnas que se utilizan.
+          Los ficheros de texto (.spot, _dat.txt) se siguen generando como exportación.
+"""
+
+import os
+import numpy as np
+
+"""
+Funcion que devuelve el tipo de la fila de cada imagen en el fichero de la noche a partir del
+tipo y del número de filas de los resultados de una imagen. El nombre del fichero ocupa al menos
+64 caracteres, o la longitud indicada si es mayor, para no truncar nombres largos.
+"""
+def getTipoNoche(tipoResultado, numFilas, longitud=64):
+    campos=[('fichero','S'+str(max(64,longitud)))]
+    for nombre in tipoResultado.names:
+        campos.append((nombre,tipoResultado[nombre],(numFilas,)))
+    return np.dtype(campos)
+
+"""
+Funcion que agrupa los resultados de varias imágenes en un array con una fila por imagen.
+Se recibe la lista de ficheros y la lista con el array estructurado de resultados de cada uno.
+"""
+def agrupar(ficheros, resultados):
+    longitud=max(len(fichero) for fichero in ficheros)
+    datos=np.zeros(len(resultados),dtype=getTipoNoche(resultados[0].dtype,len(resultados[0]),longitud))
+    for i,(fichero,resultado) in enumerate(zip(ficheros,resultados)):
+        datos['fichero'][i]=fichero
+        for nombre in resultado.dtype.names:
+            datos[nombre][i]=resultado[nombre]
+    return datos
+
+"""
+Funcion que guarda en el fichero de la noche los resultados de sus imágenes. Si no hay resultados
+no se escribe nada. Se escribe en un fichero temporal que después se renombra, para que nunca se
+lea un fichero a medio escribir.
+"""
+def guardar(fichNoche, ficheros, resultados):
+    if len(resultados)==0:
+        return
+    temporal=fichNoche+".tmp"
+    outfile=open(temporal,'wb')
+    np.save(outfile,agrupar(ficheros,resultados))
+    outfile.close()
+    os.rename(temporal,fichNoche)
+
+"""
+Funcion que abre el fichero de una noche con memory mapping. Devuelve None si no existe.
+"""
+def leer(fichNoche):
+    if not os.path.exists(fichNoche):
+        return None
+    return np.load(fichNoche,mmap_mode='r')
+
+"""
+Funcion que devuelve los resultados de una imagen (fila del fichero de la noche) con el mismo
+array estructurado con el que se guardaron. Los campos que son vectores en cada fila de los
+resultados (por ejemplo los coeficientes de las trazas) conservan su dimensión.
+"""
+def getResultado(datos, indice):
+    nombres=[n for n in datos.dtype.names if n!='fichero']
+    numFilas=datos.dtype[nombres[0]].shape[0]
+    resultado=np.zeros(numFilas,dtype=[(n,datos.dtype[n].base,datos.dtype[n].shape[1:]) for n in nombres])
+    for nombre in nombres:
+        resultado[nombre]=datos[nombre][indice]
+    return resultado
+
+"""
+Funcion que lee el fichero de una noche y devuelve la lista de ficheros y la lista con los resultados
+de cada uno. Si el fichero no existe se devuelven listas vacías.
+"""
+def leerResultados(fichNoche):
+    datos=leer(fichNoche)
+    if datos is None:
+        return [],[]
+    return [str(f) for f in datos['fichero']],[getResultado(datos,i) for i in range(len(datos))]
@@ -6,21 +6,21 @@ Objetivo: Medir las posiciones X-Y (en píxeles) de 200 spots en las imágenes
           arco crudas obtenidas durante la noche.
 """
 
-from astropy.io import fits
-from scipy import ndimage
 import numpy as np
-import os.path
-import astropy.time
-from astropy.io import ascii
-import matplotlib.pyplot as plt
-from dateutil import parser
-from lmfit import  Model
-from astroML.stats import sigmaG
-from os import listdir
-import matplotlib.gridspec as gridspec # GRIDSPEC !
 import datetime
-from jdcal import gcal2jd
 import glob
+import os
+import os.path
+import AccesoFrames
+import AjusteLote
+import CacheResultados
+import CatalogoCabeceras
+import Instrumentacion
+import HistorialNoches
+import RenderizadoPlots
+import ResultadosNoche
+import CuboHistorial
+import LecturaAnticipada
 
 # Para instalar ephem: pip install lmfit
 
@@ -38,21 +38,63 @@ se generarán las estadísticas para los demás ficheros.
 """
 INPUT_SPOT="input_spot.txt"
 
+"""
+Diferencia máxima (en píxeles) admitida entre los centros obtenidos con el ajuste por lotes
+(getCentrosVentanas) y los obtenidos con lmfit (getCentroVentana).
+"""
+TOLERANCIA_CENTRO=1e-4
+
+"""
+Constante con el nombre del fichero donde se guarda la transformada de Fourier de las ventanas de los spots
+del arco de referencia. Solo se genera y se utiliza en el modo rápido (ver generarFFTReferencia).
+"""
+FFT_SPOT="input_spot_fft.npy"
+
+"""
+Indica si se utiliza el modo rápido: el desplazamiento global de cada arco respecto al arco de referencia
+se estima por correlación de fase de las ventanas de los spots (ver estimarDesplazamiento), y solo se
+ajustan los spots uno a uno si el desplazamiento supera UMBRAL_RAPIDO. Se activa con CAFE_RAPIDO=1.
+"""
+MODO_RAPIDO=os.environ.get("CAFE_RAPIDO","0")=="1"
+
+"""
+Desplazamiento (en píxeles) a partir del cual, en el modo rápido, se ajustan todos los spots del arco.
+Es la mitad del límite del chequeo de la rutina, de modo que los arcos cercanos al límite se ajustan siempre.
+"""
+UMBRAL_RAPIDO=0.05
+
+"""
+Frecuencia máxima (en ciclos por ventana) con la que se ajusta la pendiente de la fase en estimarDesplazamiento
+"""
+FRECUENCIA_FASE=4
+
 """
 Constante donde se almacena el nombre del fichero Master para la rutina 01. En él se almacenarán las desviaciones medias de cada noche.
 """
 FICH_MASTER="./Rut01_dat/desviaciones_master.txt"
 
+"""
+Fichero PDF con el plot del historial de los últimos 180 días
+"""
+PLOT_HISTORIA="spots_history_CAFE.pdf"
+
+"""
+Columnas del fichero Master. La primera, el día juliano de la noche, es la clave del historial.
+"""
+COLUMNAS_MASTER=['juldate', 'desvX_media', 'desvY_media', 'intensidad_Norm']
+
 """
 Funcion que obtiene la matriz de datos a partir de una imagen de arco.
 """
 def getMatrizDatos(arcoFits):
+    from astropy.io import fits
     # Abrimos el fichero de arco
     hdulist=fits.open(arcoFits);
     #Obtenemos la matriz con los datos
     tbdata = hdulist[0].data
     #cerramos el fichero
     hdulist.close();
+    Instrumentacion.contar('ficherosLeidos')
     #Hallamos la matriz traspuesta, puesto que hdulist contiene la matriz traspuesta de la imagen
     tbdata_traspuesta=tbdata.transpose()
     return tbdata_traspuesta
@@ -92,6 +134,7 @@ Finalmente, se realiza un cambio de coordenadas de la submatriz a la matriz prin
 La función devuelve el centro del spot.
 """
 def getCentroSpot(coordX,coordY,matriz):
+    from scipy import ndimage
     #Obtenemos la submatriz
     subM=getSubMatriz(coordX,coordY,matriz)
     #Obtenemos el centro del spot
@@ -135,6 +178,7 @@ la matriz en vertical y ajustaremos a la Gaussiana, cuyo centro será la coorden
 Para la coordenada Y haremos lo mismo solo que en sentido horizontal.
 """
 def getCentroVentana(venX, venY, matriz):
+    from lmfit import Model
     #Obtenemos la submatriz
     subM=matriz[venX:venX+TAM_VENTANA*2,venY:venY+TAM_VENTANA*2]
     #Obtenemos el centro del spot contenido en la ventana en la dirección X
@@ -157,18 +201,138 @@ def getCentroVentana(venX, venY, matriz):
     centro=[centroX,centroY]
     return centro
 
+"""
+Versión por lotes de la función gaussian. Recibe una matriz x (N,M) y una matriz de
+parámetros p (N,4) con las columnas amp, cen, wid y level.
+"""
+def gaussianLote(x, p):
+    amp=p[:,0:1]
+    cen=p[:,1:2]
+    wid=p[:,2:3]
+    level=p[:,3:4]
+    return (amp/(np.sqrt(2*np.pi)*wid)) * np.exp(-(x-cen)**2 /(2*wid**2))  + level
+
+"""
+Derivadas parciales de la función gaussian respecto a cada parámetro (amp, cen, wid, level).
+Devuelve una matriz (N,M,4) necesaria para el ajuste por lotes.
+"""
+def jacobianoGaussianLote(x, p):
+    amp=p[:,0:1]
+    cen=p[:,1:2]
+    wid=p[:,2:3]
+    expo=np.exp(-(x-cen)**2 /(2*wid**2))/(np.sqrt(2*np.pi)*wid)
+    campana=amp*expo
+    J=np.empty(x.shape+(4,))
+    J[:,:,0]=expo
+    J[:,:,1]=campana*(x-cen)/wid**2
+    J[:,:,2]=campana*((x-cen)**2/wid**3-1./wid)
+    J[:,:,3]=1.
+    return J
+
+"""
+Funcion que obtiene la pila de ventanas (N, 2*TAM_VENTANA, 2*TAM_VENTANA) de la matriz de datos
+a partir de los vectores con las coordenadas de la esquina superior izquierda de cada ventana.
+"""
+def getVentanas(venX, venY, matriz):
+    rango=np.arange(TAM_VENTANA*2)
+    filas=np.asarray(venX,dtype=int)[:,None]+rango
+    columnas=np.asarray(venY,dtype=int)[:,None]+rango
+    return matriz[filas[:,:,None],columnas[:,None,:]]
+
+"""
+Versión por lotes de getCentroVentana. Recibe la pila de ventanas (N, 2*TAM_VENTANA, 2*TAM_VENTANA)
+y las coordenadas de la esquina superior izquierda de cada ventana. Se colapsan todas las ventanas
+en las dos direcciones y se ajustan las 2N gaussianas a la vez con el algoritmo de AjusteLote.
+La función devuelve dos vectores con las coordenadas X e Y del centro de cada spot.
+La diferencia con los centros obtenidos con lmfit en getCentroVentana es inferior a TOLERANCIA_CENTRO.
+"""
+def getCentrosVentanas(ventanas, venX, venY):
+    numSpots=len(ventanas)
+    # Colapsamos cada ventana en vertical (dirección X) y en horizontal (dirección Y)
+    ventanas=np.asarray(ventanas,dtype=np.float64)
+    Y=np.concatenate((np.sum(ventanas,axis=2),np.sum(ventanas,axis=1)))
+    x=np.tile(np.arange(TAM_VENTANA*2,dtype=np.float64),(len(Y),1))
+    # Mismos valores iniciales que en getCentroVentana
+    mediana=np.median(Y,axis=1)
+    p0=np.empty((len(Y),4))
+    p0[:,0]=np.max(Y,axis=1)-mediana
+    p0[:,1]=TAM_VENTANA
+    p0[:,2]=2
+    p0[:,3]=mediana
+    p,convergido=AjusteLote.levenbergMarquardt(gaussianLote,jacobianoGaussianLote,x,Y,p0)
+    Instrumentacion.contar('ajustes',len(Y))
+    Instrumentacion.contar('ajustesFallidos',np.sum(~convergido))
+    #Realizamos un cambio de coordenadas para obtener el centro en la matriz de datos
+    centroX=np.asarray(venX)+TAM_VENTANA+(p[:numSpots,1]-TAM_VENTANA)
+    centroY=np.asarray(venY)+TAM_VENTANA+(p[numSpots:,1]-TAM_VENTANA)
+    return centroX,centroY
+
+"""
+Funcion que resta a cada ventana su mediana (el fondo) y devuelve la transformada de Fourier 2-D de cada una
+"""
+def getFFTVentanas(ventanas):
+    ventanas=np.asarray(ventanas,dtype=np.float64)
+    return np.fft.fft2(ventanas-np.median(ventanas,axis=(1,2))[:,None,None])
+
+"""
+Transformadas de las ventanas del arco de referencia ya leídas en el proceso, por ruta, tamaño y fecha
+de modificación del fichero FFT_SPOT
+"""
+_fftReferencia={}
+
+"""
+Funcion que lee la transformada de las ventanas del arco de referencia (FFT_SPOT). Devuelve None si no existe
+o si es anterior al fichero INPUT_SPOT, puesto que entonces corresponde a otros spots de referencia.
+"""
+def getFFTReferencia(ficheroFFT=FFT_SPOT):
+    if not os.path.exists(ficheroFFT):
+        return None
+    if os.path.exists(INPUT_SPOT) and os.path.getmtime(ficheroFFT)<os.path.getmtime(INPUT_SPOT):
+        return None
+    estado=os.stat(ficheroFFT)
+    clave=(os.path.abspath(ficheroFFT),estado.st_size,estado.st_mtime)
+    if clave not in _fftReferencia:
+        _fftReferencia.clear()
+        _fftReferencia[clave]=np.load(ficheroFFT)
+    return _fftReferencia[clave]
+
+"""
+Funcion que estima el desplazamiento global (dx, dy) en píxeles de las ventanas de los spots de un arco con
+respecto a las del arco de referencia, de modo que arco(x) = referencia(x - d) y el centro de cada spot es
+el de referencia más d. Se suma el espectro cruzado de todas las ventanas:
+- El desplazamiento entero es el máximo de la correlación de fase (espectro cruzado normalizado).
+- La parte subpíxel se obtiene ajustando por mínimos cuadrados la pendiente de la fase del espectro cruzado
+  en las frecuencias bajas (hasta FRECUENCIA_FASE), ponderada por su amplitud.
+Devuelve None si no existe la transformada del arco de referencia.
+"""
+def estimarDesplazamiento(ventanas, fftReferencia=None):
+    if fftReferencia is None:
+        fftReferencia=getFFTReferencia()
+        if fftReferencia is None:
+            return None
+    n=TAM_VENTANA*2
+    cruzado=np.sum(getFFTVentanas(ventanas)*np.conj(fftReferencia),axis=0)
+    # Desplazamiento entero: máximo de la correlación de fase
+    correlacion=np.real(np.fft.ifft2(cruzado/np.maximum(np.abs(cruzado),1e-300)))
+    pico=np.unravel_index(np.argmax(correlacion),correlacion.shape)
+    entero=np.array([(p+n//2)%n-n//2 for p in pico],dtype=np.float64)
+    # Desplazamiento subpíxel: la fase del espectro cruzado es -2*pi*(u*dx+v*dy)
+    frecuencias=np.fft.fftfreq(n)
+    U,V=np.meshgrid(frecuencias,frecuencias,indexing='ij')
+    residuo=cruzado*np.exp(2j*np.pi*(U*entero[0]+V*entero[1]))
+    usadas=(np.abs(U)<=FRECUENCIA_FASE/float(n))&(np.abs(V)<=FRECUENCIA_FASE/float(n))&((U!=0)|(V!=0))
+    A=-2*np.pi*np.column_stack((U[usadas],V[usadas]))
+    pesos=np.abs(residuo[usadas])
+    subpixel=np.linalg.solve(np.dot(A.T,A*pesos[:,None]),np.dot(A.T,pesos*np.angle(residuo[usadas])))
+    return entero+subpixel
+
 """
 Funcion que obtiene el día juliano a partir de una imagen fit que se le pasa por parámetro.
+El día juliano se consulta en el catálogo de cabeceras, sin volver a abrir el fichero.
 """
 def getDiaJuliano(imagenFit):
-    # Abrimos el fichero
-    f=fits.open(imagenFit);
-    # Obtenemos la fecha y finalmente con astropy obtenemos el dia juliano
-    date=f[0].header["DATE"]
-    dt = parser.parse(date)
-    time = astropy.time.Time(dt)
-    juldate = time.jd
-    return juldate
+    # Obtenemos el dia juliano a partir del catálogo de cabeceras de la noche
+    return CatalogoCabeceras.getDiaJuliano(imagenFit)
     
 
 """
@@ -191,6 +355,10 @@ def generarInputSpot(ficheroSpot,matriz):
     outfile = open(INPUT_SPOT,"w")
     #Escribimos la primera linea del fichero con los comentarios
     outfile.write("@IdSpot,posVenX,posVenY,posX,posY,Intensidad\n")
+    #Vectores donde almacenamos el identificador y la ventana de cada spot
+    idSpots=[]
+    ventanasX=[]
+    ventanasY=[]
     #Recorremos este fichero obteniendo cada una de las lineas
     for line in infile:
         #Troceamos la linea, almacenando en spot[0] el id, spot[1] PosX, spot[2] PosY
@@ -203,220 +371,382 @@ def generarInputSpot(ficheroSpot,matriz):
             #Obtenemos el centro del spot para calcular la ventana a partir de el centro
             centro=getCentroSpot(posXSpot,posYSpot,matriz)
             #Calculamos las coordenadas X e Y de la esquina superior izquierda de la ventana
-            venX=int(centro[0]-TAM_VENTANA)
-            venY=int(centro[1]-TAM_VENTANA)
-            #Recalculamos el centro del spot contenida en la ventana a partir de sus coordenadas superior izquierda
-            centroVen=getCentroVentana(venX,venY,matriz)
-            #Obtenemos la submatriz para calcular la intensidad del spot realizando la suma
-            subM=matriz[venX:venX+TAM_VENTANA*2,venY:venY+TAM_VENTANA*2]
-            intensidad=np.sum(subM)
-            #Tomamos una precisión de 4 decimales para el calculo del centro
-            cenX=round(centroVen[0],4)
-            cenY=round(centroVen[1],4)
-            #Escribimos los datos en el fichero
-            outfile.write(idSpot+","+str(venX)+","+str(venY)+","+str(cenX)+","+str(cenY)+","+str(intensidad)+"\n")
+            idSpots.append(idSpot)
+            ventanasX.append(int(centro[0]-TAM_VENTANA))
+            ventanasY.append(int(centro[1]-TAM_VENTANA))
+    #Recalculamos a la vez el centro de todos los spots contenidos en las ventanas
+    ventanas=getVentanas(ventanasX,ventanasY,matriz)
+    centrosX,centrosY=getCentrosVentanas(ventanas,ventanasX,ventanasY)
+    #Obtenemos la intensidad de cada spot realizando la suma de su ventana
+    intensidades=np.sum(ventanas,axis=(1,2))
+    for i in range(len(idSpots)):
+        #Tomamos una precisión de 4 decimales para el calculo del centro
+        cenX=round(centrosX[i],4)
+        cenY=round(centrosY[i],4)
+        #Escribimos los datos en el fichero
+        outfile.write(idSpots[i]+","+str(ventanasX[i])+","+str(ventanasY[i])+","+str(cenX)+","+str(cenY)+","+str(intensidades[i])+"\n")
     #Cerramos ambos ficheros    
     infile.close()
     outfile.close() 
     
 """
-Función que se encarga de generar un fichero de salida con nombre "arcoFits_dat.spot"
-con la siguiente información en cada linea del fichero:
-- IdSpot = identificador del spot de la imagen arcoFits
-- posX = coordenada X del centro del spot
-- posY = coordenada Y del centro del spot
-- distX = distancia en el eje X del spot de la imagen arcoFits con respecto al fichero inputSpot que tenemos como referencia
-- distY = distancia en el eje Y del spot de la imagen arcoFits con respecto al fichero inputSpot que tenemos como referencia
-- Intensidad = Valor promedio de la submatriz que contiene los datos del spot
-Para ello se recibe como parametro:
-- inputSpot = fichero de muestra con el que se van a realizar las comparaciones
-- arcoFits = imagen de arco a analizar.
+Funcion que se encarga de generar el fichero input_spot.txt con el que se van a comparar los demas ficheros arco.
+Para ello, se toma una imagen ARCO de referencia (arco_ref) y el fichero con las coordenadas iniciales de los spots.
 """
-def generarEstadisticas(inputSpots, arcoFits):
-    # Obtenemos la matriz de datos de la imagen arcoFits
-    matrizDat=getMatrizDatos(arcoFits)
-    # Abrimos el fichero con la información calculada previamente de los spots (posicion e intensidad)
-    infile = open(inputSpots,'r')
-    # Creamos el fichero de estadisticas
+def cargarSpots(arco_ref, ficheroSpot):
+    # Obtenemos la matriz de datos del fichero que cogemos como referencia
+    tbdata=getMatrizDatos(arco_ref)
+    # Generamos el fichero input_spot.txt que utilizaremos para el estudio
+    generarInputSpot(ficheroSpot,tbdata)
+
+"""
+Funcion que genera el fichero FFT_SPOT con la transformada de las ventanas de los spots de input_spot.txt
+en la imagen arco de referencia, que solo se utiliza en el modo rápido
+"""
+def generarFFTReferencia(arco_ref):
+    ventanas=leerVentanasArco(leerInputSpot(INPUT_SPOT),arco_ref)
+    np.save(FFT_SPOT,getFFTVentanas(ventanas))
+
+"""
+Funcion que genera el fichero input_spot.txt reutilizando el guardado en la caché si no han cambiado
+la imagen arco de referencia ni el fichero con las coordenadas iniciales de los spots.
+La imagen de referencia casi nunca cambia, por lo que normalmente no se repite ningún ajuste.
+En el modo rápido se genera además, también con la caché, el fichero FFT_SPOT.
+"""
+def cargarSpotsCache(arco_ref, ficheroSpot):
+    CacheResultados.ejecutar(cargarSpots,[arco_ref,ficheroSpot],[INPUT_SPOT],arco_ref,ficheroSpot)
+    if MODO_RAPIDO:
+        CacheResultados.ejecutar(generarFFTReferencia,[arco_ref,INPUT_SPOT],[FFT_SPOT],arco_ref)
+
+"""
+Funcion que devuelve el nombre del fichero de estadisticas (.spot) de una imagen arco
+"""
+def getFicheroSpot(arcoFits):
     nomFichero = arcoFits[0:len(arcoFits)-5]+"_"+arcoFits[0:6]+".spot"
-    outfile = open("./Rut01_dat/"+nomFichero[nomFichero.index('/')+1:],"w")
-    # Escribimos la primera linea del fichero con los comentarios
-    outfile.write("@IdSpot,posX,posY,distX,distY,Intensidad,diaJuliano\n")
-    # Obtenemos el dia juliano en el que se ha realizado la imagen arcoFits
-    diaJuliano=getDiaJuliano(arcoFits)
-    # Recorremos el fichero donde tenemos las coordenadas de los spots para generar las estadisticas
+    return "./Rut01_dat/"+nomFichero[nomFichero.index('/')+1:]
+
+"""
+Funcion que devuelve el tipo (array estructurado de numpy) de los resultados de los spots de una imagen arco:
+- idSpot = identificador del spot
+- posX, posY = coordenadas del centro del spot
+- distX, distY = distancia en cada eje del spot con respecto al spot de referencia
+- intensidad = suma de la ventana del spot. Se mantiene el tipo de los datos de la imagen (enteros o reales).
+- juldate = día juliano de la imagen
+"""
+def getTipoSpot(tipoIntensidad=np.float64):
+    return np.dtype([('idSpot','S16'),('posX',np.float64),('posY',np.float64),('distX',np.float64),
+                     ('distY',np.float64),('intensidad',tipoIntensidad),('juldate',np.float64)])
+
+"""
+Funcion que lee el fichero de spots de referencia (input_spot.txt) y devuelve un array estructurado con
+el identificador, la esquina de la ventana (venX, venY), el centro (posX, posY) y la intensidad de cada spot
+"""
+def leerInputSpot(inputSpots):
+    filas=[]
+    infile = open(inputSpots,'r')
     for line in infile:
-         #Troceamos la linea, almacenando en spot[0] el id, spot[1] venX, spot[2] venY, spot[3] posX, spot[4] posY
+        #Troceamos la linea, almacenando en spot[0] el id, spot[1] venX, spot[2] venY, spot[3] posX, spot[4] posY, spot[5] intensidad
         spot=line.split(",")
-        idSpot=spot[0]
         #Comprobamos que la linea no sea un comentario, es decir, que no comience por @
-        if idSpot[0] != "@":
-            #Obtenemos la posicion de la ventana y los centros de referencia
-            venX=int(spot[1])
-            venY=int(spot[2])
-            posXSpot=float(spot[3])
-            posYSpot=float(spot[4])
-            #Obtenemos el centro del spot de la imagen que a analizar
-            centro=getCentroVentana(venX,venY,matrizDat)
-            #Calculamos las distancias de los respectivos centros
-            distX=(posXSpot-centro[0])
-            distY=(posYSpot-centro[1])
-            #Obtenemos la submatriz para calcular la intensidad del spot
-            subM=matrizDat[venX:venX+TAM_VENTANA*2,venY:venY+TAM_VENTANA*2]
-            intensidad=np.sum(subM)
-            #Tomamos una precisión de 4 decimales para el calculo del centro y las distancias
-            cenX=round(centro[0],4)
-            cenY=round(centro[1],4)
-            distanciaX=round(distX,4)
-            distanciaY=round(distY,4)
-            diaJul=round(diaJuliano,6)
-            #Escribimos los datos en el fichero
-            outfile.write(idSpot+","+str(cenX)+","+str(cenY)+","+str(distanciaX)+","+str(distanciaY)+","+str(intensidad)+","+str(diaJul)+"\n")
-    #Cerramos ambos ficheros    
+        if spot[0][0] != "@":
+            filas.append((spot[0],int(spot[1]),int(spot[2]),float(spot[3]),float(spot[4]),float(spot[5])))
     infile.close()
-    outfile.close() 
+    return np.array(filas,dtype=[('idSpot','S16'),('venX',int),('venY',int),('posX',np.float64),
+                                 ('posY',np.float64),('intensidad',np.float64)])
+
+"""
+Funcion que lee de una imagen arco solo las ventanas de los spots de referencia (ver leerInputSpot)
+"""
+def leerVentanasArco(referencia, arcoFits):
+    return AccesoFrames.leerVentanas(arcoFits,referencia['venX'],referencia['venY'],TAM_VENTANA*2)
+
+"""
+Función que calcula las estadísticas de los spots de una imagen arco con respecto a los spots de referencia
+del fichero inputSpots, sin escribir ningún fichero. Devuelve un array estructurado (ver getTipoSpot)
+con una fila por spot. Los valores no se redondean; solo se redondean al escribir el fichero .spot.
+Opcionalmente se reciben las ventanas de los spots, si ya se han leído (ver rutina01Run).
+En el modo rápido (rapido=True, o MODO_RAPIDO si no se indica), si el desplazamiento global del arco estimado
+por correlación de fase no supera UMBRAL_RAPIDO no se ajustan los spots: el centro de cada spot es el de
+referencia más el desplazamiento global.
+"""
+def calcularEstadisticas(inputSpots, arcoFits, ventanas=None, rapido=None):
+    # Obtenemos la información calculada previamente de los spots (posicion de la ventana y centro)
+    referencia=leerInputSpot(inputSpots)
+    # Obtenemos el dia juliano en el que se ha realizado la imagen arcoFits
+    diaJuliano=getDiaJuliano(arcoFits)
+    #Leemos de la imagen a analizar solo las ventanas de los spots y obtenemos a la vez el centro de todos ellos
+    if ventanas is None:
+        ventanas=leerVentanasArco(referencia,arcoFits)
+    if rapido is None:
+        rapido=MODO_RAPIDO
+    desplazamiento=estimarDesplazamiento(ventanas) if rapido else None
+    if desplazamiento is not None and np.max(np.abs(desplazamiento))<UMBRAL_RAPIDO:
+        Instrumentacion.contar('arcosRapidos')
+        centrosX=referencia['posX']+desplazamiento[0]
+        centrosY=referencia['posY']+desplazamiento[1]
+    else:
+        centrosX,centrosY=getCentrosVentanas(ventanas,referencia['venX'],referencia['venY'])
+    #Calculamos las distancias de los respectivos centros
+    distX=referencia['posX']-centrosX
+    distY=referencia['posY']-centrosY
+    #Obtenemos la intensidad de cada spot realizando la suma de su ventana
+    intensidades=np.sum(ventanas,axis=(1,2))
+    spots=np.zeros(len(referencia),dtype=getTipoSpot(intensidades.dtype))
+    spots['idSpot']=referencia['idSpot']
+    spots['posX']=centrosX
+    spots['posY']=centrosY
+    spots['distX']=distX
+    spots['distY']=distY
+    spots['intensidad']=intensidades
+    spots['juldate']=diaJuliano
+    return spots
+
+"""
+Funcion que escribe los resultados de los spots de una imagen arco en un fichero .spot con la siguiente
+información en cada linea del fichero: IdSpot, posX, posY, distX, distY, Intensidad, diaJuliano
+Las coordenadas y las distancias se escriben con 4 decimales y el día juliano con 6.
+"""
+def escribirSpot(spots, fichero):
+    lineas=["@IdSpot,posX,posY,distX,distY,Intensidad,diaJuliano\n"]
+    for spot in spots:
+        lineas.append(spot['idSpot']+","+str(round(spot['posX'],4))+","+str(round(spot['posY'],4))+","+str(round(spot['distX'],4))+","+
+                      str(round(spot['distY'],4))+","+str(spot['intensidad'])+","+str(round(spot['juldate'],6))+"\n")
+    outfile = open(fichero,"w")
+    outfile.write("".join(lineas))
+    outfile.close()
+
+"""
+Funcion que lee un fichero .spot y devuelve el mismo array estructurado que calcularEstadisticas
+"""
+def leerSpot(fichero):
+    filas=[]
+    infile = open(fichero,'r')
+    for line in infile:
+        spot=line.strip().split(",")
+        #Comprobamos que la linea no esté en blanco ni sea un comentario, es decir, que no comience por @
+        if len(spot[0])>0 and spot[0][0] != "@":
+            filas.append(spot)
+    infile.close()
+    # Las intensidades son enteras si lo son los datos de la imagen
+    entera=all(f[5].lstrip("-").isdigit() for f in filas)
+    spots=np.zeros(len(filas),dtype=getTipoSpot(np.int64 if entera else np.float64))
+    for i,f in enumerate(filas):
+        spots[i]=(f[0],float(f[1]),float(f[2]),float(f[3]),float(f[4]),int(f[5]) if entera else float(f[5]),float(f[6]))
+    return spots
+
+"""
+Función que calcula las estadísticas de los spots de una imagen arco y, si exportar es True, las escribe
+en el fichero .spot de la imagen en Rut01_dat (ver getFicheroSpot).
+Para ello se recibe como parametro:
+- inputSpot = fichero de muestra con el que se van a realizar las comparaciones
+- arcoFits = imagen de arco a analizar.
+- ventanas = ventanas de los spots, si ya se han leído.
+- rapido = si se utiliza el modo rápido (ver calcularEstadisticas). Por defecto MODO_RAPIDO.
+Devuelve el array estructurado con los resultados de cada spot.
+"""
+def generarEstadisticas(inputSpots, arcoFits, exportar=True, ventanas=None, rapido=None):
+    spots=calcularEstadisticas(inputSpots,arcoFits,ventanas,rapido)
+    if exportar:
+        escribirSpot(spots,getFicheroSpot(arcoFits))
+    return spots
+
+"""
+Funcion que genera el fichero de estadisticas de una imagen arco en el modo rápido
+"""
+def generarEstadisticasRapidas(inputSpots, arcoFits):
+    return generarEstadisticas(inputSpots,arcoFits,rapido=True)
+
+"""
+Funcion que genera el fichero de estadisticas de una imagen arco reutilizando el resultado guardado en la
+caché si no han cambiado la imagen, la imagen arco de referencia ni el fichero con las coordenadas de los spots.
+Los resultados del modo rápido se guardan en la caché por separado.
+Devuelve el array estructurado con los resultados de cada spot.
+"""
+def generarEstadisticasCache(inputSpots, arcoFits, arco_ref, ficheroSpot):
+    if MODO_RAPIDO:
+        return CacheResultados.ejecutar(generarEstadisticasRapidas,[arcoFits,arco_ref,ficheroSpot],[getFicheroSpot(arcoFits)],inputSpots,arcoFits)
+    return CacheResultados.ejecutar(generarEstadisticas,[arcoFits,arco_ref,ficheroSpot],[getFicheroSpot(arcoFits)],inputSpots,arcoFits)
+
 
+"""
+Funcion que devuelve el nombre del fichero binario con los resultados de todos los arcos de una noche
+"""
+def getFicheroNoche(noche):
+    return "./Rut01_dat/spots_"+noche+".npy"
+
+"""
+Funcion que guarda en el fichero binario de la noche los resultados de los spots de cada arco.
+Se recibe la lista de imágenes de arco y la lista con los resultados de cada una.
+"""
+def guardarResultadosNoche(noche, arcos, listaSpots):
+    ResultadosNoche.guardar(getFicheroNoche(noche),arcos,listaSpots)
+
+"""
+Funcion que lee el fichero binario de una noche y devuelve la lista de imágenes de arco y la lista
+con los resultados de los spots de cada una. Si no existe se devuelven listas vacías.
+"""
+def leerResultadosNoche(noche):
+    return ResultadosNoche.leerResultados(getFicheroNoche(noche))
+
+"""
+Directorio del cubo con los resultados de los spots de todos los arcos de todas las noches (ver CuboHistorial)
+"""
+DIR_CUBO="./Rut01_dat/cubo_spots"
+
+"""
+Funcion que añade al cubo de historial los resultados de los spots de los arcos de una noche.
+Las intensidades se guardan siempre como reales, sea cual sea el tipo de los datos de cada imagen,
+para que todas las noches tengan el mismo tipo en el cubo.
+"""
+def anadirCuboNoche(noche, arcos, listaSpots):
+    listaSpots=[spots.astype(getTipoSpot()) for spots in listaSpots]
+    CuboHistorial.anadirNoche(DIR_CUBO,noche,arcos,[spots['juldate'][0] for spots in listaSpots],listaSpots)
+
+"""
+Funcion que devuelve la serie temporal de un campo de los spots (posX, posY, distX, distY, intensidad o juldate)
+a partir del cubo de historial. Opcionalmente se indican los identificadores de los spots que se consultan
+(por defecto todos) y las noches inicial y final (formato AAMMDD).
+Devuelve el vector con el día juliano de cada arco y la matriz (spots x arcos) con los valores.
+"""
+def serieSpots(campo, idSpots=None, nocheInicial=None, nocheFinal=None):
+    columnas=None
+    if idSpots is not None:
+        cubo=CuboHistorial.abrir(DIR_CUBO)
+        if cubo is None or len(cubo)==0:
+            return np.zeros(0),np.zeros((0,0))
+        # Los spots aparecen en el mismo orden en todos los arcos
+        posiciones=dict((idSpot,i) for i,idSpot in enumerate(cubo['idSpot'][0]))
+        columnas=[posiciones[str(idSpot)] for idSpot in idSpots]
+    return CuboHistorial.serie(DIR_CUBO,campo,columnas,nocheInicial,nocheFinal)
+
+"""
+Funcion que reconstruye el cubo de historial a partir de los resultados de Rut01_dat: el fichero binario
+de cada noche o, si no existe, sus ficheros .spot
+"""
+def reconstruirCubo():
+    import shutil
+    if os.path.isdir(DIR_CUBO):
+        shutil.rmtree(DIR_CUBO)
+    noches=set(os.path.basename(f)[6:12] for f in glob.glob('./Rut01_dat/spots_*.npy'))
+    noches.update(os.path.basename(f)[-11:-5] for f in glob.glob('./Rut01_dat/*_*.spot'))
+    for noche in sorted(noches):
+        arcos,listaSpots=leerResultadosNoche(noche)
+        if len(listaSpots)==0:
+            ficheros=sorted(glob.glob('./Rut01_dat/*_'+noche+'.spot'))
+            arcos=[noche+"/"+os.path.basename(f)[:-12]+".fits" for f in ficheros]
+            listaSpots=[leerSpot(f) for f in ficheros]
+        anadirCuboNoche(noche,arcos,listaSpots)
+        print "Noche "+noche+": "+str(len(listaSpots))+" arcos"
+
+"""
+Funcion que devuelve las lineas no vacías del fichero con el listado de imágenes de arco
+"""
+def leerListaArcos(listaArcos):
+    infile = open(listaArcos,'r')
+    arcos=[line.strip() for line in infile if len(line.strip())>0]
+    infile.close()
+    return arcos
 
 """
 Funcion que se encarga de generar todas las estadísticas para el listado de imágenes de arco
 que se encuentren en el fichero que se le introduce por parámetro.
 IMPORTANTE: Estos ficheros de ARCO deberán estar en el mismo directorio que la rutina y 
 que el fichero con dicho listado.
+Las ventanas de cada arco se leen por adelantado mientras se procesa el anterior (ver LecturaAnticipada).
+Con rapido se indica si se utiliza el modo rápido (por defecto MODO_RAPIDO).
+Devuelve la lista con los resultados de cada arco.
+"""
+def rutina01Run(listaArcos, rapido=None):
+    referencia=leerInputSpot(INPUT_SPOT)
+    lecturas=LecturaAnticipada.anticipar(lambda arco: leerVentanasArco(referencia,arco),leerListaArcos(listaArcos))
+    return [generarEstadisticas(INPUT_SPOT,arco,ventanas=ventanas,rapido=rapido) for arco,ventanas in lecturas]
+
 """
-def rutina01Run(listaArcos):
-    # Abrimos el fichero con el listado de ficheros arco
-    infile = open(listaArcos,'r')
-    # Procesamos cada una de las lineas del fichero, y generamos las estadísticas para cada fichero de arco
-    for line in infile:
-        #Eliminamos de la linea el retorno de carro (\n)
-        line=line.strip()
-        #Comprobamos que la linea tenga información y no sea una linea en blanco
-        if len(line)>0:
-            generarEstadisticas(INPUT_SPOT,line)
+Función que realiza el promedio de las desviaciones de todos los spots de un arco y el promedio de las intensidades
+a partir de los resultados de sus spots. Las desviaciones se redondean a 4 decimales, como en el fichero .spot,
+para que las entradas del fichero Master no dependan de dónde se leen los resultados.
+"""
+def promedioSpots(spots):
+    # Sumamos en el mismo orden que los spots
+    promedioX=sum([round(v,4) for v in spots['distX'].tolist()])/200
+    promedioY=sum([round(v,4) for v in spots['distY'].tolist()])/200
+    promedioInt=sum(spots['intensidad'].astype(np.float64).tolist())/200
+    return [promedioX,promedioY,promedioInt]
 
 """
-Función que realiza el promedio de las desviaciones de todos los spots para un fichero en concreto, y el promedio de las intensidades
+Función que realiza el promedio de las desviaciones de todos los spots para un fichero .spot en concreto, y el promedio de las intensidades
 """
 def getPromedioDesv(fichero):
-    #Abrimos el fichero
-    infile = open("./Rut01_dat/"+fichero[fichero.index('/')+1:],'r')
-    # Inicializamos contadores
-    sumaX=0.0
-    sumaY=0.0
-    sumaInt=0.0
-    # Recorremos el fichero donde tenemos la informacion de los spots
-    for line in infile:
-         #Troceamos la linea, almacenando en spot[0] el id, spot[1] PosX, spot[2] PosY, spot[3] distX, spot[4] distY, spot[5] intensidad
-        spot=line.split(",")
-        idSpot=spot[0]
-        #Comprobamos que la linea no sea un comentario, es decir, que no comience por @
-        if idSpot[0] != "@":
-            sumaX=sumaX+float(spot[3])
-            sumaY=sumaY+float(spot[4])
-            sumaInt=sumaInt+float(spot[5])
-    infile.close()
-    promedioX=sumaX/200
-    promedioY=sumaY/200
-    promedioInt=sumaInt/200
-    return [promedioX,promedioY,promedioInt]
+    return promedioSpots(leerSpot("./Rut01_dat/"+fichero[fichero.index('/')+1:]))
     #print "Fichero: %s. Anchura ventana: %d px. Desviacion en X: %.4f px. Desviacion en Y: %.4f px" %(fichero,TAM_VENTANA*2, promedioX, promedioY)
     
 """
 Funcion que obtiene un array con las intensidades del fichero ARCO de referencia
 """
 def getIntensidadReferencia():
-    #Abrimos el fichero
-    infile = open(INPUT_SPOT,'r')
-    # Inicializamos contadores
-    intensidadesRef=[]
-    # Recorremos el fichero donde tenemos la informacion de los spots
-    for line in infile:
-         #Troceamos la linea, almacenando en spot[0] el id, spot[1] PosVenX, spot[2] PosVenY, spot[3] posX, spot[4] posY, spot[5] intensidad
-        spot=line.split(",")
-        idSpot=spot[0]
-        #Comprobamos que la linea no sea un comentario, es decir, que no comience por @
-        if idSpot[0] != "@":
-            intensidadesRef.append(float(spot[5]))
-    infile.close()
-    return intensidadesRef
+    return leerInputSpot(INPUT_SPOT)['intensidad'].tolist()
+
+"""
+Función que muestra el promedio de las desviaciones de todos los spots estudiados y de las intensidades
+a partir de la lista con los resultados de cada arco de la noche (ver calcularEstadisticas).
+"""
+def promedioNoche(listaSpots):
+    #Obtenemos las desviaciones medias de cada arco asi como las intensidades
+    promedios=[promedioSpots(spots) for spots in listaSpots]
+    desvX=[p[0] for p in promedios]
+    desvY=[p[1] for p in promedios]
+    intensidad=[p[2] for p in promedios]
+    #Calculamos las intensidades normalizadas de la noche
+    intRef=getIntensidadReferencia()
+    intNorm=np.array(intensidad[:])/np.mean(intRef)
+    return [np.mean(desvX), np.mean(desvY), np.mean(intNorm)]
 
 """
 Función que muestra el promedio de las desviaciones de todos los spots estudiados y de las intensidades
 Para ello, hace uso del fichero que contiene el litado de imágenes de arco y accede
-a los ficheros "arco_dat.txt" para mostrar el promedio de las desviaciones de los spots.
+a los ficheros "arco_dat.spot" para mostrar el promedio de las desviaciones de los spots.
 Es necesario haber ejecutado la rutina para poder ejecutar esta función, es decir, deben existir los ficheros
 """
 def promedioDistancias(listaArcos):
-    #Inicializamos vectores donde se almacenara las desviaciones medias de cada fichero asi como las intensidades
-    desvX=[]
-    desvY=[]
-    intensidad=[]
-    # Abrimos el fichero con el listado de ficheros arco
-    infile = open(listaArcos,'r')
-    # Procesamos cada una de las lineas del fichero, y generamos las estadísticas para cada fichero de arco
-    for line in infile:
-        #Comprobamos que la linea tenga información y no sea una linea en blanco
-        if len(line)>0:
-            #Eliminamos de la linea el retorno de carro (\n), eliminamos la extensión .fits y añadimos "_fecha.spot"
-            line=line.strip()
-            line=line[0:len(line)-5]+"_"+line[0:6]+".spot"
-            fichDat=getPromedioDesv(line)
-            desvX.append(fichDat[0])
-            desvY.append(fichDat[1])
-            intensidad.append(fichDat[2])
-    #Calculamos las intensidades normalizadas de la noche
-    intRef=getIntensidadReferencia()
-    intNorm=np.array(intensidad[:])/np.mean(intRef)
-    infile.close()
-    return [np.mean(desvX), np.mean(desvY), np.mean(intNorm)]      
+    return promedioNoche([leerSpot(getFicheroSpot(arco)) for arco in leerListaArcos(listaArcos)])
 
 """
 Esta función devolverá true en caso de que exista en el fichero bias_master.txt 
 una entrada para la noche que se introduce por parámetro, y false en caso contrario.
 El dia juliano introducido por parámetro debe ser un valor entero.
 """
-def existeNoche(diaJuliano):
-    # Abrimos el fichero en modo lectura
-    infile=open(FICH_MASTER,'r')
-    # Creamos una variable que inicialmente inicializamos a falso
-    existe=False
-    # Recorremos el fichero y comparamos cada una de las lineas
-    for line in infile:
-        #Ignoramos las lineas que comiencen por @, puesto que se trata de un comentario en el fichero
-        if line[0]!='@':
-            # Obtenemos el dia juliano almacenado en la primera posicion de la linea
-            linea=line.split(',')
-            juldate=np.int(linea[0])
-            if juldate==diaJuliano:
-                existe=True
-    infile.close()
-    return existe
+def existeNoche(diaJuliano, fichMaster=FICH_MASTER):
+    # Consultamos el historial del fichero Master, indexado por el dia juliano
+    return HistorialNoches.existeNoche(fichMaster,diaJuliano)
     
 
 """
 Función que se encarga de genera el fichero Master de la rutina y de chequear los datos
-Se le pasa por parametro la lista de ficheros arco.
+Se le pasa por parametro la lista de ficheros arco y, opcionalmente, el fichero Master donde se añade la noche
+y la lista con los resultados de cada arco. Si no se indican los resultados se leen de los ficheros .spot.
 """
-def checkRutina01(listaArcos):
+def checkRutina01(listaArcos, fichMaster=FICH_MASTER, listaSpots=None):
     #Obtenemos el promedio de las desviaciones en X y en Y de los spots y el promedio de las intensidades normalizadas
-    [desvX, desvY, intNorm]=promedioDistancias(listaArcos)
-    # Añadimos el valor de la media de todas las desviaciones de los spots de la noche al fichero master
-    # Si existe el fichero lo abrimos en modo "a", sino lo creamos
-    if os.path.exists(FICH_MASTER):
-        file=open(FICH_MASTER,"a")
+    if listaSpots is None:
+        [desvX, desvY, intNorm]=promedioDistancias(listaArcos)
     else:
-        file=open(FICH_MASTER,"w")
-        file.write("@juldate,desvX_media,desvY_media,intensidad_Norm\n")
+        [desvX, desvY, intNorm]=promedioNoche(listaSpots)
     # Abrimos el fichero con el listado de ficheros arco
     infile = open(listaArcos,'r')
     # Obtenemos el dia juliano para uno de los ficheros arco de la noche
     imagen = infile.readline().strip()
     infile.close()
     juldate=getDiaJuliano(imagen)
-    #Comprobamos que la entrada en el fichero no exista. En caso de no existir escribimos nueva entrada
-    if not existeNoche(np.int(juldate)):
-        file.write(str(np.int(juldate))+","+str(round(desvX,4))+","+str(round(desvY,4))+","+str(intNorm)+"\n")
-    file.close()
+    registrarRutina01(juldate, desvX, desvY, intNorm, fichMaster)
+
+"""
+Función que añade al fichero Master la entrada de la noche con las desviaciones medias de los spots
+y la intensidad normalizada, y que realiza el chequeo de dichos valores.
+"""
+def registrarRutina01(juldate, desvX, desvY, intNorm, fichMaster=FICH_MASTER):
+    # Guardamos en el historial del fichero master la media de todas las desviaciones de los spots de la noche
+    # Si ya existe una entrada para la noche se sustituye
+    HistorialNoches.guardarNoche(fichMaster,COLUMNAS_MASTER,[np.int(juldate),round(desvX,4),round(desvY,4),float(intNorm)])
     
     #Realizamos el checkeo para la rutina01
     # Si las desviciones medias de los spots son menores a 100 milipíxeles y la intensidad normalizada esta entre el 0.99% y el 1.01%
@@ -437,17 +767,16 @@ def checkRutina01(listaArcos):
 Funcion encargada de añadir pintar y añadir al historial los resultados obtenidos en la noche que se esta ejecutando
 """
 def plotHistory():
-    colnames = ('jd','desvX','desvY','intNorm')
-    table = ascii.read('Rut01_dat/desviaciones_master.txt', format='csv', names=colnames, comment='@')	
-    jd  = np.array(table["jd"])
-    desvX   = np.array(table["desvX"])
-    desvY   = np.array(table["desvY"])
-    intNorm   = np.array(table["intNorm"])
-    
+    import astropy.time
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec # GRIDSPEC !
+    from jdcal import gcal2jd
     today = datetime.datetime.now()
     today = astropy.time.Time(today)
     jd_today = np.int(today.jd)
     jd_ini=jd_today-180
+    # Leemos del historial solo las noches de los ultimos 180 dias
+    jd,desvX,desvY,intNorm = HistorialNoches.leerColumnas(FICH_MASTER,jd_ini)
     
     plt.figure(figsize=(12,7))
     gs = gridspec.GridSpec(3,1)
@@ -504,17 +833,32 @@ def plotHistory():
     arr = intNorm
     
     plt.scatter(jd-jd_ini,intNorm,c=arr, cmap='winter',vmin=3.5, vmax=6)
-    plt.savefig('spots_history_CAFE.pdf')
+    plt.savefig(PLOT_HISTORIA)
+
+"""
+Funcion que lanza en segundo plano el plot del historial, si han cambiado los datos o el día desde que se dibujó
+"""
+def lanzarPlotHistory():
+    return RenderizadoPlots.lanzar(plotHistory,(),PLOT_HISTORIA,[FICH_MASTER],RenderizadoPlots.getDiaJulianoHoy())
+
 
 
         
 """
-Plot de los resultados de la noche que se esta ejecutando
-"""
-def Plot1night(night):
-	#Directorio de trabajo y numero de ficheros
-    DIR = './Rut01_dat'
-    nfiles= len(glob.glob('./Rut01_dat/*'+night+'.spot'))
+Plot de los resultados de la noche que se esta ejecutando.
+Opcionalmente se recibe la lista con los resultados de cada arco; si no se indica se leen del fichero binario
+de la noche o, si no existe, de los ficheros .spot de la noche.
+"""
+def Plot1night(night, listaSpots=None):
+    from astroML.stats import sigmaG
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec # GRIDSPEC !
+    if listaSpots is None:
+        listaSpots=leerResultadosNoche(night)[1]
+    if len(listaSpots)==0:
+        listaSpots=[leerSpot(fichero) for fichero in glob.glob('./Rut01_dat/*'+night+'.spot')]
+	#Numero de ficheros
+    nfiles= len(listaSpots)
 	#Inicializamos algunas variables
     XX = np.zeros((nfiles, 199))
     YY = np.zeros((nfiles, 199))
@@ -522,17 +866,18 @@ def Plot1night(night):
     dY = np.zeros((nfiles, 199))
     IN = np.zeros((nfiles, 199))
     JD = np.zeros((nfiles, 199))
-	#Leemos todos los ficheros creados para cada arco y los almacenamos en las matrices correspondientes
+	#Almacenamos los resultados de cada arco en las matrices correspondientes
     ii = 0
-    for file in glob.glob('./Rut01_dat/*'+night+'.spot'):
-        colnames = ('IdSpot','posX','posY','distX','distY','Intensidad','jd')
-        table = ascii.read(file, format='csv', names=colnames, comment='@')
-        jda  = np.array(table["jd"])
-        x   = np.array(table["posX"])
-        y   = np.array(table["posY"])
-        dx  = np.array(table["distX"])
-        dy  = np.array(table["distY"])
-        I	= np.array(table["Intensidad"])
+    for spots in listaSpots:
+        # Al leer los ficheros .spot con ascii.read la primera fila se tomaba como cabecera,
+        # por lo que se dibujan los 199 spots siguientes
+        spots = spots[1:]
+        jda  = spots["juldate"]
+        x   = spots["posX"]
+        y   = spots["posY"]
+        dx  = spots["distX"]
+        dy  = spots["distY"]
+        I	= spots["intensidad"]
         if ii==0: today = np.floor(jda[0])
         XX[ii,:] = x
         YY[ii,:] = y
@@ -543,13 +888,9 @@ def Plot1night(night):
         ii = ii+1
     
 	# Calculamos los offsets de cada spot respecto a la mediana de ese spot en todos los arcos de la noche
-    nXX = np.zeros((nfiles, 199))
-    nYY = np.zeros((nfiles, 199))
-    nIN = np.zeros((nfiles, 199))
-    for i in range(199):
-        nXX[:,i] = (XX[:,i]-np.median(XX[:,i]))#*0.037517/5500. * 299792458
-        nYY[:,i] = (YY[:,i]-np.median(YY[:,i]))#*0.037517/5500. * 299792458
-        nIN[:,i] = IN[:,i]/np.mean(IN[:,i])
+    nXX = (XX-np.median(XX,axis=0))#*0.037517/5500. * 299792458
+    nYY = (YY-np.median(YY,axis=0))#*0.037517/5500. * 299792458
+    nIN = IN/np.mean(IN,axis=0)
     
     # Inicializamos el plot
     plt.figure(figsize=(12,7))
@@ -562,12 +903,9 @@ def Plot1night(night):
     ax.get_xaxis().set_ticks([])
     ax.set_ylim([-50,55])
     ax.set_xlim([np.min(JD)*24.-0.2,np.max(JD)*24.+0.2])
-    for i in range(199):
-        Xplot = (XX[:,i]-np.median(XX[:,i]))*1.e3
-        plt.plot((JD[:,i])*24.,Xplot,'+',c='Silver',zorder=-1,alpha=0.6)
-    for i in range(nfiles):
-        Xplot = nXX[i,:]*1.e3
-        plt.errorbar((JD[i,0])*24.,np.median(Xplot),yerr=sigmaG(Xplot),fmt='o',c='b',zorder=1)
+    # Todos los spots se dibujan en una única serie de marcadores, y la mediana de cada arco en una única serie de barras de error
+    plt.plot((JD*24.).ravel(),(nXX*1.e3).ravel(),'+',c='Silver',zorder=-1,alpha=0.6)
+    plt.errorbar(JD[:,0]*24.,np.median(nXX*1.e3,axis=1),yerr=sigmaG(nXX*1.e3,axis=1),fmt='o',c='b',zorder=1)
     
     # Plot para los offsets relativos en la dirección Y
     ax = plt.subplot(gs[1,0])
@@ -575,24 +913,31 @@ def Plot1night(night):
     ax.get_xaxis().set_ticks([])
     ax.set_ylim([-50,50])
     ax.set_xlim([np.min(JD)*24.-0.2,np.max(JD)*24.+0.2])
-    for i in range(199):
-        Xplot = (YY[:,i]-np.median(YY[:,i]))*1.e3
-        plt.plot((JD[:,i])*24.,Xplot,'+',c='Silver',zorder=-1,alpha=0.6)
-    for i in range(nfiles):
-        Xplot = nYY[i,:]*1.e3
-        plt.errorbar((JD[i,0])*24.,np.median(Xplot),yerr=sigmaG(Xplot),fmt='o',c='r',zorder=1)
+    plt.plot((JD*24.).ravel(),(nYY*1.e3).ravel(),'+',c='Silver',zorder=-1,alpha=0.6)
+    plt.errorbar(JD[:,0]*24.,np.median(nYY*1.e3,axis=1),yerr=sigmaG(nYY*1.e3,axis=1),fmt='o',c='r',zorder=1)
     # Plot para la intensidad
     ax = plt.subplot(gs[2,0])
     ax.set_ylabel('Norm. Intensity')
     ax.set_xlabel('JD-2457594 (h)')
     ax.set_ylim([0.95,1.02])
     ax.set_xlim([np.min(JD)*24.-0.2,np.max(JD)*24.+0.2])
-    for i in range(199):
-        plt.plot((JD[:,i])*24.,nIN[:,i],'+',c='Silver',zorder=-1,alpha=0.6)
-    for i in range(nfiles):
-        plt.errorbar((JD[i,0])*24.,np.median(nIN[i,:]),yerr=sigmaG(nIN[i,:]),fmt='o',c='forestgreen',zorder=1)
+    plt.plot((JD*24.).ravel(),nIN.ravel(),'+',c='Silver',zorder=-1,alpha=0.6)
+    plt.errorbar(JD[:,0]*24.,np.median(nIN,axis=1),yerr=sigmaG(nIN,axis=1),fmt='o',c='forestgreen',zorder=1)
     
-    plt.savefig("./Rut01_dat/Rutina01_plot_1night_"+night[0:6]+".pdf") 
+    plt.savefig(getPlot1night(night))
+
+"""
+Funcion que devuelve el fichero PDF con el plot de una noche
+"""
+def getPlot1night(night):
+    return "./Rut01_dat/Rutina01_plot_1night_"+night[0:6]+".pdf"
+
+"""
+Funcion que lanza el plot de una noche a partir de su fichero binario de resultados, si han cambiado
+los resultados desde que se dibujó. Con esperar=True se dibuja en el proceso actual.
+"""
+def lanzarPlot1night(night, esperar=False):
+    return RenderizadoPlots.lanzar(Plot1night,(night,),getPlot1night(night),[getFicheroNoche(night)],esperar=esperar)
 
 """
 tbdata=getMatrizDatos("./cali_0075.fits")
@@ -7,17 +7,24 @@ Objetivo: Determinar la posición de los órdenes en ciertas columnas del CCD
 
 """
 
-from astropy.io import fits
 import numpy as np
-from scipy.optimize import curve_fit
-from astropy.io import ascii
-import matplotlib.pyplot as plt
-import os.path
-from dateutil import parser
-import astropy.time
-import matplotlib.gridspec as gridspec # GRIDSPEC !
 import datetime
-from jdcal import gcal2jd
+import glob
+import os
+import os.path
+import multiprocessing
+import AccesoFrames
+import AjusteLote
+import CacheResultados
+import CombinacionFrames
+import Instrumentacion
+import CatalogoCabeceras
+import HistorialNoches
+import RenderizadoPlots
+import ResultadosNoche
+import CuboHistorial
+import LecturaAnticipada
+import Planificador
 
 """
 Fichero que almacena las posiciones de cada uno de los ordenes medidas con el DS9 para la columna central
@@ -34,6 +41,44 @@ Constante donde se almacena el nombre del fichero Master para la rutina 01. En 
 """
 FICH_MASTER="./Rut02_dat/ordenes_master.txt"
 
+"""
+Fichero PDF con el plot del historial de los últimos 180 días
+"""
+PLOT_HISTORIA="orden_history_CAFE.pdf"
+
+"""
+Columnas del fichero Master. La primera, el día juliano de la noche, es la clave del historial.
+"""
+COLUMNAS_MASTER=['juldate', 'desv_Orden10', 'desv_Orden40', 'desv_Orden70']
+
+"""
+Constante que indica si el ajuste de las posiciones de los ordenes se realiza por lotes,
+es decir, ajustando a la vez todos los ordenes de cada columna.
+"""
+AJUSTE_LOTE=True
+
+"""
+Indica si se trazan los ordenes en todas las columnas de cada flat (ver trazarFlat). Se activa con CAFE_TRAZAS=1.
+"""
+MODO_TRAZAS=os.environ.get("CAFE_TRAZAS","0")=="1"
+
+"""
+Parámetros del trazado de los ordenes: anchura (en columnas) de cada bin de columnas, grado del polinomio
+de la traza de cada orden, radio (en píxeles) de la ventana en la que se busca el máximo de cada orden en
+cada bin, y número de desviaciones (robustas) a partir del cual se descarta un bin en el ajuste de la traza
+"""
+ANCHO_BIN=5
+GRADO_TRAZA=3
+RADIO_TRAZA=6
+RECORTE_TRAZA=5.
+
+"""
+Método con el que se combinan los flats de cada noche en un flat master antes del ajuste ("mediana" o "sigma",
+ver CombinacionFrames), de modo que se ajusta un único flat por noche. Por defecto (cadena vacía) se ajusta cada
+flat por separado. Se indica con la variable de entorno CAFE_FLAT_MASTER.
+"""
+COMBINACION_FLATS=os.environ.get("CAFE_FLAT_MASTER","")
+
 """
 Función que devuelve la gausiana con los parámetros:
 - x: altura de la campana.
@@ -46,16 +91,41 @@ def gaus(x,a,x0,sigma,zero):
     return zero + a*np.exp(-(x-x0)**2/(2*sigma**2))
 
 
+"""
+Versión por lotes de la función gaus. Recibe una matriz x (N,M) y una matriz de
+parámetros p (N,4) con las columnas a, x0, sigma y zero.
+"""
+def gausLote(x,p):
+    return p[:,3:4] + p[:,0:1]*np.exp(-(x-p[:,1:2])**2/(2*p[:,2:3]**2))
+
+"""
+Derivadas parciales de la función gaus respecto a cada parámetro (a, x0, sigma, zero).
+Devuelve una matriz (N,M,4) necesaria para el ajuste por lotes.
+"""
+def jacobianoGausLote(x,p):
+    a=p[:,0:1]
+    x0=p[:,1:2]
+    sigma=p[:,2:3]
+    expo=np.exp(-(x-x0)**2/(2*sigma**2))
+    J=np.empty(x.shape+(4,))
+    J[:,:,0]=expo
+    J[:,:,1]=a*expo*(x-x0)/sigma**2
+    J[:,:,2]=a*expo*(x-x0)**2/sigma**3
+    J[:,:,3]=1.
+    return J
+
 """
 Funcion que obtiene la matriz de datos a partir de una imagen de flat.
 """
 def getMatrizDatos(arcoFits):
+    from astropy.io import fits
     # Abrimos el fichero de arco
     hdulist=fits.open(arcoFits);
     #Obtenemos la matriz con los datos
     tbdata = hdulist[0].data
     #cerramos el fichero
     hdulist.close();
+    Instrumentacion.contar('ficherosLeidos')
     #Hallamos la matriz traspuesta, puesto que hdulist contiene la matriz traspuesta de la imagen
     tbdata_traspuesta=tbdata.transpose()
     return tbdata_traspuesta
@@ -86,163 +156,604 @@ def getConfiguracion(fichero):
     return ordenesPosY
 
 """
-Funcion que a partir del fichero fits con cada orden y el fichero de configuración,
-genera una matriz por cada coeficiente que se ajuste. En dicha matriz contendrá el
-valor del coeficiente para cada columna en la imagen.
-Para el cálculo, se ha cogido la columna central de la imagen y 17 columnas a la izquierda
-y a la derecha de la columna central con la separación de 60 píxeles.
+Funcion que ajusta cada uno de los ordenes en una columna de la imagen.
+Se recibe el rango de pixeles XX, el vector YY con la suma de las columnas y las posiciones
+iniciales de cada orden. Para cada orden se toma una ventana de 18 pixeles alrededor de su posicion
+y se ajusta a una gaussiana con curve_fit. Si el ajuste falla se mantiene la posición inicial
+y se almacena 0.0 como sigma y umbral.
+Devuelve tres vectores con las nuevas posiciones, sigmas y umbrales de cada orden.
 """
-def generarAjuste(fich_ordenes, fich_conf):
-    # Obtenemos la matriz con los datos del fichero fits
-    mat=getMatrizDatos(fich_ordenes)
+def ajustarColumna(XX, YY, posiciones, fich_ordenes):
+    from scipy.optimize import curve_fit
+    newPos=[]
+    newSigma=[]
+    newUmbral=[]
+    for y0 in posiciones:
+        # La ventana comienza en el pixel entero de la posición del orden
+        ini=int(y0)
+        x=XX[ini-9:ini+9]
+        y=YY[ini-9:ini+9]
+        Instrumentacion.contar('ajustes')
+        try:
+            p0=[np.max(y)-y[0],y0,2.,y[0]]
+            # Realizamos el ajuste
+            coeff,pcov = curve_fit(gaus,x,y,p0)
+            # Almacenamos los valores obtenidos en los vectores para cada orden
+            newPos.append(coeff[1])
+            newSigma.append(coeff[2])
+            newUmbral.append(coeff[3])
+        except:
+            Instrumentacion.contar('ajustesFallidos')
+            #Almacenamos los valores obtenidos en los vectores para cada orden
+            newPos.append(y0)
+            newSigma.append(0.0)
+            newUmbral.append(0.0)
+            print "Rutina 2 WARNING: el flat "+fich_ordenes+" no se ajustó correctamente"
+    return newPos,newSigma,newUmbral
+
+"""
+Versión por lotes de ajustarColumna. Se construye una matriz con las ventanas de 18 pixeles
+de todos los ordenes de la columna y se ajustan todas las gaussianas a la vez con AjusteLote.
+Los ordenes cuya ventana se sale de la imagen o cuyo ajuste no converge mantienen la posición
+inicial y se almacena 0.0 como sigma y umbral, igual que en ajustarColumna.
+"""
+def ajustarColumnaLote(XX, YY, posiciones, fich_ordenes):
+    posiciones=np.asarray(posiciones,dtype=np.float64)
+    # La ventana de cada orden comienza en el pixel entero de su posición
+    ini=posiciones.astype(int)-9
+    dentro=(ini>=0) & (ini+18<=len(YY))
+    indices=np.clip(ini,0,len(YY)-18)[:,None]+np.arange(18)
+    x=XX[indices].astype(np.float64)
+    y=YY[indices].astype(np.float64)
+    p0=np.empty((len(posiciones),4))
+    p0[:,0]=np.max(y,axis=1)-y[:,0]
+    p0[:,1]=posiciones
+    p0[:,2]=2.
+    p0[:,3]=y[:,0]
+    # Realizamos el ajuste de todos los ordenes
+    coeff,convergido=AjusteLote.levenbergMarquardt(gausLote,jacobianoGausLote,x,y,p0)
+    correcto=convergido & dentro
+    Instrumentacion.contar('ajustes',len(posiciones))
+    Instrumentacion.contar('ajustesFallidos',np.sum(~correcto))
+    newPos=list(np.where(correcto,coeff[:,1],posiciones))
+    newSigma=list(np.where(correcto,coeff[:,2],0.0))
+    newUmbral=list(np.where(correcto,coeff[:,3],0.0))
+    for i in range(np.sum(~correcto)):
+        print "Rutina 2 WARNING: el flat "+fich_ordenes+" no se ajustó correctamente"
+    return newPos,newSigma,newUmbral
+
+"""
+Funcion que devuelve la posición de las 17 columnas que se ajustan en cada barrido. Hacia la izquierda
+(sentido -1) se parte de la columna central de la imagen y hacia la derecha (sentido 1) de la columna
+situada a 60 píxeles de ella, con una separación de 60 píxeles entre columnas.
+"""
+def getColumnasBarrido(sentido):
+    # Definimos el salto entre cada columna
+    salto=60
+    # Fijo la posición de la primera columna en el centro de la imagen
+    if sentido<0:
+        return [1024-salto*i for i in range(17)]
+    return [1024+salto*(i+1) for i in range(17)]
+
+"""
+Funcion que suma las 5 columnas de la imagen que comienzan en posX y devuelve sus valores en un vector
+"""
+def sumarColumnas(mat, posX):
+    return np.sum(mat[posX:posX+5,:], axis=0)
+
+"""
+Funcion que realiza el barrido de las columnas de la imagen en un sentido (-1 a la izquierda, 1 a la derecha)
+a partir de las posiciones del fichero de configuración. Se recibe el vector con la suma de cada columna del
+barrido (ver getColumnasBarrido y sumarColumnas). Las posiciones ajustadas en cada columna, corregidas por la
+inclinación de los ordenes, son las posiciones iniciales de la siguiente.
+Cada barrido comienza de nuevo a partir del fichero de configuración, por lo que los dos son independientes.
+Devuelve las listas con la posición X de cada columna y con las posiciones, sigmas y umbrales de los ordenes,
+en el orden del barrido.
+"""
+def barrido(columnas, fich_conf, sentido, ajustar, fich_ordenes):
     # Obtenemos las posiciones del fichero de configuración de cada uno de los órdenes
     posiciones=getConfiguracion(fich_conf)
     # Definimos el rango de los pixeles de la imagen
     XX = np.arange(0,2048)
-    # Fijo la posición de la primera columna en el centro de la imagen
-    posX=1024
-    # Vector y matriz para almacenar las nuevas posiciones de los ordenes
-    newPos=[]
-    matPosY=[]
     matPosX=[]
-    # Vector y matriz para almacenar los nuevos valores de sigma
-    newSigma=[]
+    matPosY=[]
     matSigma=[]
-    # Vector y matriz para almacenar los nuevos valores umbrales
-    newUmbral=[]
     matUmbral=[]
-    # Definimos el salto entre cada columna
-    salto=60
-    # Repetimos este proceso de ajuste para la columna central y para 17 columnas más a la izquierda de esta
-    for i in range(17):
-        # Sumo para la posición determinada 5 columnas y obtengo sus valores en un vector YY
-        YY = np.sum(mat[posX:posX+5,:], axis=0)
-        for y0 in posiciones:
-            x=XX[y0-9:y0+9]
-            y=YY[y0-9:y0+9]
-            try:
-                p0=[np.max(y)-y[0],y0,2.,y[0]]
-                # Realizamos el ajuste
-                coeff,pcov = curve_fit(gaus,x,y,p0)
-                # Almacenamos los valores obtenidos en los vectores para cada orden
-                newPos.append(coeff[1])
-                newSigma.append(coeff[2])
-                newUmbral.append(coeff[3])
-            except:
-                #Almacenamos los valores obtenidos en los vectores para cada orden
-                newPos.append(y0)
-                newSigma.append(0.0)
-                newUmbral.append(0.0)
-                print "Rutina 2 WARNING: el flat "+fich_ordenes+" no se ajustó correctamente"
-            
-        matPosX.insert(0,(posX+posX+5.)/2.)
-        #Desplazamos la posicion de la columna "salto" pixeles a la izquierda
-        posX=posX-salto
-        #Actualizamos el nuevo vector de posiciones
-        posiciones = np.array(newPos[:])- (np.array(newPos[:])*4./2048.)
-        #Almacenamos los datos en las matrices correspondientes, al inicio de las mismas
-        matPosY.insert(0,posiciones)
-        matSigma.insert(0,newSigma)
-        matUmbral.insert(0,newUmbral)
-        
-        #print matPosX
-        # Vaciamos los vectores
-        newPos=[]
-        newSigma=[]
-        newUmbral=[]
-    
-    #Repetimos el proceso de ajute para los valores que están a la derecha de la columna central
-    #Inicializamos el vector de posiciones al valor obtenido para la columna central
-    #posiciones=np.array(matPosY[len(matPosY)-1:])[0]
-    posiciones=getConfiguracion(fich_conf)
-    posX=1024+salto
-    for i in range(17):
-        YY = np.sum(mat[posX:posX+5,:], axis=0)
-        for y0 in posiciones:
-            x=XX[y0-9:y0+9]
-            y=YY[y0-9:y0+9]
-            try:
-                p0=[np.max(y)-y[0],y0,2.,y[0]]
-                # Realizamos el ajuste
-                coeff,pcov = curve_fit(gaus,x,y,p0)
-                # Almacenamos los valores obtenidos en los vectores para cada orden
-                newPos.append(coeff[1])
-                newSigma.append(coeff[2])
-                newUmbral.append(coeff[3])
-            except:
-                #Almacenamos los valores obtenidos en los vectores para cada orden
-                newPos.append(y0)
-                newSigma.append(0.0)
-                newUmbral.append(0.0)
-                print "Rutina 2 WARNING: el flat "+fich_ordenes+" no se ajustó correctamente"
-        
+    for posX,YY in zip(getColumnasBarrido(sentido),columnas):
+        # Ajustamos todos los ordenes de la columna
+        newPos,newSigma,newUmbral=ajustar(XX,YY,posiciones,fich_ordenes)
         matPosX.append((posX+posX+5.)/2.)
-        #Desplazamos la posicion de la columna "salto" pixeles a la derecha
-        posX=posX+salto
         #Actualizamos el nuevo vector de posiciones
-        posiciones = np.array(newPos[:])+ (np.array(newPos[:])*4./2048.)
-        #Almacenamos los datos en las matrices correspondientes, al final de las mismas
+        posiciones = np.array(newPos[:])+sentido*(np.array(newPos[:])*4./2048.)
         matPosY.append(posiciones)
         matSigma.append(newSigma)
         matUmbral.append(newUmbral)
-        
-        # Vaciamos los vectores
-        newPos=[]
-        newSigma=[]
-        newUmbral=[]
-    
+    return matPosX,matPosY,matSigma,matUmbral
+
+"""
+Funcion que une los resultados de los barridos a la izquierda y a la derecha, con las columnas ordenadas de
+izquierda a derecha. Devuelve las matrices de posiciones, sigmas y umbrales y el vector de posiciones X.
+"""
+def unirBarridos(izquierda, derecha):
+    # Las columnas de la izquierda se almacenan al inicio de las matrices, de la más lejana a la central
+    matPosX,matPosY,matSigma,matUmbral=[list(reversed(i))+list(d) for i,d in zip(izquierda,derecha)]
     return matPosY,matSigma,matUmbral,matPosX
 
 """
-Función que se encarga de escribir el contenido de una matriz en un fichero
+Funcion que a partir del fichero fits con cada orden y el fichero de configuración,
+genera una matriz por cada coeficiente que se ajuste. En dicha matriz contendrá el
+valor del coeficiente para cada columna en la imagen.
+Para el cálculo, se ha cogido la columna central de la imagen y 17 columnas a la izquierda
+y a la derecha de la columna central con la separación de 60 píxeles (ver barrido).
+Si lote es True se ajustan a la vez todos los ordenes de cada columna (ajustarColumnaLote),
+en caso contrario se realiza un ajuste con curve_fit para cada orden (ajustarColumna).
+Opcionalmente se recibe la matriz de datos del flat, si ya se ha leído (ver procesarListaFlats).
+"""
+def generarAjuste(fich_ordenes, fich_conf, lote=AJUSTE_LOTE, mat=None):
+    # Elegimos el modo de ajuste de cada columna: todos los ordenes a la vez o uno a uno
+    ajustar=getFuncionAjuste(lote)
+    # Obtenemos la matriz con los datos del fichero fits
+    if mat is None:
+        mat=getMatrizDatos(fich_ordenes)
+    # Realizamos el barrido hacia la izquierda y hacia la derecha de la columna central
+    izquierda=barrido([sumarColumnas(mat,posX) for posX in getColumnasBarrido(-1)],fich_conf,-1,ajustar,fich_ordenes)
+    derecha=barrido([sumarColumnas(mat,posX) for posX in getColumnasBarrido(1)],fich_conf,1,ajustar,fich_ordenes)
+    return unirBarridos(izquierda,derecha)
+
+"""
+Funcion que devuelve la función con la que se ajustan los ordenes de cada columna
+"""
+def getFuncionAjuste(lote=AJUSTE_LOTE):
+    if lote:
+        return ajustarColumnaLote
+    return ajustarColumna
+
+"""
+Funcion que realiza uno de los barridos de un fichero flat en un proceso del pool (ver procesarListaFlats).
+De la imagen, proyectada en memoria en modo de solo lectura, solo se leen las columnas del barrido, de modo
+que los procesos comparten la imagen en lugar de recibir cada uno una copia.
+"""
+def barridoFlat(fichero, fich_conf, sentido, lote=AJUSTE_LOTE):
+    inicios=getColumnasBarrido(sentido)
+    columnas=[np.sum(franja, axis=0) for franja in AccesoFrames.leerFranjas(fichero,inicios,5)]
+    return barrido(columnas,fich_conf,sentido,getFuncionAjuste(lote),fichero)
+
+"""
+Función que se encarga de escribir el contenido de una matriz en un fichero, con 4 decimales.
+Se forma el texto completo y se escribe de una vez.
 """
 def escribirMatriz(mat,nomFichero):
     matriz=np.array(mat).transpose()
+    lineas=[",".join([str(round(dato,4)) for dato in fila])+"\n" for fila in matriz.tolist()]
     outfile = open(nomFichero,"w")
-    for i in range(0,len(matriz)):
-        for j in range(0,len(matriz[i])):
-            dato=round(matriz[i][j],4)
-            outfile.write(str(dato))
-            if j<len(matriz[i])-1:
-                outfile.write(",")
-        outfile.write("\n")
+    outfile.write("".join(lineas))
     outfile.close()
             
 
+"""
+Funcion que devuelve el tipo (array estructurado de numpy) del ajuste de un fichero flat, con una fila
+por cada columna del CCD ajustada:
+- posX = posición X de la columna
+- posY, sigma, umbral = vectores con la posición, la anchura y el valor umbral de cada orden en la columna
+"""
+def getTipoAjuste(numOrdenes):
+    return np.dtype([('posX',np.float64),('posY',np.float64,(numOrdenes,)),
+                     ('sigma',np.float64,(numOrdenes,)),('umbral',np.float64,(numOrdenes,))])
+
+"""
+Funcion que genera el ajuste de un fichero flat y, si exportar es True, escribe en el directorio Rut02_dat
+el fichero con las posiciones de las órdenes. Devuelve el array estructurado con el ajuste (ver getTipoAjuste);
+ajuste['posY'] es la matriz (columnas x ordenes) con las posiciones de cada orden.
+Opcionalmente se recibe la matriz de datos del flat, si ya se ha leído.
+"""
+def procesarFlat(fichero, exportar=True, mat=None):
+    #Obtenemos el ajuste de cada orden
+    return crearAjuste(fichero,generarAjuste(fichero,INPUT_ORDEN,mat=mat),exportar)
+
+"""
+Funcion que crea el array estructurado con el ajuste de un fichero flat a partir de las matrices devueltas
+por generarAjuste y, si exportar es True, escribe el fichero con las posiciones de las órdenes
+"""
+def crearAjuste(fichero, matrices, exportar=True):
+    matPos,matSigma,matUmbral,matPosX = matrices
+    ajuste=np.zeros(len(matPosX),dtype=getTipoAjuste(len(matPos[0])))
+    ajuste['posX']=matPosX
+    ajuste['posY']=matPos
+    ajuste['sigma']=matSigma
+    ajuste['umbral']=matUmbral
+    #Escribimos en un fichero el resultado
+    if exportar:
+        escribirMatriz(matPos,getFicheroAjuste(fichero))
+    return ajuste
+
+"""
+Funcion que devuelve el nombre del fichero con las posiciones de las órdenes de un fichero flat
+o del flat master de una noche
+"""
+def getFicheroAjuste(fichero):
+    # El flat master de la noche ya está en Rut02_dat y su nombre incluye la noche
+    if esMasterFlat(fichero):
+        return fichero[0:len(fichero)-5]+"_dat.txt"
+    nomFichero = fichero[0:len(fichero)-5]+"_"+fichero[0:6]+"_dat.txt"
+    return "./Rut02_dat/"+nomFichero[nomFichero.index('/')+1:]
+
+"""
+Funcion que procesa un fichero flat reutilizando el ajuste guardado en la caché si no han cambiado
+el fichero ni el fichero con las posiciones iniciales de las órdenes
+"""
+def procesarFlatCache(fichero):
+    return CacheResultados.ejecutar(procesarFlat,[fichero,INPUT_ORDEN],[getFicheroAjuste(fichero)],fichero)
+
+"""
+Funcion que genera el ajuste de una lista de ficheros flat. Devuelve la lista con el ajuste de cada flat.
+Con un proceso, cada flat se lee por adelantado mientras se ajusta el anterior (ver LecturaAnticipada).
+Con varios procesos, los dos barridos de cada flat se reparten como tareas independientes entre los
+procesos de un pool (ver barridoFlat). El resultado es idéntico en los dos casos.
+Dentro de un proceso del pool (por ejemplo en el reprocesado por lotes) no se pueden crear otros procesos,
+por lo que se utiliza siempre un único proceso.
+"""
+def procesarListaFlats(flats, numProcesos=1):
+    if numProcesos<=1 or multiprocessing.current_process().daemon:
+        return [procesarFlat(fichero,mat=mat) for fichero,mat in LecturaAnticipada.anticipar(getMatrizDatos,flats)]
+    pool=multiprocessing.Pool(numProcesos)
+    try:
+        barridos=[[pool.apply_async(Planificador.ejecutarTarea,(barridoFlat,(fichero,INPUT_ORDEN,sentido)))
+                   for sentido in (-1,1)] for fichero in flats]
+        listaAjustes=[]
+        for fichero,resultados in zip(flats,barridos):
+            valores=[]
+            for resultado in resultados:
+                valor,cpu,registro,texto=resultado.get()
+                Instrumentacion.combinar(registro)
+                valores.append(valor)
+            listaAjustes.append(crearAjuste(fichero,unirBarridos(*valores)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return listaAjustes
+
+"""
+Funcion que devuelve el nombre del fichero .fits con el flat master de una noche
+"""
+def getFicheroMasterFlat(noche):
+    return "./Rut02_dat/flat_master_"+noche+".fits"
+
+"""
+Funcion que devuelve True si el fichero es el flat master de una noche
+"""
+def esMasterFlat(fichero):
+    return os.path.basename(fichero).startswith("flat_master_")
+
+"""
+Funcion que combina los flats de una noche en el flat master de la noche con el método indicado (ver
+CombinacionFrames) y lo escribe en Rut02_dat, con la cabecera del primer flat. La noche es el directorio
+de los flats. Devuelve el nombre del fichero del flat master.
+"""
+def combinarFlats(flats, combinacion):
+    fichMaster=getFicheroMasterFlat(os.path.basename(os.path.dirname(os.path.normpath(flats[0]))))
+    print "Combinando %d flats en %s (%s)"%(len(flats),fichMaster,combinacion)
+    CombinacionFrames.escribir(fichMaster,CombinacionFrames.combinar(flats,combinacion),flats,combinacion)
+    return fichMaster
+
+"""
+Funcion que combina los flats de una noche reutilizando el flat master si no ha cambiado ninguno de ellos
+y el fichero del flat master existe. El flat master no se guarda en la caché, puesto que ya está en Rut02_dat.
+"""
+def combinarFlatsCache(flats, combinacion=None):
+    if combinacion is None:
+        combinacion=COMBINACION_FLATS
+    flats=list(flats)
+    guardado=CacheResultados.consultar(combinarFlats,flats,flats,combinacion)
+    if guardado is not None and os.path.exists(guardado[0]):
+        return guardado[0]
+    fichMaster=combinarFlats(flats,combinacion)
+    CacheResultados.guardar(combinarFlats,flats,[],fichMaster,flats,combinacion)
+    return fichMaster
+
+"""
+Funcion que devuelve la lista de flats que se ajustan en una noche: si se indica un método de combinación
+(por defecto COMBINACION_FLATS), el flat master de la noche (ver combinarFlatsCache) y si no, los propios flats
+"""
+def getFlatsAjuste(flats, combinacion=None):
+    if combinacion is None:
+        combinacion=COMBINACION_FLATS
+    if combinacion=="" or len(flats)==0:
+        return flats
+    return [combinarFlatsCache(flats,combinacion)]
+
 """
 Esta funcion se encarga de generar el ajute para una lista de ficheros de flat.
 Este listado de flats vendrá dado en un fichero que se le pasará a la función por parámetro.
 Se generará un fichero con las posiciones de las órdenes de cada una de las imagenes flat
+Opcionalmente se indica el número de procesos con los que se ajustan los flats (ver procesarListaFlats)
+y el método con el que se combinan los flats antes del ajuste (ver getFlatsAjuste).
 """    
-def rutina02Run(listaFlat):
-    # Creamos una lista para almacenar todos los ajustes de una noche
-    listaAjustes=[]
+def rutina02Run(listaFlat, numProcesos=1, combinacion=None):
     # Abrimos el fichero con el listado de ficheros flat
     infile = open(listaFlat,'r')
-    # Procesamos cada una de las lineas del fichero, y generamos las estadísticas para cada fichero de flat
-    for line in infile:
-        #Eliminamos de la linea el retorno de carro (\n)
-        line=line.strip()
-        #Comprobamos que la linea tenga información y no sea una linea en blanco
-        if len(line)>0:
-            #Obtenemos el ajuste de cada orden
-            matPos,matSigma,matUmbral,matPosX = generarAjuste(line,INPUT_ORDEN)
-            #Escribimos en un fichero el resultado
-            nomFichero = line[0:len(line)-5]+"_"+line[0:6]+"_dat.txt"
-            escribirMatriz(matPos,"./Rut02_dat/"+nomFichero[nomFichero.index('/')+1:])
-            listaAjustes.append(np.array(matPos))
+    # Eliminamos de cada linea el retorno de carro (\n) y descartamos las lineas en blanco
+    flats=[line.strip() for line in infile if len(line.strip())>0]
+    infile.close()
+    # Generamos el ajuste de cada fichero de flat (o del flat master de la noche)
+    listaAjustes=procesarListaFlats(getFlatsAjuste(flats,combinacion),numProcesos)
     # Realizamos el chequeo
     checkRutina02(listaAjustes, listaFlat)
 
 
+"""
+Funcion que devuelve el nombre del fichero binario con los ajustes de todos los flats de una noche
+"""
+def getFicheroNoche(noche):
+    return "./Rut02_dat/ordenes_"+noche+".npy"
+
+"""
+Funcion que guarda en el fichero binario de la noche el ajuste de cada flat.
+Se recibe la lista de imágenes flat y la lista con el ajuste de cada una.
+"""
+def guardarResultadosNoche(noche, flats, listaAjustes):
+    ResultadosNoche.guardar(getFicheroNoche(noche),flats,listaAjustes)
+
+"""
+Funcion que lee el fichero binario de una noche y devuelve la lista de imágenes flat y la lista
+con el ajuste de cada una. Si no existe se devuelven listas vacías.
+"""
+def leerResultadosNoche(noche):
+    return ResultadosNoche.leerResultados(getFicheroNoche(noche))
+
+"""
+Directorio del cubo con los ajustes de todos los flats de todas las noches (ver CuboHistorial)
+"""
+DIR_CUBO="./Rut02_dat/cubo_ordenes"
+
+"""
+Funcion que devuelve el día juliano de un fichero flat. Si el fichero ya no existe (por ejemplo al reconstruir
+el cubo a partir de resultados antiguos) se toma el mediodía de la noche, cuyo nombre tiene el formato AAMMDD.
+"""
+def getDiaJulianoFlat(fichero, noche):
+    if os.path.exists(fichero):
+        return getDiaJuliano(fichero)
+    return CatalogoCabeceras.fechaJuliana("20"+noche[0:2]+"-"+noche[2:4]+"-"+noche[4:6]+"T12:00:00")
+
+"""
+Funcion que añade al cubo de historial el ajuste de los flats de una noche
+"""
+def anadirCuboNoche(noche, flats, listaAjustes):
+    juldates=[getDiaJulianoFlat(flat,noche) for flat in flats]
+    CuboHistorial.anadirNoche(DIR_CUBO,noche,flats,juldates,listaAjustes)
+
+"""
+Funcion que devuelve la serie temporal de un campo del ajuste de los flats (posX, posY, sigma o umbral)
+a partir del cubo de historial. Opcionalmente se indican los índices de los ordenes y de las columnas del
+ajuste (0 a 33, la central es la 17) que se consultan, por defecto todos, y las noches inicial y final
+(formato AAMMDD). Devuelve el vector con el día juliano de cada flat y la matriz (columnas x ordenes x flats)
+con los valores, o (columnas x flats) para posX.
+"""
+def serieOrdenes(campo, ordenes=None, columnas=None, nocheInicial=None, nocheFinal=None):
+    juldates,valores=CuboHistorial.serie(DIR_CUBO,campo,columnas,nocheInicial,nocheFinal)
+    if ordenes is not None and valores.ndim==3:
+        valores=valores[:,ordenes,:]
+    return juldates,valores
+
+"""
+Funcion que calcula la desviación de la posición de los ordenes con respecto al ajuste inicial en cada flat
+del cubo de historial, igual que en el fichero Master (ver getDesviacionOrdenes), pero para cualquier orden
+y región de columnas. Se indican los índices de los ordenes y, opcionalmente, de las columnas (por defecto
+todas) y las noches inicial y final. Devuelve el vector con el día juliano de cada flat y la matriz
+(ordenes x flats) con la desviación media en las columnas indicadas.
+"""
+def derivaOrdenes(ordenes, columnas=None, nocheInicial=None, nocheFinal=None):
+    if columnas is None:
+        columnas=slice(None)
+    juldates,posiciones=serieOrdenes('posY',ordenes,columnas,nocheInicial,nocheFinal)
+    # Ajuste inicial con una fila por orden y una columna por cada columna del ajuste
+    ajusteInicial=np.loadtxt(AJUSTE_INICIAL,delimiter=",",ndmin=2)
+    referencia=ajusteInicial[ordenes][:,columnas].transpose()
+    if len(juldates)==0:
+        return juldates,np.zeros((len(ordenes),0))
+    return juldates,np.mean(referencia[:,:,np.newaxis]-posiciones,axis=0)
+
+"""
+Funcion que devuelve la posición X de las columnas del ajuste de generarAjuste: 17 columnas desde la central
+hacia la izquierda y 17 hacia la derecha, separadas 60 píxeles
+"""
+def getPosicionesColumnas():
+    return [(posX+posX+5.)/2. for posX in sorted(getColumnasBarrido(-1))+getColumnasBarrido(1)]
+
+"""
+Funcion que reconstruye el cubo de historial a partir de los resultados de Rut02_dat: el fichero binario
+de cada noche o, si no existe, sus ficheros _dat.txt. Los ficheros _dat.txt solo tienen la posición de los
+ordenes (con 4 decimales), por lo que la anchura y el umbral de esas noches quedan como NaN.
+"""
+def reconstruirCubo():
+    import shutil
+    if os.path.isdir(DIR_CUBO):
+        shutil.rmtree(DIR_CUBO)
+    noches=set(os.path.basename(f)[8:14] for f in glob.glob('./Rut02_dat/ordenes_[0-9]*.npy'))
+    noches.update(os.path.basename(f)[-14:-8] for f in glob.glob('./Rut02_dat/*_*_dat.txt'))
+    for noche in sorted(noches):
+        flats,listaAjustes=leerResultadosNoche(noche)
+        if len(listaAjustes)==0:
+            ficheros=sorted(glob.glob('./Rut02_dat/*_'+noche+'_dat.txt'))
+            flats=[noche+"/"+os.path.basename(f)[:-15]+".fits" for f in ficheros]
+            for fichero in ficheros:
+                posiciones=np.loadtxt(fichero,delimiter=",",ndmin=2).transpose()
+                ajuste=np.zeros(len(posiciones),dtype=getTipoAjuste(posiciones.shape[1]))
+                ajuste['posX']=getPosicionesColumnas()
+                ajuste['posY']=posiciones
+                ajuste['sigma']=np.nan
+                ajuste['umbral']=np.nan
+                listaAjustes.append(ajuste)
+        anadirCuboNoche(noche,flats,listaAjustes)
+        print "Noche "+noche+": "+str(len(listaAjustes))+" flats"
+
+"""
+Funcion que devuelve el tipo (array estructurado de numpy) de las trazas de un fichero flat, con una fila por orden:
+- coef = coeficientes del polinomio de la traza (de menor a mayor grado) en función de t=(x-1024)/1024,
+  donde x es la columna del CCD. coef[1] está relacionado con la inclinación del orden y coef[2] con su curvatura.
+- rms = desviación cuadrática media (en píxeles) de las posiciones medidas con respecto a la traza
+- bins = número de bins de columnas utilizados en el ajuste
+Si un orden no tiene bins suficientes para el ajuste sus coeficientes y su rms son NaN.
+"""
+def getTipoTraza(grado=GRADO_TRAZA):
+    return np.dtype([('coef',np.float64,(grado+1,)),('rms',np.float64),('bins',np.int64)])
+
+"""
+Funcion que devuelve la matriz de Vandermonde de las columnas indicadas para el polinomio de las trazas
+"""
+def getVandermonde(columnas, grado=GRADO_TRAZA):
+    return np.vander((np.asarray(columnas,dtype=np.float64)-1024.)/1024.,grado+1,increasing=True)
+
+"""
+Funcion que devuelve la posición aproximada de cada orden en las columnas indicadas, a partir del ajuste del
+flat de referencia (AJUSTE_INICIAL). En el ajuste se almacena la posición ajustada corregida por la inclinación
+de los ordenes para la siguiente columna del barrido (ver barrido), por lo que primero se deshace la corrección.
+Después se ajusta una parábola a las posiciones de cada orden, que permite extrapolarlas a los bordes de la imagen.
+Devuelve la matriz (columnas x ordenes).
+"""
+def getPosicionesReferencia(columnas):
+    ajusteInicial=np.loadtxt(AJUSTE_INICIAL,delimiter=",",ndmin=2).transpose()
+    sentidos=np.array([-1.]*17+[1.]*17)
+    posiciones=ajusteInicial/(1+sentidos[:,np.newaxis]*4./2048.)
+    coef=np.linalg.lstsq(getVandermonde(getPosicionesColumnas(),2),posiciones,rcond=None)[0]
+    return np.dot(getVandermonde(columnas,2),coef)
+
+"""
+Funcion que suma la matriz de datos en bins de ancho columnas consecutivas a partir de su suma acumulada.
+Devuelve la matriz (bins x filas) con la suma de cada bin y el vector con la columna central de cada bin.
+La suma acumulada se calcula sobre la matriz traspuesta (la imagen tal y como está en el fichero), en la
+que las columnas de cada fila son consecutivas en memoria.
+"""
+def binarColumnas(mat, ancho=ANCHO_BIN):
+    imagen=mat.transpose()
+    acumulada=np.zeros((imagen.shape[0],imagen.shape[1]+1))
+    np.cumsum(imagen,axis=1,dtype=np.float64,out=acumulada[:,1:])
+    numBins=imagen.shape[1]//ancho
+    bins=acumulada[:,ancho:numBins*ancho+1:ancho]-acumulada[:,0:numBins*ancho:ancho]
+    return bins.transpose(),np.arange(numBins)*ancho+(ancho-1)/2.
+
+"""
+Funcion que mide la posición de todos los ordenes en todos los bins a la vez. Se recibe la matriz con la suma
+de cada bin y la matriz (bins x ordenes) con la posición aproximada de cada orden. En una ventana de RADIO_TRAZA
+píxeles alrededor de la posición aproximada se toma el máximo y se ajusta una parábola al logaritmo de los tres
+píxeles centrales (perfil gaussiano), después de restar el mínimo de la ventana.
+Devuelve la matriz de posiciones y la matriz que indica si cada medida es válida: el orden está dentro de la
+imagen, el máximo no está en el borde de la ventana y la parábola tiene un máximo a menos de un píxel.
+"""
+def medirOrdenes(bins, aproximadas):
+    numFilas=bins.shape[1]
+    ini=np.rint(aproximadas).astype(int)-RADIO_TRAZA
+    dentro=(ini>=0)&(ini+2*RADIO_TRAZA<numFilas)
+    indices=np.clip(ini,0,numFilas-2*RADIO_TRAZA-1)[:,:,np.newaxis]+np.arange(2*RADIO_TRAZA+1)
+    ventanas=bins[np.arange(len(bins))[:,np.newaxis,np.newaxis],indices]
+    pico=np.argmax(ventanas,axis=2)
+    dentro&=(pico>=1)&(pico<=2*RADIO_TRAZA-1)
+    pico=np.clip(pico,1,2*RADIO_TRAZA-1)[:,:,np.newaxis]
+    fondo=np.min(ventanas,axis=2)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        a,c,d=[np.log(np.take_along_axis(ventanas,pico+k,axis=2)[:,:,0]-fondo) for k in (-1,0,1)]
+        curvatura=a-2*c+d
+        delta=0.5*(a-d)/curvatura
+        validas=dentro&np.isfinite(delta)&(curvatura<0)&(np.abs(delta)<=1)
+    return np.take_along_axis(indices,pico,axis=2)[:,:,0]+np.where(validas,delta,0.),validas
+
+"""
+Funcion que ajusta a la vez el polinomio de la traza de todos los ordenes por mínimos cuadrados, resolviendo
+el sistema de cada orden con sus medidas válidas. Después se descartan los bins que se alejan de la traza más
+de RECORTE_TRAZA desviaciones robustas y se repite el ajuste. Se recibe el vector con la columna central de cada
+bin y las matrices (bins x ordenes) de posiciones y de medidas válidas. Devuelve el array estructurado con las
+trazas (ver getTipoTraza).
+"""
+def ajustarTrazas(columnas, posiciones, validas, grado=GRADO_TRAZA):
+    V=getVandermonde(columnas,grado)
+    pesos=validas.astype(np.float64)
+    posiciones=np.where(validas,posiciones,0.)
+    for iteracion in range(2):
+        # Sistema normal de cada orden: (V^T W V) coef = V^T W y
+        A=np.einsum('bk,bo,bl->okl',V,pesos,V)
+        b=np.einsum('bk,bo->ok',V,pesos*posiciones)
+        suficientes=np.sum(pesos,axis=0)>grado+1
+        A[~suficientes]=np.eye(grado+1)
+        coef=np.linalg.solve(A,b[:,:,np.newaxis])[:,:,0]
+        residuos=posiciones-np.dot(V,coef.transpose())
+        if iteracion==0:
+            # Desviación robusta (1.4826 veces la mediana del valor absoluto de los residuos) de cada orden
+            mediana=np.array([np.median(np.abs(r[p>0])) if np.any(p>0) else 0. for r,p in zip(residuos.transpose(),pesos.transpose())])
+            pesos=pesos*(np.abs(residuos)<=RECORTE_TRAZA*1.4826*np.maximum(mediana,1e-3))
+    numBins=np.sum(pesos,axis=0)
+    trazas=np.zeros(posiciones.shape[1],dtype=getTipoTraza(grado))
+    trazas['coef']=np.where(suficientes[:,np.newaxis],coef,np.nan)
+    trazas['rms']=np.where(suficientes,np.sqrt(np.sum(pesos*residuos**2,axis=0)/np.maximum(numBins,1)),np.nan)
+    trazas['bins']=numBins
+    return trazas
+
+"""
+Funcion que evalúa las trazas en las columnas indicadas. Devuelve la matriz (ordenes x columnas) de posiciones.
+"""
+def evaluarTrazas(trazas, columnas):
+    return np.dot(trazas['coef'],getVandermonde(columnas,trazas['coef'].shape[1]-1).transpose())
+
+"""
+Funcion que traza los ordenes de un flat en todas las columnas de la imagen: se suman las columnas en bins de
+ANCHO_BIN columnas, se mide la posición de cada orden en cada bin partiendo de su posición en el flat de
+referencia, y se ajusta el polinomio de la traza de cada orden. A diferencia de generarAjuste, que ajusta una
+gaussiana a cada orden en 34 columnas, no hay ajustes iterativos, por lo que se trazan todas las columnas en
+menos tiempo. Devuelve el array estructurado con las trazas (ver getTipoTraza).
+Opcionalmente se recibe la matriz de datos del flat, si ya se ha leído.
+"""
+def trazarFlat(fichero, mat=None):
+    if mat is None:
+        mat=getMatrizDatos(fichero)
+    bins,columnas=binarColumnas(mat)
+    posiciones,validas=medirOrdenes(bins,getPosicionesReferencia(columnas))
+    Instrumentacion.contar('binsTrazados',validas.size)
+    Instrumentacion.contar('binsDescartados',np.sum(~validas))
+    return ajustarTrazas(columnas,posiciones,validas)
+
+"""
+Funcion que traza los ordenes de un flat reutilizando las trazas guardadas en la caché si no han cambiado
+el fichero ni el ajuste del flat de referencia
+"""
+def trazarFlatCache(fichero):
+    return CacheResultados.ejecutar(trazarFlat,[fichero,AJUSTE_INICIAL],[],fichero)
+
+"""
+Funcion que traza los ordenes de una lista de ficheros flat, leyendo cada flat por adelantado mientras se traza
+el anterior (ver LecturaAnticipada). Devuelve la lista con las trazas de cada flat.
+"""
+def trazarListaFlats(flats):
+    return [trazarFlat(fichero,mat) for fichero,mat in LecturaAnticipada.anticipar(getMatrizDatos,flats)]
+
+"""
+Funcion que devuelve el nombre del fichero binario con las trazas de todos los flats de una noche
+"""
+def getFicheroTrazas(noche):
+    return "./Rut02_dat/trazas_"+noche+".npy"
+
+"""
+Funcion que guarda en el fichero binario de la noche las trazas de cada flat.
+Se recibe la lista de imágenes flat y la lista con las trazas de cada una.
+"""
+def guardarTrazasNoche(noche, flats, listaTrazas):
+    ResultadosNoche.guardar(getFicheroTrazas(noche),flats,listaTrazas)
+
+"""
+Funcion que lee el fichero binario de las trazas de una noche y devuelve la lista de imágenes flat y la lista
+con las trazas de cada una. Si no existe se devuelven listas vacías.
+"""
+def leerTrazasNoche(noche):
+    return ResultadosNoche.leerResultados(getFicheroTrazas(noche))
+
 """
 Función que se encarga de genera el fichero Master de la rutina y de chequear los datos
 Se le proporciona una lista con el ajuste de todos los ficheros flat de una noche
+y, opcionalmente, el fichero Master donde se añade la noche.
 """
-def checkRutina02(listaAjustes, listaFlat):
+def checkRutina02(listaAjustes, listaFlat, fichMaster=FICH_MASTER):
     # Obtenemos la matriz con el ajuste inicial con el que calcularemos la desviación de las posiciones de cada orden
-    table = ascii.read(AJUSTE_INICIAL, format='csv')
-    ajusteInicial=np.array(table)
+    ajusteInicial=getAjusteInicial()
     
     # Creamos un vector donde almacenaremos las desviaciones de los ordenes 10, 40 y 70
     desviacionO10=[]
@@ -251,34 +762,49 @@ def checkRutina02(listaAjustes, listaFlat):
     
     # Calculamos la desviación de la posición de cada orden con respecto al flat inicial para la columna central (17)
     for ajuste in listaAjustes:
-        desv10=ajusteInicial[9][17]-ajuste[17][10]
+        desv10,desv40,desv70=getDesviacionOrdenes(ajuste['posY'],ajusteInicial)
         desviacionO10.append(desv10)
-        desv40=ajusteInicial[39][17]-ajuste[17][40]
         desviacionO40.append(desv40)
-        desv70=ajusteInicial[69][17]-ajuste[17][70]
         desviacionO70.append(desv70)
     # Calculamos las desviaciones medias para cada orden
     desvMedia10=np.mean(desviacionO10)
     desvMedia40=np.mean(desviacionO40)
     desvMedia70=np.mean(desviacionO70)
     
-    # Añadimos el valor de la media de todas las desviaciones de los ordenes 10 40 70 de la noche al fichero master
-    # Si existe el fichero lo abrimos en modo "a", sino lo creamos
-    if os.path.exists(FICH_MASTER):
-        file=open(FICH_MASTER,"a")
-    else:
-        file=open(FICH_MASTER,"w")
-        file.write("@juldate,desv_Orden10,desv_Orden40,desv_Orden70\n")
     # Abrimos el fichero con el listado de ficheros flat
     infile = open(listaFlat,'r')
     # Obtenemos el dia juliano para uno de los ficheros flat de la noche
     imagen = infile.readline().strip()
     infile.close()
     juldate=getDiaJuliano(imagen)
-    #Comprobamos que la entrada en el fichero no exista. En caso de no existir escribimos nueva entrada
-    if not existeNoche(np.int(juldate)):
-        file.write(str(np.int(juldate))+","+str(round(desvMedia10,4))+","+str(round(desvMedia40,4))+","+str(round(desvMedia70,4))+"\n")
-    file.close()
+    registrarRutina02(juldate, desvMedia10, desvMedia40, desvMedia70, fichMaster)
+
+"""
+Función que devuelve la matriz con el ajuste inicial (ordenes x columnas) del flat de referencia
+"""
+def getAjusteInicial():
+    from astropy.io import ascii
+    table = ascii.read(AJUSTE_INICIAL, format='csv')
+    return np.array(table)
+
+"""
+Función que devuelve la desviación de la posición de los ordenes 10, 40 y 70 de un ajuste
+con respecto al ajuste inicial en la columna central (17)
+"""
+def getDesviacionOrdenes(ajuste, ajusteInicial):
+    desv10=ajusteInicial[9][17]-ajuste[17][10]
+    desv40=ajusteInicial[39][17]-ajuste[17][40]
+    desv70=ajusteInicial[69][17]-ajuste[17][70]
+    return desv10,desv40,desv70
+
+"""
+Función que añade al fichero Master la entrada de la noche con las desviaciones medias
+de los ordenes 10, 40 y 70, y que realiza el chequeo de dichos valores.
+"""
+def registrarRutina02(juldate, desvMedia10, desvMedia40, desvMedia70, fichMaster=FICH_MASTER):
+    # Guardamos en el historial del fichero master la media de todas las desviaciones de los ordenes 10 40 70 de la noche
+    # Si ya existe una entrada para la noche se sustituye
+    HistorialNoches.guardarNoche(fichMaster,COLUMNAS_MASTER,[np.int(juldate),round(desvMedia10,4),round(desvMedia40,4),round(desvMedia70,4)])
     
     #Realizamos el checkeo para la rutina02
     # Si las desviciones medias de los ordenes son menores a 100 milipíxeles
@@ -304,35 +830,17 @@ Esta función devolverá true en caso de que exista en el fichero bias_master.tx
 una entrada para la noche que se introduce por parámetro, y false en caso contrario.
 El dia juliano introducido por parámetro debe ser un valor entero.
 """
-def existeNoche(diaJuliano):
-    # Abrimos el fichero en modo lectura
-    infile=open(FICH_MASTER,'r')
-    # Creamos una variable que inicialmente inicializamos a falso
-    existe=False
-    # Recorremos el fichero y comparamos cada una de las lineas
-    for line in infile:
-        #Ignoramos las lineas que comiencen por @, puesto que se trata de un comentario en el fichero
-        if line[0]!='@':
-            # Obtenemos el dia juliano almacenado en la primera posicion de la linea
-            linea=line.split(',')
-            juldate=np.int(linea[0])
-            if juldate==diaJuliano:
-                existe=True
-    infile.close()
-    return existe  
+def existeNoche(diaJuliano, fichMaster=FICH_MASTER):
+    # Consultamos el historial del fichero Master, indexado por el dia juliano
+    return HistorialNoches.existeNoche(fichMaster,diaJuliano)  
 
 """
 Funcion que obtiene el día juliano a partir de una imagen fit que se le pasa por parámetro.
+El día juliano se consulta en el catálogo de cabeceras, sin volver a abrir el fichero.
 """
 def getDiaJuliano(imagenFit):
-    # Abrimos el fichero
-    f=fits.open(imagenFit);
-    # Obtenemos la fecha y finalmente con astropy obtenemos el dia juliano
-    date=f[0].header["DATE"]
-    dt = parser.parse(date)
-    time = astropy.time.Time(dt)
-    juldate = time.jd
-    return juldate
+    # Obtenemos el dia juliano a partir del catálogo de cabeceras de la noche
+    return CatalogoCabeceras.getDiaJuliano(imagenFit)
         
     
 """
@@ -344,21 +852,27 @@ def cargarAjustes(flat_ref):
     matPos, matSigma, matUmbral, matPosX=generarAjuste(flat_ref, INPUT_ORDEN)
     escribirMatriz(matPos, AJUSTE_INICIAL)
 
+"""
+Funcion que genera el fichero inicial con el ajuste del flat de referencia reutilizando el guardado en la caché
+si no han cambiado la imagen flat de referencia ni el fichero con las posiciones iniciales de las órdenes
+"""
+def cargarAjustesCache(flat_ref):
+    CacheResultados.ejecutar(cargarAjustes,[flat_ref,INPUT_ORDEN],[AJUSTE_INICIAL],flat_ref)
+
 """
 Funcion encargada de añadir pintar y añadir al historial los resultados obtenidos en la noche que se esta ejecutando
 """
 def plotHistory():
-    colnames = ('jd','desv10','desv40','desv70')
-    table = ascii.read('Rut02_dat/ordenes_master.txt', format='csv', names=colnames, comment='@')	
-    jd  = np.array(table["jd"])
-    desv10   = np.array(table["desv10"])
-    desv40   = np.array(table["desv40"])
-    desv70   = np.array(table["desv70"])
-    
+    import astropy.time
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec # GRIDSPEC !
+    from jdcal import gcal2jd
     today = datetime.datetime.now()
     today = astropy.time.Time(today)
     jd_today = np.int(today.jd)
     jd_ini=jd_today-180
+    # Leemos del historial solo las noches de los ultimos 180 dias
+    jd,desv10,desv40,desv70 = HistorialNoches.leerColumnas(FICH_MASTER,jd_ini)
     
     plt.figure(figsize=(12,7))
     gs = gridspec.GridSpec(3,1)
@@ -369,7 +883,6 @@ def plotHistory():
     ax.get_xaxis().set_ticks([])
     ax.set_ylim([-1,1])
     ax.set_xlim([0,180])
-    arr = desv10
     plt.errorbar(jd-jd_ini,desv10,yerr=0,fmt='o',c='red')
     for year in range(10):
     	jdyear = gcal2jd(2011+year,1,1)
@@ -386,7 +899,6 @@ def plotHistory():
     ax.set_xlabel(label)
     ax.set_xlim([0,180])
     ax.set_ylim([-1,1])
-    arr = desv40
     plt.errorbar(jd-jd_ini,desv40,yerr=0,fmt='o',c='red')
     for year in range(10):
     	jdyear = gcal2jd(2011+year,1,1)
@@ -412,7 +924,14 @@ def plotHistory():
     plt.grid(ls=':',c='gray')
     plt.axhline(0.1,ls='--',c='red')
     plt.axhline(-0.1,ls='--',c='red')
-    plt.savefig('orden_history_CAFE.pdf')
+    plt.savefig(PLOT_HISTORIA)
+
+"""
+Funcion que lanza en segundo plano el plot del historial, si han cambiado los datos o el día desde que se dibujó
+"""
+def lanzarPlotHistory():
+    return RenderizadoPlots.lanzar(plotHistory,(),PLOT_HISTORIA,[FICH_MASTER],RenderizadoPlots.getDiaJulianoHoy())
+
 
 """  
 i=getMatrizDatos("./flat_160106_evening.fits")
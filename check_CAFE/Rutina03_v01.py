@@ -21,33 +21,19 @@ import astropy.time
 from dateutil import parser
 import os.path
 from os import listdir
+import HistorialNoches
 
 LOG_SNR="./Rut03_dat/log_snr.txt"
 
 """
-Esta función devolverá true en caso de que exista en el fichero log_snr.txt 
-una entrada para la noche que se introduce por parámetro, y false en caso contrario.
+Columnas del fichero log_snr.txt. La primera, el día juliano del espectro, es la clave del historial.
 """
-def existeNoche(diaJuliano):
-    # Abrimos el fichero en modo lectura
-    infile=open(LOG_SNR,'r')
-    # Creamos una variable que inicialmente inicializamos a falso
-    existe=False
-    # Recorremos el fichero y comparamos cada una de las lineas
-    for line in infile:
-        #Ignoramos las lineas que comiencen por @, puesto que se trata de un comentario en el fichero
-        if line[0]!='@':
-            # Obtenemos el dia juliano almacenado en la primera posicion de la linea
-            linea=line.split(',')
-            if linea[0]==diaJuliano:
-                existe=True
-    infile.close()
-    return existe
+COLUMNAS_SNR=['juldate','snr/exptime','object']
 
 """
 Función que se encarga de calcular la señal ruido para un fichero determinado.
-Este fichero debe contener el espectro ya reducido. Almacena los resultados en un fichero
-log_snr.txt
+Este fichero debe contener el espectro ya reducido. Devuelve la entrada del fichero
+log_snr.txt (ver COLUMNAS_SNR)
 """
 def procesar(fichero):
     # Abrimos el fichero
@@ -78,29 +64,27 @@ def procesar(fichero):
     # Obtenemos el nombre del objeto observado
     name = f[0].header["OBJECT"]
     
-    # Escribimos en el fichero de registro
-    if os.path.exists(LOG_SNR):
-        file=open(LOG_SNR,"a")
-    else:
-        file=open(LOG_SNR,"w")
-        file.write("@juldate,snr/exptime,object\n")
-    # Comprobamos que ese mismo fichero no se haya procesado anteriormente, para ello comparamos con el dia juliano
-    if not existeNoche(str(round(juldate,6))):
-        file.write(str(round(juldate,6))+","+str(round(snr_time,4))+","+name+"\n")
-    file.close()
+    return [round(juldate,6),float(round(snr_time,4)),name]
 
 
 """
 Esta función procesa todos los ficheros de un directorio, y ejecutar la función procesar
 para aquellos ficheros que estén reducidos, es decir, cuya extensión es .disp_cor.fits
+Las entradas de todos los ficheros se guardan a la vez en el historial del fichero log_snr.txt, de modo que
+el fichero de texto se vuelve a escribir una sola vez por directorio.
 """
 def runRutina03(directorio):
+    filas=[]
     # Recorremos el directorio
     for fichero in listdir(directorio):
         # Comprobamos que exista el fichero y que se trata de un fichero reducido
         if os.path.isfile(directorio+"/"+fichero) and fichero.endswith(".disp_cor.fits"):
             rutaFich=directorio+"/"+fichero
-            procesar(rutaFich)
+            filas.append(procesar(rutaFich))
+    # Guardamos las entradas en el historial del fichero de registro
+    # Si un mismo fichero ya se había procesado (mismo dia juliano) se sustituye su entrada
+    if len(filas)>0:
+        HistorialNoches.guardarNoches(LOG_SNR,COLUMNAS_SNR,filas)
     
     
     
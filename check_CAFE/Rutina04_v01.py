@@ -7,19 +7,23 @@ Objetivo: Medir el nivel de BIAS de cada fichero. Se generará un único fichero
           del nivel de bias de cada una de las imágenes BIAS.
           Esta rutina añadirá una entrada en el fichero "bias_master.txt". Este fichero contendrá
           la mediana del nivel de bias de una noche específica, junto con el día juliano.
+          Además se generan el bias master y el mapa de ruido de lectura de cada píxel de la noche
+          (master_bias_directorio.fits y ruido_bias_directorio.fits) y las estadísticas de cada cuadrante
+          del CCD (regiones_bias_directorio.txt).
 """
 
-from astropy.io import fits
-import numpy as np
-import astropy.time
-from dateutil import parser
+import os
 import os.path
-from astroML.stats import sigmaG
-from astropy.io import ascii
+import numpy as np
 import datetime
-from jdcal import gcal2jd
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec # GRIDSPEC !
+import AccesoFrames
+import CacheResultados
+import CombinacionFrames
+import CatalogoCabeceras
+import Instrumentacion
+import HistorialNoches
+import RenderizadoPlots
+import LecturaAnticipada
 
 """
 Definición de constantes:
@@ -29,79 +33,339 @@ Definición de constantes:
 FICH_BIAS="biasFits.txt"
 FICH_MASTER="./Rut04_dat/bias_master.txt"
 
+"""
+Fichero PDF con el plot del historial de los últimos 180 días
+"""
+PLOT_HISTORIA="bias_history_CAFE.pdf"
+
+"""
+Columnas del fichero Master. La primera, el día juliano de la noche, es la clave del historial.
+"""
+COLUMNAS_MASTER=['juldate', 'bias_mediana', 'bias_medio', 'bias_desvTipica']
+
+"""
+Indica si se generan el bias master y el mapa de ruido de lectura de cada noche (ver generarMapasBias).
+Se desactiva con la variable de entorno CAFE_MAPAS_BIAS=0.
+"""
+MAPAS_BIAS=os.environ.get("CAFE_MAPAS_BIAS","1")=="1"
+
+"""
+Número de desviaciones típicas (sigmaG) a partir del cual la mediana de una columna del bias master
+se considera anómala con respecto a las demás columnas de su región (columna caliente)
+"""
+UMBRAL_COLUMNAS=5.
+
+"""
+Número de veces el ruido de lectura de la noche a partir del cual se descarta el valor de un píxel en un bias
+(rayos cósmicos) al generar el bias master y el mapa de ruido de lectura
+"""
+RECORTE_BIAS=5.
+
+"""
+Factor que convierte el rango intercuartílico en la desviación típica de una gaussiana.
+Es el mismo que utiliza sigmaG de astroML: 1/(2*sqrt(2)*erfinv(0.5))
+"""
+FACTOR_SIGMAG=0.741301109252801
+
 """
 Esta función devolverá true en caso de que exista en el fichero bias_master.txt 
 una entrada para la noche que se introduce por parámetro, y false en caso contrario.
 El dia juliano introducido por parámetro debe ser un valor entero.
 """
-def existeNoche(diaJuliano):
-    # Abrimos el fichero en modo lectura
-    infile=open(FICH_MASTER,'r')
-    # Creamos una variable que inicialmente inicializamos a falso
-    existe=False
-    # Recorremos el fichero y comparamos cada una de las lineas
-    for line in infile:
-        #Ignoramos las lineas que comiencen por @, puesto que se trata de un comentario en el fichero
-        if line[0]!='@':
-            # Obtenemos el dia juliano almacenado en la primera posicion de la linea
-            linea=line.split(',')
-            juldate=np.int(linea[0])
-            if juldate==diaJuliano:
-                existe=True
-    infile.close()
-    return existe
+def existeNoche(diaJuliano, fichMaster=FICH_MASTER):
+    # Consultamos el historial del fichero Master, indexado por el dia juliano
+    return HistorialNoches.existeNoche(fichMaster,diaJuliano)
         
+"""
+Funcion que crea el acumulador de un bias a partir de la matriz con sus datos.
+Si los datos son enteros (el caso de CAFE) el acumulador es el histograma exacto de los valores:
+el valor mínimo y el número de píxeles con cada valor desde el mínimo. Así las estadísticas de toda
+la noche se obtienen sin guardar los bias, con memoria constante.
+Si los datos no son enteros se guarda la matriz completa en la lista 'otros'.
+"""
+def acumuladorBias(tbdata):
+    datos=np.asarray(tbdata).ravel()
+    if datos.dtype.kind in 'iu':
+        minimo=int(datos.min())
+        return {'minimo':minimo, 'cuentas':np.bincount(datos.astype(np.int64)-minimo), 'otros':[]}
+    return {'minimo':0, 'cuentas':np.zeros(0,dtype=np.int64), 'otros':[datos]}
+
+"""
+Funcion que suma dos acumuladores de bias. Cualquiera de los dos puede ser None (acumulador vacío).
+"""
+def sumarAcumuladores(acum1, acum2):
+    if acum1 is None:
+        return acum2
+    if acum2 is None:
+        return acum1
+    if len(acum1['cuentas'])==0:
+        minimo=acum2['minimo']
+    elif len(acum2['cuentas'])==0:
+        minimo=acum1['minimo']
+    else:
+        minimo=min(acum1['minimo'],acum2['minimo'])
+    # Alineamos los dos histogramas a partir del menor de los mínimos y los sumamos
+    tamanio=max(acum['minimo']-minimo+len(acum['cuentas']) for acum in (acum1,acum2))
+    cuentas=np.zeros(tamanio,dtype=np.int64)
+    for acum in (acum1,acum2):
+        inicio=acum['minimo']-minimo
+        cuentas[inicio:inicio+len(acum['cuentas'])]+=acum['cuentas']
+    return {'minimo':minimo, 'cuentas':cuentas, 'otros':acum1['otros']+acum2['otros']}
+
+"""
+Funcion que obtiene el elemento k-ésimo (empezando en 0) de los datos ordenados de un histograma,
+a partir de los valores y las cuentas acumuladas
+"""
+def elementoHistograma(valores, acumuladas, k):
+    return valores[np.searchsorted(acumuladas,k,side='right')]
+
+"""
+Funcion que obtiene el percentil q (entre 0 y 1) de los datos de un histograma, interpolando
+linealmente entre los dos elementos más próximos igual que np.percentile
+"""
+def percentilHistograma(valores, acumuladas, q):
+    total=acumuladas[-1]
+    indice=q*(total-1)
+    abajo=int(np.floor(indice))
+    arriba=min(abajo+1,total-1)
+    peso=indice-abajo
+    return elementoHistograma(valores,acumuladas,abajo)*(1.0-peso)+elementoHistograma(valores,acumuladas,arriba)*peso
+
+"""
+Funcion que obtiene la mediana, la media y la desviación típica (sigmaG) de los datos de un acumulador.
+Con datos enteros se calculan a partir del histograma, en tiempo proporcional al número de valores
+distintos, y coinciden exactamente con np.median, np.mean y sigmaG sobre todos los datos:
+la suma de enteros es exacta, igual que la de numpy mientras no supere 2**53.
+"""
+def estadisticasAcumulador(acum):
+    if len(acum['otros'])>0:
+        from astroML.stats import sigmaG
+        # Hay datos no enteros: calculamos las estadísticas sobre todos los datos
+        datos=acum['otros']
+        if len(acum['cuentas'])>0:
+            valores=np.arange(acum['minimo'],acum['minimo']+len(acum['cuentas']))
+            datos=[np.repeat(valores,acum['cuentas'])]+datos
+        datos=np.concatenate(datos)
+        return np.median(datos),np.mean(datos),sigmaG(datos)
+    cuentas=acum['cuentas']
+    valores=np.arange(acum['minimo'],acum['minimo']+len(cuentas),dtype=np.int64)
+    acumuladas=np.cumsum(cuentas)
+    total=int(acumuladas[-1])
+    # Mediana: elemento central, o media de los dos centrales si el número de datos es par
+    if total%2==1:
+        mediana=np.float64(elementoHistograma(valores,acumuladas,total//2))
+    else:
+        mediana=(np.float64(elementoHistograma(valores,acumuladas,total//2-1))+elementoHistograma(valores,acumuladas,total//2))/2.0
+    media=np.float64(int(np.dot(valores,cuentas)))/total
+    desviacion=FACTOR_SIGMAG*(percentilHistograma(valores,acumuladas,0.75)-percentilHistograma(valores,acumuladas,0.25))
+    return mediana,media,desviacion
+
+"""
+Funcion que lee la matriz de datos de un fichero bias
+"""
+def leerBias(fichero):
+    from astropy.io import fits
+    # Abrimos el fichero de bias
+    hdulist=fits.open(fichero);
+    # Copiamos los datos para poder cerrar el fichero
+    tbdata=np.array(hdulist[0].data)
+    #cerramos el fichero
+    hdulist.close();
+    Instrumentacion.contar('ficherosLeidos')
+    return tbdata
+
+"""
+Funcion que obtiene las estadísticas de un fichero bias. Devuelve el nombre del fichero, el bias medio,
+la mediana, la desviación típica, el día juliano y el acumulador con el histograma de los datos del bias.
+Opcionalmente se recibe la matriz de datos del bias, si ya se ha leído (ver runRutina04).
+"""
+def estadisticasBias(fichero, tbdata=None):
+    if tbdata is None:
+        tbdata=leerBias(fichero)
+    #Obtenemos el histograma de los datos
+    acumulador=acumuladorBias(tbdata)
+    #Obtenemos el dia juliano del bias a partir del catálogo de cabeceras
+    juldate = CatalogoCabeceras.getDiaJuliano(fichero)
+    nombre=fichero[fichero.index("/")+1:]
+    mediana,media,desviacion=estadisticasAcumulador(acumulador)
+    return nombre,media,mediana,desviacion,juldate,acumulador
+
+"""
+Funcion que escribe en el fichero nivel_bias de la noche la linea con las estadísticas de un fichero bias
+"""
+def escribirEstadisticasBias(outfile, nombre, media, mediana, desviacion, juldate):
+    outfile.write(nombre+","+str(round(media,4))+","+str(mediana)+","+str(round(desviacion,4))+","+str(round(juldate,6))+"\n")
+
+"""
+Funciones que devuelven los nombres de los ficheros con el bias master, el mapa de ruido de lectura y las
+estadísticas de cada región de una noche, en el mismo directorio que el fichero nivel_bias de la noche
+"""
+def getFicheroMasterBias(directorio):
+    return "./Rut04_dat/master_bias_"+directorio+".fits"
+
+def getFicheroRuidoBias(directorio):
+    return "./Rut04_dat/ruido_bias_"+directorio+".fits"
+
+def getFicheroRegionesBias(directorio):
+    return "./Rut04_dat/regiones_bias_"+directorio+".txt"
+
+"""
+Funcion que devuelve las regiones del CCD en las que se calculan las estadísticas del bias master y del mapa
+de ruido: los cuatro cuadrantes de la imagen, que corresponden a los amplificadores de lectura. Cada región
+es una tupla con su nombre y el rango de filas y de columnas en la imagen tal y como está en el fichero.
+"""
+def getRegiones(numFilas, numColumnas):
+    filas=[slice(0,numFilas//2),slice(numFilas//2,numFilas)]
+    columnas=[slice(0,numColumnas//2),slice(numColumnas//2,numColumnas)]
+    return [("Q"+str(2*i+j+1),filas[i],columnas[j]) for i in range(2) for j in range(2)]
+
+"""
+Funcion que obtiene sigmaG (desviación típica a partir del rango intercuartílico) de un array, sin tener en cuenta
+los valores NaN (píxeles de un solo bias en el mapa de ruido)
+"""
+def getSigmaG(datos):
+    percentil25,percentil75=np.nanpercentile(datos,[25,75])
+    return FACTOR_SIGMAG*(percentil75-percentil25)
+
+"""
+Funcion que calcula las estadísticas de cada región a partir del bias master y del mapa de ruido:
+- nivel_mediana, nivel_medio: mediana y media del bias master
+- patron_desvTipica: sigmaG del bias master, es decir, la variación del nivel de bias entre píxeles (patrón fijo)
+- ruido_medio: ruido de lectura de la región, como raíz de la varianza media de los píxeles (la mediana del ruido
+  de cada píxel subestima el ruido cuando hay pocos bias)
+- columnas_calientes: número de columnas cuyo nivel medio se aleja del de las demás más de UMBRAL_COLUMNAS veces sigmaG
+Los píxeles sin valor (NaN) no se tienen en cuenta. Devuelve una lista con una tupla por región.
+"""
+def estadisticasRegiones(master, ruido):
+    estadisticas=[]
+    for nombre,filas,columnas in getRegiones(*master.shape):
+        nivel=np.array(master[filas,columnas],dtype=np.float64)
+        # El nivel medio de cada columna no está discretizado como su mediana, que con pocos bias toma pocos valores
+        mediaColumnas=np.nanmean(nivel,axis=0)
+        calientes=np.abs(mediaColumnas-np.nanmedian(mediaColumnas))>UMBRAL_COLUMNAS*getSigmaG(mediaColumnas)
+        varianza=np.nanmean(np.square(ruido[filas,columnas],dtype=np.float64))
+        estadisticas.append((nombre,np.nanmedian(nivel),np.nanmean(nivel),getSigmaG(nivel),np.sqrt(varianza),int(np.sum(calientes))))
+    return estadisticas
+
+"""
+Funcion que escribe en un fichero las estadísticas de cada región
+"""
+def escribirRegiones(fichero, estadisticas):
+    outfile=open(fichero,"w")
+    outfile.write("@region, nivel_mediana, nivel_medio, patron_desvTipica, ruido_medio, columnas_calientes\n")
+    for nombre,mediana,media,patron,ruido,calientes in estadisticas:
+        outfile.write(nombre+","+",".join(str(round(v,4)) for v in (mediana,media,patron,ruido))+","+str(calientes)+"\n")
+    outfile.close()
+
+"""
+Funcion que genera el bias master y el mapa de ruido de lectura de una noche a partir de sus bias. Los bias se
+recorren a la vez por bloques de filas (ver AccesoFrames.leerBloques), y en cada píxel se calculan la media y la
+desviación típica de sus valores después de descartar los que se alejan de la mediana más de RECORTE_BIAS veces
+el ruido de lectura de la noche (ver CombinacionFrames.estadisticasRecortadas). Los resultados se acumulan en ficheros proyectados en memoria, de modo
+que solo se tienen en memoria los bloques de los bias, y después se escriben los ficheros .fits y las
+estadísticas de cada región. Se necesitan al menos dos bias. Devuelve las estadísticas de cada región.
+"""
+def generarMapasBias(directorio, ficheros, ruidoNoche):
+    fichMaster=getFicheroMasterBias(directorio)
+    fichRuido=getFicheroRuidoBias(directorio)
+    dimensiones=AccesoFrames.getDimensiones(ficheros[0])
+    master=np.memmap(fichMaster+".dat",dtype='>f4',mode='w+',shape=dimensiones)
+    ruido=np.memmap(fichRuido+".dat",dtype='>f4',mode='w+',shape=dimensiones)
+    try:
+        for inicio,fin,pila in AccesoFrames.leerBloques(ficheros):
+            master[inicio:fin],ruido[inicio:fin]=CombinacionFrames.estadisticasRecortadas(pila,RECORTE_BIAS,sigmaFija=ruidoNoche)
+        CombinacionFrames.escribir(fichMaster,master,ficheros,"sigma")
+        CombinacionFrames.escribir(fichRuido,ruido,ficheros,"sigma")
+        estadisticas=estadisticasRegiones(master,ruido)
+    finally:
+        del master,ruido
+        os.remove(fichMaster+".dat")
+        os.remove(fichRuido+".dat")
+    escribirRegiones(getFicheroRegionesBias(directorio),estadisticas)
+    return estadisticas
+
+"""
+Funcion que genera los mapas de una noche reutilizando las estadísticas de las regiones guardadas en la caché
+si no ha cambiado ningún bias y existen los ficheros .fits. Devuelve las estadísticas de cada región.
+"""
+def generarMapasBiasCache(directorio, ficheros, ruidoNoche):
+    ficheros=list(ficheros)
+    guardado=CacheResultados.consultar(generarMapasBias,ficheros,directorio,ficheros,ruidoNoche)
+    if guardado is not None and os.path.exists(getFicheroMasterBias(directorio)) and os.path.exists(getFicheroRuidoBias(directorio)):
+        return guardado[0]
+    estadisticas=generarMapasBias(directorio,ficheros,ruidoNoche)
+    CacheResultados.guardar(generarMapasBias,ficheros,[getFicheroRegionesBias(directorio)],estadisticas,directorio,ficheros,ruidoNoche)
+    return estadisticas
+
+"""
+Funcion que realiza el chequeo del nivel de bias y del ruido de lectura de cada región, con los mismos
+umbrales que los de toda la noche (ver registrarRutina04)
+"""
+def comprobarRegiones(estadisticas):
+    for nombre,mediana,media,patron,ruido,calientes in estadisticas:
+        texto="... Región %s: nivel BIAS medio %.2f ADUs, ruido de lectura %.2f ADUs, %d columnas calientes"%(nombre,media,ruido,calientes)
+        if media >= 810 and media <= 830 and ruido < 6 and calientes==0:
+            print texto+" ... OK"
+        else:
+            print texto+" ... NO OK! - CHECK"
+
+"""
+Funcion que genera los mapas de bias de una noche (si MAPAS_BIAS es True y hay al menos dos bias)
+y realiza el chequeo de cada región. Se recibe el ruido de lectura (sigmaG) de toda la noche.
+"""
+def mapasNoche(directorio, ficheros, ruidoNoche):
+    if not MAPAS_BIAS:
+        return
+    if len(ficheros)<2:
+        print "... Mapa de ruido de lectura: se necesitan al menos 2 bias, la noche tiene %d"%(len(ficheros))
+        return
+    comprobarRegiones(generarMapasBiasCache(directorio,ficheros,ruidoNoche))
+
 """
 Funcion encargada de llevar a cabo la ejecucion de la rutina 4
+Opcionalmente se puede indicar el fichero con el listado de bias y el fichero Master donde se añade la noche.
+Los bias se leen por adelantado mientras se calculan las estadísticas del anterior (ver LecturaAnticipada).
 """
-def runRutina04(directorio):
-     # Abrimos el fichero con el listado de ficheros bias
-    infile = open(FICH_BIAS,'r')
+def runRutina04(directorio, listaBias=FICH_BIAS, fichMaster=FICH_MASTER):
+     # Abrimos el fichero con el listado de ficheros bias y eliminamos las lineas en blanco
+    infile = open(listaBias,'r')
+    lineas=[line.strip() for line in infile if len(line.strip())>0]
+    infile.close()
+    # Si un bias no ha cambiado reutilizamos sus estadísticas guardadas en la caché, y solo se leen los demás
+    guardados=dict((line,CacheResultados.consultar(estadisticasBias,[line],line)) for line in lineas)
+    lecturas=LecturaAnticipada.anticipar(leerBias,[line for line in lineas if guardados[line] is None])
     # Abrimos el fichero donde escribiremos los resultados
     outfile = open("./Rut04_dat/nivel_bias_"+directorio+".txt","w")
     outfile.write("@fichero, bias_medio, bias_mediana, bias_desvTipica, dia_juliano\n")
-    # Variable para almacenar todos los valores de todos los bias de una noche
-    biasNoche=[]
+    # Acumulador con el histograma de todos los valores de todos los bias de una noche
+    biasNoche=None
     # Procesamos cada una de las lineas del fichero
-    for line in infile:
-        #Eliminamos de la linea el retorno de carro (\n)
-        line=line.strip()
-        #Comprobamos que la linea tenga información y no sea una linea en blanco
-        if len(line)>0:
-            # Abrimos el fichero de bias
-            hdulist=fits.open(line);
-            #Obtenemos la matriz con los datos
-            tbdata = hdulist[0].data
-            #Obtenemos el dia juliano del bias
-            date=hdulist[0].header["DATE"]
-            dt = parser.parse(date)
-            time = astropy.time.Time(dt)
-            juldate = time.jd
-            #cerramos el fichero
-            hdulist.close();
-            nombre=line[line.index("/")+1:]
-            media=np.mean(tbdata)
-            mediana=np.median(tbdata)
-            desviacion=sigmaG(tbdata)
-            biasNoche.append(tbdata)
-            outfile.write(nombre+","+str(round(media,4))+","+str(mediana)+","+str(round(desviacion,4))+","+str(round(juldate,6))+"\n")     
+    for line in lineas:
+        with Instrumentacion.medir('ficheros',line,funcion='estadisticasBias'):
+            if guardados[line] is not None:
+                resultado=guardados[line][0]
+            else:
+                fichero,tbdata=next(lecturas)
+                resultado=estadisticasBias(line,tbdata)
+                CacheResultados.guardar(estadisticasBias,[line],[],resultado,line)
+        nombre,media,mediana,desviacion,juldate,acumulador=resultado
+        biasNoche=sumarAcumuladores(biasNoche,acumulador)
+        escribirEstadisticasBias(outfile,nombre,media,mediana,desviacion,juldate)
     outfile.close()
-    infile.close()
     
-    # Añadimos el valor de la mediana de todos los bias de la noche al fichero master
-    # Si existe el fichero lo abrimos en modo "a", sino lo creamos
-    if os.path.exists(FICH_MASTER):
-        file=open(FICH_MASTER,"a")
-    else:
-        file=open(FICH_MASTER,"w")
-        file.write("@juldate,bias_mediana,bias_medio,bias_desvTipica\n")
-    mediana_total=np.median(biasNoche)
-    media_total=np.mean(biasNoche)
-    desvTipica_total=sigmaG(biasNoche)
-    #Comprobamos que la entrada en el fichero no exista. En caso de no existir escribimos nueva entrada
-    if not existeNoche(np.int(juldate)):
-        file.write(str(np.int(juldate))+","+str(round(mediana_total,4))+","+str(round(media_total,4))+","+str(round(desvTipica_total,4))+"\n")
-    file.close()
+    mediana_total,media_total,desvTipica_total=estadisticasAcumulador(biasNoche)
+    registrarRutina04(juldate, mediana_total, media_total, desvTipica_total, fichMaster)
+    # Generamos el bias master y el mapa de ruido de lectura de la noche
+    mapasNoche(directorio,lineas,desvTipica_total)
+
+"""
+Funcion que añade al fichero Master la entrada de la noche con la mediana, la media y la desviación típica
+del nivel de bias de todos los bias de la noche, y que realiza el chequeo de dichos valores.
+"""
+def registrarRutina04(juldate, mediana_total, media_total, desvTipica_total, fichMaster=FICH_MASTER):
+    # Guardamos en el historial del fichero master la mediana de todos los bias de la noche
+    # Si ya existe una entrada para la noche se sustituye
+    HistorialNoches.guardarNoche(fichMaster,COLUMNAS_MASTER,[np.int(juldate),round(mediana_total,4),round(media_total,4),round(desvTipica_total,4)])
     # Realizamos el checkeo de valores umbrales. 
     # Si el bias medio está entre 810 y 830 es correcto, y si el ruido de lectura es menor que 6 será también correcto.
     if media_total >= 810 and media_total <=830:
@@ -117,16 +381,16 @@ def runRutina04(directorio):
 Funcion encargada de añadir pintar y añadir al historial los resultados obtenidos en la noche que se esta ejecutando
 """
 def plotHistory():
-    colnames = ('jd','bias','noise','std')
-    table = ascii.read('Rut04_dat/bias_master.txt', format='csv', names=colnames, comment='@')	
-    jd  = np.array(table["jd"])
-    bias   = np.array(table["bias"])
-    std   = np.array(table["std"])
-    
+    import astropy.time
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec # GRIDSPEC !
+    from jdcal import gcal2jd
     today = datetime.datetime.now()
     today = astropy.time.Time(today)
     jd_today = np.int(today.jd)
     jd_ini=jd_today-180
+    # Leemos del historial solo las noches de los ultimos 180 dias
+    jd,bias,noise,std = HistorialNoches.leerColumnas(FICH_MASTER,jd_ini)
     
     plt.figure(figsize=(12,7))
     gs = gridspec.GridSpec(2,1)
@@ -166,4 +430,10 @@ def plotHistory():
     arr = std
     
     plt.scatter(jd-jd_ini,std,c=arr, cmap='winter',vmin=3.5, vmax=6)
-    plt.savefig('bias_history_CAFE.pdf')
\ No newline at end of file
+    plt.savefig(PLOT_HISTORIA)
+
+"""
+Funcion que lanza en segundo plano el plot del historial, si han cambiado los datos o el día desde que se dibujó
+"""
+def lanzarPlotHistory():
+    return RenderizadoPlots.lanzar(plotHistory,(),PLOT_HISTORIA,[FICH_MASTER],RenderizadoPlots.getDiaJulianoHoy())
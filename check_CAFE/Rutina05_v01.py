@@ -9,32 +9,15 @@ Objetivo: Obtener la eficiencia de la noche de observación.
 """
 
 
-import ephem
-import os.path
-from os import listdir
-from astropy.io import fits
 import numpy as np
-import astropy.time
-from dateutil import parser
+import CatalogoCabeceras
 
 """
-Funcion que obtiene el día juliano a partir de una imagen fit que se le pasa por parámetro.
+Función que obtiene el inicio y el fin de la noche astronómica (crepúsculos a -18 grados)
+para la noche del directorio, cuyo nombre tiene el formato AAMMDD
 """
-def getDiaJuliano(imagenFit):
-    # Abrimos el fichero
-    f=fits.open(imagenFit);
-    # Obtenemos la fecha y finalmente con astropy obtenemos el dia juliano
-    date=f[0].header["DATE"]
-    dt = parser.parse(date)
-    time = astropy.time.Time(dt)
-    juldate = time.jd
-    return juldate
-
-"""
-Función que se encarga de lanzar la rutina y generar las estadísticas a partir del directorio
-que contiene todos los ficheros de observación de una noche
-"""
-def runRutina05(directorio):
+def getCrepusculos(directorio):
+    import ephem
     observatorio=ephem.Observer()
     #Obtenemos la fecha de observacion a partir del directorio    
     anio="20"+directorio[0:2]
@@ -52,6 +35,16 @@ def runRutina05(directorio):
     # Hallamos el twilight para asegurarnos que todos los ficheros se han realizado dentro de ese tiempo
     inicio=observatorio.next_setting(sol, use_center=True)
     fin=observatorio.next_rising(sol, use_center=True)
+    return inicio,fin
+
+"""
+Función que se encarga de lanzar la rutina y generar las estadísticas a partir del directorio
+que contiene todos los ficheros de observación de una noche
+"""
+def runRutina05(directorio):
+    import ephem
+    # Hallamos el twilight para asegurarnos que todos los ficheros se han realizado dentro de ese tiempo
+    inicio,fin=getCrepusculos(directorio)
 
     #Hallamos el dia juliano para el twilight
     inicioTw = ephem.julian_date(inicio)
@@ -74,31 +67,26 @@ def runRutina05(directorio):
     numFlats=0
     numBias=0
     
-    # Recorremos el directorio y obtenemos los tiempos
-    for fichero in listdir(directorio):
-        if os.path.isfile(directorio+"/"+fichero) and fichero.endswith(".fits"):
-            rutaFich=directorio+"/"+fichero
-            # Abrimos el fichero
-            f=fits.open(rutaFich)
-            # Obtenemos el tiempo de exposicion del fichero y la fecha
-            tiempo=f[0].header["EXPTIME"]
-            tExposicion=np.float(tiempo)
-            fechaJul=getDiaJuliano(rutaFich)
-            # Obtenemos el tipo de fichero que estamos tratando
-            objeto=f[0].header["OBJECT"]
-            if objeto.startswith("[arc]"):
-                numArcos=numArcos+1
-            if objeto.startswith("[flat]"):
-                numFlats=numFlats+1
-            if objeto.startswith("[Bias]"):
-                numBias=numBias+1
-            # Comprobamos que la fecha del fichero este dentro de los limites del twilight
-            if inicioTw<fechaJul and fechaJul<finTw:
-                # Comprobamos si es de tipo arco y si es así sumamos su tiempo de exposicion
-                if objeto.startswith("[arc]"):
-                    tiempoArco=tiempoArco+tExposicion
-                # Sumamos el tiempo total de exposicion de todos los ficheros de la noche
-                tiempoTotal=tiempoTotal+tExposicion
+    # Recorremos el catálogo de cabeceras del directorio y obtenemos los tiempos
+    for fila in CatalogoCabeceras.getCatalogo(directorio):
+        # Obtenemos el tiempo de exposicion del fichero y la fecha
+        tExposicion=np.float(fila['exptime'])
+        fechaJul=fila['juldate']
+        # Obtenemos el tipo de fichero que estamos tratando
+        tipo=fila['tipo']
+        if tipo=="[arc]":
+            numArcos=numArcos+1
+        if tipo=="[flat]":
+            numFlats=numFlats+1
+        if tipo=="[Bias]":
+            numBias=numBias+1
+        # Comprobamos que la fecha del fichero este dentro de los limites del twilight
+        if inicioTw<fechaJul and fechaJul<finTw:
+            # Comprobamos si es de tipo arco y si es así sumamos su tiempo de exposicion
+            if tipo=="[arc]":
+                tiempoArco=tiempoArco+tExposicion
+            # Sumamos el tiempo total de exposicion de todos los ficheros de la noche
+            tiempoTotal=tiempoTotal+tExposicion
     
     eficiencia=(tiempoTotal/segundosNoche)*100.0
     tiempoCiencia=tiempoTotal-tiempoArco
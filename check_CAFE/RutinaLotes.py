@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Rutina de reprocesado por lotes.
+Objetivo: Ejecutar las rutinas sobre muchas noches a la vez, por ejemplo después de cambiar
+          la imagen arco o flat de referencia. Cada noche se procesa en un proceso independiente,
+          con las mismas etapas que la rutina master (ver RutinaMaster.generarEtapas) ejecutadas en serie,
+          y al terminar cada etapa de una noche se anota en un fichero de control (checkpoint),
+          de modo que si el reprocesado se interrumpe, al volver a lanzarlo solo se ejecutan
+          las etapas que faltan.
+          Cada noche escribe su entrada de los ficheros Master en un fichero parcial propio.
+          Al final, las entradas de todas las noches se guardan en el historial de los ficheros Master
+          (ver HistorialNoches), sustituyendo las que ya existían, por lo que el resultado no depende
+          del orden en que terminen las noches.
+          Para comenzar un reprocesado nuevo desde cero hay que borrar el fichero lotes_checkpoint.txt.
+SINTAXIS: python RutinaLotes.py [-j numProcesos] noche1 [noche2 ...]
+          Cada noche puede ser un directorio o un patrón, por ejemplo: python RutinaLotes.py 16*
+"""
+
+import sys
+import os
+import os.path
+import glob
+import multiprocessing
+import traceback
+import time
+import Instrumentacion
+import HistorialNoches
+import Planificador
+import Rutina01_v01
+import Rutina02_v01
+import Rutina04_v01
+import RutinaMaster
+
+"""
+Fichero de control donde se anota cada etapa terminada de cada noche, con el formato: noche,etapa
+"""
+FICH_CHECKPOINT="./lotes_checkpoint.txt"
+
+"""
+Etapas de la rutina master que se ejecutan siempre, aunque ya estén anotadas en el fichero de control, porque
+sus resultados (los listados de ficheros y los ficheros de referencia) se pasan en memoria a las siguientes.
+Son rápidas, ya que utilizan el catálogo de cabeceras y la caché de resultados.
+"""
+ETAPAS_SIEMPRE=['listas','ref01','ref02','masterFlat']
+
+"""
+Ficheros Master de cada rutina en los que se combinan las entradas de todas las noches
+"""
+MASTERS=[Rutina01_v01.FICH_MASTER, Rutina02_v01.FICH_MASTER, Rutina04_v01.FICH_MASTER]
+
+"""
+Funcion que lee el fichero de control y devuelve un diccionario con el conjunto de etapas
+terminadas de cada noche
+"""
+def leerCheckpoint():
+    hechas={}
+    if os.path.exists(FICH_CHECKPOINT):
+        infile=open(FICH_CHECKPOINT,'r')
+        for line in infile:
+            campo=line.strip().split(",")
+            if len(campo)==2:
+                hechas.setdefault(campo[0],set()).add(campo[1])
+        infile.close()
+    return hechas
+
+"""
+Funcion que anota en el fichero de control que una etapa de una noche ha terminado.
+Se escribe la linea completa en una única operación para que varios procesos puedan
+añadir lineas a la vez sin mezclarlas.
+"""
+def marcarEtapa(noche, etapa):
+    fd=os.open(FICH_CHECKPOINT,os.O_WRONLY|os.O_APPEND|os.O_CREAT,0644)
+    os.write(fd,noche+","+etapa+"\n")
+    os.close(fd)
+
+"""
+Funcion que devuelve el nombre del fichero Master parcial de una noche.
+Se almacena en el subdirectorio "lotes" del directorio del fichero Master.
+"""
+def getMasterParcial(fichMaster, noche):
+    directorio,nombre=os.path.split(fichMaster)
+    return os.path.join(directorio,"lotes",nombre[:-4]+"_"+noche+".txt")
+
+"""
+Funcion que devuelve los nombres de los ficheros con el listado de arcos, flats y bias de una noche
+"""
+def getListasNoche(noche):
+    return [f[:-4]+"_"+noche+".txt" for f in (RutinaMaster.FICH_ARCO,RutinaMaster.FICH_FLAT,RutinaMaster.FICH_BIAS)]
+
+"""
+Funcion que devuelve el grafo de etapas de una noche para el reprocesado por lotes: el mismo de la rutina master
+(ver RutinaMaster.generarEtapas), con los listados de ficheros y los ficheros Master parciales de la noche.
+Las etapas anotadas en el fichero de control se sustituyen por etapas vacías, salvo las de ETAPAS_SIEMPRE, y al
+terminar cada etapa se anota en el fichero de control.
+"""
+def generarEtapasNoche(noche, hechas):
+    etapas=RutinaMaster.generarEtapas(noche,getListasNoche(noche),lambda fichMaster: getMasterParcial(fichMaster,noche),lotes=True)
+    for e in etapas:
+        if e['nombre'] in hechas and e['nombre'] not in ETAPAS_SIEMPRE:
+            e['inicio']=e['tareas']=e['final']=None
+            continue
+        # La función final original se ejecuta antes de anotar la etapa como terminada
+        e['final']=lambda r,final=e['final'],nombre=e['nombre']: (final(r) if final is not None else None,marcarEtapa(noche,nombre))
+    return etapas
+
+"""
+Funcion que ejecuta las etapas pendientes de una noche, en serie y en el proceso actual. La salida de las rutinas
+se escribe en el fichero lotes_noche.log y las medidas de cada etapa en el informe de la noche.
+Devuelve la noche y None si todo ha ido bien, o el error producido.
+"""
+def procesarNoche(noche):
+    etapas=generarEtapasNoche(noche,leerCheckpoint().get(noche,set()))
+    salida=sys.stdout
+    sys.stdout=open("./lotes_"+noche+".log","a")
+    inicio=time.time()
+    Instrumentacion.reiniciar()
+    try:
+        print "NOCHE "+noche
+        Planificador.ejecutar(etapas,1,noche)
+        Instrumentacion.escribirInforme(noche,inicio,numProcesos=1)
+        return noche,None
+    except Exception:
+        error=traceback.format_exc()
+        print error
+        return noche,error
+    finally:
+        sys.stdout.close()
+        sys.stdout=salida
+
+"""
+Funcion que añade al historial de un fichero Master las entradas de los ficheros parciales de las noches,
+sustituyendo las noches que ya existan en el historial. Si dos noches tienen el mismo día juliano se
+conserva la entrada menor, para que el resultado no dependa del orden en que terminen las noches.
+Los ficheros parciales y sus historiales se eliminan una vez combinados.
+"""
+def combinarMaster(fichMaster, noches):
+    parciales=[getMasterParcial(fichMaster,noche) for noche in noches]
+    parciales=[p for p in parciales if os.path.exists(HistorialNoches.getFicheroHistorial(p))]
+    columnas=None
+    filas={}
+    for parcial in parciales:
+        columnasParcial,filasParcial=HistorialNoches.leerFilas(parcial)
+        columnas=columnasParcial or columnas
+        for fila in filasParcial:
+            if fila[0] not in filas or fila<filas[fila[0]]:
+                filas[fila[0]]=fila
+    if columnas is not None and len(filas)>0:
+        HistorialNoches.guardarNoches(fichMaster,columnas,[filas[jd] for jd in sorted(filas)])
+    for parcial in parciales:
+        for fichero in (parcial,HistorialNoches.getFicheroHistorial(parcial)):
+            if os.path.exists(fichero):
+                os.remove(fichero)
+
+"""
+Funcion que añade a los cubos de historial de las rutinas 01 y 02 los resultados de las noches que se han
+reprocesado: aquellas cuya etapa de arcos o de flats ha terminado (en esta ejecución o en una anterior que
+se interrumpió) y cuyos resultados aún no se han añadido al cubo. Al añadirlos se anotan en el fichero de control
+las etapas cubo01 y cubo02, de modo que al reanudar el reprocesado no se vuelven a añadir las noches ya terminadas.
+Se hace desde el proceso principal y en el orden de las noches, para que no escriban en un cubo varios procesos a la vez.
+"""
+def combinarCubos(noches):
+    hechas=leerCheckpoint()
+    for noche in noches:
+        etapas=hechas.get(noche,set())
+        if 'arcos' in etapas and 'cubo01' not in etapas:
+            arcos,listaSpots=Rutina01_v01.leerResultadosNoche(noche)
+            Rutina01_v01.anadirCuboNoche(noche,arcos,listaSpots)
+            marcarEtapa(noche,'cubo01')
+        if 'flats' in etapas and 'cubo02' not in etapas:
+            flats,listaAjustes=Rutina02_v01.leerResultadosNoche(noche)
+            Rutina02_v01.anadirCuboNoche(noche,flats,listaAjustes)
+            marcarEtapa(noche,'cubo02')
+
+"""
+Funcion que obtiene la lista de noches a partir de los parámetros, expandiendo los patrones
+y descartando lo que no sean directorios del directorio de trabajo.
+"""
+def getNoches(parametros):
+    noches=[]
+    for parametro in parametros:
+        for ruta in sorted(glob.glob(parametro)) or [parametro]:
+            noche=ruta.rstrip("/")
+            if not os.path.isdir(noche):
+                print "El directorio "+noche+" no existe"
+            elif "/" in noche:
+                print "El directorio "+noche+" debe estar en el directorio de trabajo"
+            elif noche not in noches:
+                noches.append(noche)
+    return noches
+
+"""
+Funcion que reprocesa una lista de noches con numProcesos procesos.
+Los ficheros de referencia se generan una única vez antes de repartir las noches.
+"""
+def runLotes(noches, numProcesos):
+    for fichMaster in MASTERS:
+        directorio=os.path.join(os.path.dirname(fichMaster),"lotes")
+        if not os.path.isdir(directorio):
+            os.makedirs(directorio)
+    # Generamos los ficheros de referencia de las rutinas 01 y 02
+    Rutina01_v01.cargarSpotsCache(RutinaMaster.ARCO_REF,"./spots.txt")
+    Rutina02_v01.cargarAjustesCache(RutinaMaster.FLAT_REF)
+    if numProcesos<=1:
+        resultados=[procesarNoche(noche) for noche in noches]
+    else:
+        pool=multiprocessing.Pool(numProcesos)
+        resultados=pool.map(procesarNoche,noches,chunksize=1)
+        pool.close()
+        pool.join()
+    errores=[(noche,error) for noche,error in resultados if error is not None]
+    for noche,error in resultados:
+        if error is None:
+            print "Noche "+noche+" ... OK"
+        else:
+            print "Noche "+noche+" ... ERROR (ver lotes_"+noche+".log)"
+    # Combinamos las entradas de todas las noches en los ficheros Master y generamos los plots
+    for fichMaster in MASTERS:
+        combinarMaster(fichMaster,noches)
+    combinarCubos(noches)
+    Rutina01_v01.lanzarPlotHistory()
+    Rutina02_v01.lanzarPlotHistory()
+    Rutina04_v01.lanzarPlotHistory()
+    return errores
+
+
+if __name__=="__main__":
+    parametros=sys.argv[1:]
+    numProcesos=RutinaMaster.NUM_PROCESOS
+    if len(parametros)>=2 and parametros[0]=="-j" and parametros[1].isdigit():
+        numProcesos=int(parametros[1])
+        parametros=parametros[2:]
+    noches=getNoches(parametros)
+    if len(noches)>0:
+        runLotes(noches,numProcesos)
+    else:
+        print "No se ha introducido ninguna noche."
+        print "SINTAXIS: python RutinaLotes.py [-j numProcesos] noche1 [noche2 ...]"
@@ -15,10 +15,13 @@ Objetivo: Ejecutar cada una de las rutinas de manera automática.
 """
 # Para instalar ephem: pip install pyephem
 import sys
-from astropy.io import fits
 import os.path
+import time
 from os import system
-from os import listdir
+import multiprocessing
+import CatalogoCabeceras
+import Instrumentacion
+import Planificador
 import Rutina01_v01
 import Rutina02_v01
 import Rutina04_v01
@@ -38,13 +41,19 @@ FICH_ARCO="arcoFits.txt"
 FICH_FLAT="flatFits.txt"
 FICH_BIAS="biasFits.txt"
 
+"""
+Número de procesos con los que se ejecutan las rutinas si no se indica por parámetros.
+Con un único proceso las rutinas se ejecutan en serie.
+"""
+NUM_PROCESOS=multiprocessing.cpu_count()
+
 """
 Funcion que se encarga de generar las listas de ficheros para arco, flats y bias
 del directorio que se recibe por parámetro 
+Opcionalmente se pueden indicar los nombres de los ficheros donde se escribe cada listado.
+Devuelve las tres listas (arcos, flats y bias).
 """
-def generarListaFicheros():
-    # Obtenemos el directorio donde se encuentran todos los ficheros
-    direct=sys.argv[1]
+def generarListaFicheros(direct, fichArco=FICH_ARCO, fichFlat=FICH_FLAT, fichBias=FICH_BIAS):
     # Definimos un directorio auxiliar de trabajo
     directAux=direct+'_aux'
     
@@ -53,87 +62,127 @@ def generarListaFicheros():
     #system('cp -r '+direct+' '+directAux)
     directAux=direct
     
-    #Creamos ficheros para arco, flat y bias
-    arcoFits=open(FICH_ARCO,"w")
-    flatFits=open(FICH_FLAT,"w")
-    biasFits=open(FICH_BIAS,"w")
+    #Creamos las listas para arco, flat y bias
+    listas={'[arc]':[], '[flat]':[], '[Bias]':[]}
     
-    # Recorremos el directorio
-    for fichero in listdir(directAux):
-        if os.path.isfile(directAux+"/"+fichero) and fichero.endswith(".fits"):
-            rutaFich=directAux+"/"+fichero
-            # Abrimos el fichero
-            f=fits.open(rutaFich)
-            # Obtenemos el tipo de fichero que estamos tratando
-            objeto=f[0].header["OBJECT"]
-            if objeto[0]=='[':
-                tipo=objeto[:objeto.index(']')+1]
-            else:
-                tipo='[science]'
-            #print "%s - %s"%(rutaFich,tipo)
-            #Clasificamos los ficheros segun su tipo y creamos una lista de ficheros para cada tipo
-            if tipo=='[arc]':
-                arcoFits.write(rutaFich+"\n")
-            elif tipo=='[flat]':
-                flatFits.write(rutaFich+"\n")
-            elif tipo=='[Bias]':
-                biasFits.write(rutaFich+"\n")
-                    
-            f.close()
+    # Recorremos el catálogo de cabeceras del directorio
+    for fila in CatalogoCabeceras.getCatalogo(directAux):
+        rutaFich=directAux+"/"+fila['fichero']
+        tipo=fila['tipo']
+        #print "%s - %s"%(rutaFich,tipo)
+        #Clasificamos los ficheros segun su tipo y creamos una lista de ficheros para cada tipo
+        if tipo in listas:
+            listas[tipo].append(rutaFich)
     
-    arcoFits.close()
-    flatFits.close()
-    biasFits.close()
+    #Escribimos los ficheros para arco, flat y bias
+    for tipo,fichero in (('[arc]',fichArco),('[flat]',fichFlat),('[Bias]',fichBias)):
+        outfile=open(fichero,"w")
+        outfile.write("".join(rutaFich+"\n" for rutaFich in listas[tipo]))
+        outfile.close()
+    return listas['[arc]'],listas['[flat]'],listas['[Bias]']
 
 
 """
-Función que se encarga de lanzar las rutinas 1 y 2
-"""
-def run_Rutina01_Rutina02(directorio):
-    #Arrancamos la rutina 01. 
-    print "EJECUTANDO RUTINA 01: ARC-SPOTS ..."
-    print "==================================="
-    # Obtenemos la matriz de datos del fichero que cogemos como referencia
-    tbdata=Rutina01_v01.getMatrizDatos(ARCO_REF)
-    # Generamos el fichero input_spot.txt que utilizaremos para el estudio
-    Rutina01_v01.generarInputSpot("./spots.txt",tbdata)
-    # Lanzamos la rutina generando para cada fichero arco un fichero de datos con los resultados
-    Rutina01_v01.rutina01Run(FICH_ARCO)
-    #Rutina01_v01.promedioDistancias(FICH_ARCO)
-    # Generamos el fichero Master de la primera rutina:
-    Rutina01_v01.checkRutina01(FICH_ARCO)
-     # Si no existe el fichero pdf, generamos el plot para la rutina 01
-#    if not os.path.exists("./Rut01_dat/Rutina01_plot_1night_"+directorio[0:6]+".pdf"):
-    Rutina01_v01.Plot1night(directorio)
-    
-    # Cargamos ajustes de la rutina02
-    Rutina02_v01.cargarAjustes(FLAT_REF)
-    # Lanzamos la rutina 02.
-    print "EJECUTANDO RUTINA 02: Posición e intensidad del flat ..."
-    print "========================================================"
-    Rutina02_v01.rutina02Run(FICH_FLAT)
-    
+Funcion que devuelve las lineas no vacías del fichero con el listado de ficheros de un tipo
+"""
+def leerListaFicheros(fichero):
+    infile=open(fichero,'r')
+    lista=[line.strip() for line in infile if len(line.strip())>0]
+    infile.close()
+    return lista
 
+"""
+Funcion que imprime la cabecera de cada rutina
+"""
+def cabecera(titulo, subrayado):
+    print titulo
+    print subrayado
 
-#Comprobamos que se ha introducido un parámetro al programa y que sea un directorio
-if len(sys.argv)==2:
-    if os.path.exists(sys.argv[1]) and not os.path.isfile(sys.argv[1]):
-        generarListaFicheros()
-        run_Rutina01_Rutina02(sys.argv[1])
-        print "EJECUTANDO RUTINA 04: Control del nivel de BIAS ..."
-        print "==================================================="
-        Rutina04_v01.runRutina04(sys.argv[1])
-        print "EJECUTANDO RUTINA 05: Calculando tiempos de observación ..."
-        print "==================================================="
-        Rutina05_v01.runRutina05(sys.argv[1])
-        # Hacemos los plots
-        Rutina01_v01.plotHistory()
-        Rutina02_v01.plotHistory()
-        Rutina04_v01.plotHistory()
-    else:
-        print "El directorio introducido no existe"
-else:
-    print "El numero de parámetros es incorrecto."
-    print "Debes introducir el directorio de trabajo:"
-    print "SINTAXIS: python RutinaMaster [directorio]"
+"""
+Función que genera el grafo de etapas de la noche. Salvo las listas de ficheros, que comparten
+todas las rutinas, las rutinas 01, 02, 04 y 05 son independientes entre sí. Dentro de las rutinas
+01 y 02 cada fichero arco o flat es una tarea independiente.
+Las listas de ficheros y los resultados de cada arco se pasan en memoria a las etapas posteriores.
+Para el reprocesado por lotes (ver RutinaLotes) se pueden indicar:
+- listas: ficheros donde se escriben los listados de arcos, flats y bias de la noche
+- getMaster: función que devuelve el fichero Master en el que se añade la noche a partir del fichero Master
+  de cada rutina (por defecto el propio fichero)
+- lotes: si es True no se añade la noche a los cubos de historial ni se lanzan los plots de historial, que
+  se hacen al terminar todas las noches, y el plot de la noche se dibuja en el propio proceso
+"""
+def generarEtapas(directorio, listas=(FICH_ARCO,FICH_FLAT,FICH_BIAS), getMaster=None, lotes=False):
+    E=Planificador.etapa
+    fichArco,fichFlat,fichBias=listas
+    if getMaster is None:
+        getMaster=lambda fichMaster: fichMaster
+    # Resultados de las etapas que utilizan las etapas posteriores
+    resultados={}
+    return [
+        # Generamos las listas de ficheros para arco, flats y bias
+        E('listas', final=lambda r: resultados.update(zip(('arcos','flats','bias'),generarListaFicheros(directorio,fichArco,fichFlat,fichBias)))),
+        #Arrancamos la rutina 01. Generamos el fichero input_spot.txt que utilizaremos para el estudio
+        #Si no han cambiado ARCO_REF ni spots.txt se reutiliza el guardado en la caché
+        E('ref01',
+          inicio=lambda: cabecera("EJECUTANDO RUTINA 01: ARC-SPOTS ...","==================================="),
+          tareas=lambda: [(Rutina01_v01.cargarSpotsCache,(ARCO_REF,"./spots.txt"))]),
+        # Generamos para cada fichero arco un fichero de datos con los resultados y el fichero Master de la rutina 01
+        # Los arcos que no han cambiado desde la última ejecución reutilizan el resultado guardado en la caché
+        E('arcos',['listas','ref01'],
+          tareas=lambda: [(Rutina01_v01.generarEstadisticasCache,(Rutina01_v01.INPUT_SPOT,f,ARCO_REF,"./spots.txt")) for f in resultados['arcos']],
+          final=lambda r: (resultados.update(spots=r), Rutina01_v01.guardarResultadosNoche(directorio,resultados['arcos'],r),
+                           None if lotes else Rutina01_v01.anadirCuboNoche(directorio,resultados['arcos'],r),
+                           Rutina01_v01.checkRutina01(fichArco,getMaster(Rutina01_v01.FICH_MASTER),r))),
+        # El plot de la noche se dibuja en segundo plano a partir del fichero binario de la noche
+        E('plot1night',['arcos'], final=lambda r: Rutina01_v01.lanzarPlot1night(directorio,esperar=lotes)),
+        # Cargamos ajustes de la rutina02 (de la caché si no han cambiado FLAT_REF ni ordenes_input.txt)
+        E('ref02', tareas=lambda: [(Rutina02_v01.cargarAjustesCache,(FLAT_REF,))]),
+        # Con CAFE_FLAT_MASTER=mediana|sigma combinamos los flats de la noche y se ajusta solo el flat master
+        E('masterFlat',['listas'],
+          inicio=lambda: cabecera("EJECUTANDO RUTINA 02: Posición e intensidad del flat ...","========================================================"),
+          tareas=lambda: [(Rutina02_v01.combinarFlatsCache,(resultados['flats'],))] if Rutina02_v01.COMBINACION_FLATS and len(resultados['flats'])>0 else [],
+          final=lambda r: resultados.update(flatsAjuste=r or resultados['flats'])),
+        # Lanzamos la rutina 02 para cada fichero flat (o para el flat master) y realizamos el chequeo
+        E('flats',['masterFlat','ref02'],
+          tareas=lambda: [(Rutina02_v01.procesarFlatCache,(f,)) for f in resultados['flatsAjuste']],
+          final=lambda r: (Rutina02_v01.guardarResultadosNoche(directorio,resultados['flatsAjuste'],r),
+                           None if lotes else Rutina02_v01.anadirCuboNoche(directorio,resultados['flatsAjuste'],r),
+                           Rutina02_v01.checkRutina02(r,fichFlat,getMaster(Rutina02_v01.FICH_MASTER)))),
+        # Con CAFE_TRAZAS=1 trazamos los ordenes de cada flat en todas las columnas y guardamos las trazas de la noche
+        E('trazas',['masterFlat','ref02'],
+          tareas=lambda: [(Rutina02_v01.trazarFlatCache,(f,)) for f in resultados['flatsAjuste']] if Rutina02_v01.MODO_TRAZAS else [],
+          final=lambda r: Rutina02_v01.guardarTrazasNoche(directorio,resultados['flatsAjuste'],r)),
+        E('bias',['listas'],
+          inicio=lambda: cabecera("EJECUTANDO RUTINA 04: Control del nivel de BIAS ...","==================================================="),
+          tareas=lambda: [(Rutina04_v01.runRutina04,(directorio,fichBias,getMaster(Rutina04_v01.FICH_MASTER)))]),
+        E('eficiencia',['listas'],
+          inicio=lambda: cabecera("EJECUTANDO RUTINA 05: Calculando tiempos de observación ...","==================================================="),
+          tareas=lambda: [(Rutina05_v01.runRutina05,(directorio,))]),
+    ]+([] if lotes else [
+        # Hacemos los plots. Se dibujan en procesos en segundo plano (ver RenderizadoPlots), de modo que la rutina
+        # master termina sin esperar a los PDF, y solo si han cambiado los datos desde el último PDF
+        E('historia01',['arcos'], final=lambda r: Rutina01_v01.lanzarPlotHistory()),
+        E('historia02',['flats'], final=lambda r: Rutina02_v01.lanzarPlotHistory()),
+        E('historia04',['bias'], final=lambda r: Rutina04_v01.lanzarPlotHistory()),
+    ])
 
+
+if __name__=="__main__":
+    #Comprobamos que se ha introducido un parámetro al programa y que sea un directorio
+    #Opcionalmente se puede indicar el número de procesos con los que se ejecutarán las rutinas
+    if len(sys.argv)==2 or (len(sys.argv)==3 and sys.argv[2].isdigit()):
+        if os.path.exists(sys.argv[1]) and not os.path.isfile(sys.argv[1]):
+            if len(sys.argv)==3:
+                numProcesos=int(sys.argv[2])
+            else:
+                numProcesos=NUM_PROCESOS
+            inicio=time.time()
+            noche=os.path.basename(sys.argv[1].rstrip("/"))
+            Planificador.ejecutar(generarEtapas(sys.argv[1]),numProcesos,noche)
+            # Escribimos el informe con las medidas de tiempo y memoria de la noche
+            print "Informe de la ejecución: "+Instrumentacion.escribirInforme(noche,inicio,numProcesos=numProcesos)
+        else:
+            print "El directorio introducido no existe"
+    else:
+        print "El numero de parámetros es incorrecto."
+        print "Debes introducir el directorio de trabajo:"
+        print "SINTAXIS: python RutinaMaster [directorio] [numProcesos]"
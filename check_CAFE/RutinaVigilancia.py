@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Rutina de vigilancia.
+Objetivo: Procesar los ficheros de una noche a medida que se van generando, en lugar de esperar
+          a que termine la noche. Se revisa periódicamente el directorio de la noche y cada fichero
+          .fits nuevo se clasifica a partir de su cabecera en cuanto su tamaño deja de cambiar:
+          - Arco: se generan las estadísticas de sus spots (rutina 01).
+          - Flat: se genera el ajuste de sus órdenes (rutina 02).
+          - Bias: se calculan sus estadísticas y se añaden al fichero nivel_bias de la noche (rutina 04).
+          Los promedios de la noche se van acumulando con cada fichero, de modo que al amanecer
+          (fin del crepúsculo astronómico) solo queda escribir las entradas de los ficheros Master,
+          calcular la eficiencia de la noche y generar los plots.
+          La vigilancia también se puede terminar antes con Ctrl+C.
+SINTAXIS: python RutinaVigilancia.py directorio [segundos]
+"""
+
+import sys
+import os
+import os.path
+import time
+import Instrumentacion
+import numpy as np
+import CatalogoCabeceras
+import Rutina01_v01
+import Rutina02_v01
+import Rutina04_v01
+import Rutina05_v01
+import RutinaMaster
+
+"""
+Tiempo (en segundos) entre cada revisión del directorio de la noche
+"""
+PERIODO=30
+
+"""
+Margen (en horas) que se espera tras el fin del crepúsculo astronómico antes de cerrar la noche,
+para dar tiempo a que lleguen los últimos ficheros de calibración
+"""
+MARGEN_AMANECER=1.0
+
+"""
+Funcion que crea el estado de la vigilancia de una noche, donde se acumulan los resultados
+de cada fichero procesado
+"""
+def nuevoEstado(directorio):
+    # Abrimos el fichero de la rutina 04 donde se irán añadiendo las estadísticas de cada bias
+    outfile=open("./Rut04_dat/nivel_bias_"+directorio+".txt","w")
+    outfile.write("@fichero, bias_medio, bias_mediana, bias_desvTipica, dia_juliano\n")
+    outfile.flush()
+    return {'directorio':directorio, 'inicio':time.time(),
+            # Ficheros ya procesados y tamaño y fecha de modificación de los pendientes en la última revisión
+            'procesados':set(), 'pendientes':{},
+            # Rutina 01: dia juliano, desviaciones medias e intensidad media de cada arco, y resultados de sus spots
+            'juldateArcos':[], 'desvX':[], 'desvY':[], 'intensidad':[], 'arcos':[], 'spots':[],
+            # Rutina 02: dia juliano y desviaciones de los ordenes 10, 40 y 70 de cada flat, su ajuste y sus trazas (CAFE_TRAZAS=1)
+            'juldateFlats':[], 'desv10':[], 'desv40':[], 'desv70':[], 'flats':[], 'ajustes':[], 'trazas':[],
+            'ajusteInicial':Rutina02_v01.getAjusteInicial(),
+            # Rutina 04: fichero nivel_bias, bias procesados y su dia juliano, y acumulador con el histograma de todos los bias
+            'ficheroBias':outfile, 'bias':[], 'juldateBias':[], 'biasNoche':None}
+
+"""
+Funcion que procesa un fichero arco y acumula sus desviaciones medias y su intensidad media
+"""
+def procesarArco(estado, fichero):
+    spots=Rutina01_v01.generarEstadisticas(Rutina01_v01.INPUT_SPOT,fichero)
+    desvX,desvY,intensidad=Rutina01_v01.promedioSpots(spots)
+    estado['arcos'].append(fichero)
+    estado['spots'].append(spots)
+    estado['juldateArcos'].append(Rutina01_v01.getDiaJuliano(fichero))
+    estado['desvX'].append(desvX)
+    estado['desvY'].append(desvY)
+    estado['intensidad'].append(intensidad)
+    print "... Arco %s: desviación X %.4f pix, desviación Y %.4f pix"%(fichero,desvX,desvY)
+
+"""
+Funcion que procesa un fichero flat y acumula la desviación de los ordenes 10, 40 y 70
+y, con CAFE_TRAZAS=1, las trazas de sus ordenes
+"""
+def procesarFlat(estado, fichero):
+    mat=Rutina02_v01.getMatrizDatos(fichero)
+    ajuste=Rutina02_v01.procesarFlat(fichero,mat=mat)
+    if Rutina02_v01.MODO_TRAZAS:
+        estado['trazas'].append(Rutina02_v01.trazarFlat(fichero,mat))
+    desv10,desv40,desv70=Rutina02_v01.getDesviacionOrdenes(ajuste['posY'],estado['ajusteInicial'])
+    estado['flats'].append(fichero)
+    estado['ajustes'].append(ajuste)
+    estado['juldateFlats'].append(Rutina02_v01.getDiaJuliano(fichero))
+    estado['desv10'].append(desv10)
+    estado['desv40'].append(desv40)
+    estado['desv70'].append(desv70)
+    print "... Flat %s: desviación ordenes 10/40/70 %.4f / %.4f / %.4f pix"%(fichero,desv10,desv40,desv70)
+
+"""
+Funcion que procesa un fichero bias, escribe sus estadísticas en el fichero nivel_bias de la noche
+y suma su histograma al de la noche completa
+"""
+def procesarBias(estado, fichero):
+    nombre,media,mediana,desviacion,juldate,acumulador=Rutina04_v01.estadisticasBias(fichero)
+    Rutina04_v01.escribirEstadisticasBias(estado['ficheroBias'],nombre,media,mediana,desviacion,juldate)
+    estado['ficheroBias'].flush()
+    estado['bias'].append(fichero)
+    estado['juldateBias'].append(juldate)
+    estado['biasNoche']=Rutina04_v01.sumarAcumuladores(estado['biasNoche'],acumulador)
+    print "... Bias %s: nivel medio %.2f ADUs, ruido de lectura %.2f ADUs"%(fichero,media,desviacion)
+
+"""
+Funcion que clasifica un fichero a partir de su cabecera y lo procesa según su tipo.
+Los ficheros de ciencia solo se añaden al catálogo, que se utiliza en la rutina 05.
+"""
+def procesarFichero(estado, fichero):
+    tipo=CatalogoCabeceras.actualizarFichero(fichero)['tipo']
+    try:
+        with Instrumentacion.medir('ficheros',fichero,funcion=tipo):
+            if tipo=="[arc]":
+                procesarArco(estado,fichero)
+            elif tipo=="[flat]":
+                procesarFlat(estado,fichero)
+            elif tipo=="[Bias]":
+                procesarBias(estado,fichero)
+    except Exception as error:
+        # Un fichero defectuoso no debe detener la vigilancia del resto de la noche
+        print "... Error al procesar el fichero %s: %s"%(fichero,error)
+    sys.stdout.flush()
+
+"""
+Funcion que revisa el directorio de la noche y procesa los ficheros nuevos.
+Un fichero se procesa cuando su tamaño y fecha de modificación no han cambiado desde la revisión
+anterior, para no leer ficheros que aún se están escribiendo. Si completos es True se procesan
+todos los ficheros pendientes sin esperar a la siguiente revisión.
+"""
+def revisarDirectorio(estado, completos=False):
+    directorio=estado['directorio']
+    for fichero in sorted(os.listdir(directorio)):
+        rutaFich=directorio+"/"+fichero
+        if fichero.endswith(".fits") and rutaFich not in estado['procesados'] and os.path.isfile(rutaFich):
+            estadoFich=os.stat(rutaFich)
+            firma=(estadoFich.st_size,estadoFich.st_mtime)
+            if completos or estado['pendientes'].get(rutaFich)==firma:
+                estado['pendientes'].pop(rutaFich,None)
+                # El fichero se marca como procesado cuando termina su procesado, de modo que si se interrumpe
+                # la vigilancia con Ctrl+C durante el ajuste se vuelve a procesar al cerrar la noche
+                procesarFichero(estado,rutaFich)
+                estado['procesados'].add(rutaFich)
+            else:
+                estado['pendientes'][rutaFich]=firma
+
+"""
+Funcion que cierra la noche: escribe las entradas de los ficheros Master a partir de los valores
+acumulados, calcula la eficiencia de la noche, genera los plots y escribe el informe de la noche
+"""
+def cerrarNoche(estado):
+    directorio=estado['directorio']
+    estado['ficheroBias'].close()
+    # Generamos las listas de ficheros de la noche, igual que la rutina master
+    RutinaMaster.generarListaFicheros(directorio)
+    if len(estado['desvX'])>0:
+        RutinaMaster.cabecera("RUTINA 01: ARC-SPOTS ...","========================")
+        intNorm=np.mean(estado['intensidad'])/np.mean(Rutina01_v01.getIntensidadReferencia())
+        Rutina01_v01.registrarRutina01(min(estado['juldateArcos']),np.mean(estado['desvX']),np.mean(estado['desvY']),intNorm)
+        Rutina01_v01.guardarResultadosNoche(directorio,estado['arcos'],estado['spots'])
+        Rutina01_v01.anadirCuboNoche(directorio,estado['arcos'],estado['spots'])
+        Rutina01_v01.lanzarPlot1night(directorio)
+        Rutina01_v01.lanzarPlotHistory()
+    if len(estado['desv10'])>0:
+        RutinaMaster.cabecera("RUTINA 02: Posición e intensidad del flat ...","=============================================")
+        Rutina02_v01.registrarRutina02(min(estado['juldateFlats']),np.mean(estado['desv10']),
+                                       np.mean(estado['desv40']),np.mean(estado['desv70']))
+        Rutina02_v01.guardarResultadosNoche(directorio,estado['flats'],estado['ajustes'])
+        Rutina02_v01.anadirCuboNoche(directorio,estado['flats'],estado['ajustes'])
+        Rutina02_v01.guardarTrazasNoche(directorio,estado['flats'],estado['trazas'])
+        Rutina02_v01.lanzarPlotHistory()
+    if estado['biasNoche'] is not None:
+        RutinaMaster.cabecera("RUTINA 04: Control del nivel de BIAS ...","========================================")
+        mediana,media,desviacion=Rutina04_v01.estadisticasAcumulador(estado['biasNoche'])
+        Rutina04_v01.registrarRutina04(min(estado['juldateBias']),mediana,media,desviacion)
+        # El bias master y el mapa de ruido de lectura necesitan todos los bias de la noche
+        Rutina04_v01.mapasNoche(directorio,estado['bias'],desviacion)
+        Rutina04_v01.lanzarPlotHistory()
+    RutinaMaster.cabecera("RUTINA 05: Calculando tiempos de observación ...","================================================")
+    Rutina05_v01.runRutina05(directorio)
+    # Escribimos el informe con las medidas de tiempo y memoria de cada fichero de la noche
+    print "Informe de la vigilancia: "+Instrumentacion.escribirInforme(directorio,estado['inicio'],numProcesos=1)
+
+"""
+Funcion que vigila el directorio de una noche hasta el amanecer, procesando los ficheros a medida
+que se generan, y al terminar cierra la noche. Si el directorio aún no existe se espera a que se cree.
+"""
+def vigilarNoche(directorio, periodo=PERIODO):
+    import ephem
+    # Generamos los ficheros de referencia de las rutinas 01 y 02
+    Rutina01_v01.cargarSpotsCache(RutinaMaster.ARCO_REF,"./spots.txt")
+    Rutina02_v01.cargarAjustesCache(RutinaMaster.FLAT_REF)
+    # Calculamos el momento en el que se da por terminada la noche
+    inicio,fin=Rutina05_v01.getCrepusculos(directorio)
+    limite=ephem.Date(fin+MARGEN_AMANECER*ephem.hour)
+    print "Vigilando el directorio %s hasta %s UT"%(directorio,limite)
+    sys.stdout.flush()
+    while not os.path.isdir(directorio):
+        if ephem.now()>limite:
+            print "El directorio %s no se ha creado durante la noche"%(directorio)
+            return
+        time.sleep(periodo)
+    estado=nuevoEstado(directorio)
+    try:
+        while ephem.now()<=limite:
+            revisarDirectorio(estado)
+            time.sleep(periodo)
+    except KeyboardInterrupt:
+        print "Vigilancia interrumpida. Cerrando la noche ..."
+    # Procesamos los ficheros que quedan pendientes y cerramos la noche
+    revisarDirectorio(estado,True)
+    cerrarNoche(estado)
+
+
+if __name__=="__main__":
+    if len(sys.argv)==2 or (len(sys.argv)==3 and sys.argv[2].isdigit()):
+        if "/" in sys.argv[1].rstrip("/"):
+            print "El directorio debe estar en el directorio de trabajo"
+        elif len(sys.argv)==3:
+            vigilarNoche(sys.argv[1].rstrip("/"),int(sys.argv[2]))
+        else:
+            vigilarNoche(sys.argv[1].rstrip("/"))
+    else:
+        print "El numero de parámetros es incorrecto."
+        print "SINTAXIS: python RutinaVigilancia.py directorio [segundos]"
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Generador de imágenes sintéticas.
+Objetivo: Generar imágenes .fits de 2048x2048 con el mismo formato que las de CAFE:
+          - Arco: los 200 spots de spots.txt como gaussianas 2-D sobre el nivel de bias, con un
+                  desplazamiento subpíxel común a todos los spots que se puede controlar.
+          - Flat: los 80 ordenes de ordenes_input.txt como perfiles gaussianos cuya posición deriva
+                  a lo largo de la imagen igual que supone la rutina 02, más una ligera curvatura.
+          - Bias: ruido gaussiano alrededor de 816 ADUs con ruido de lectura configurable.
+          - Ciencia: nivel de bias y ruido, con el tiempo de exposición indicado.
+          Las cabeceras contienen OBJECT, DATE y EXPTIME. Los datos se escriben traspuestos, igual que
+          en las imágenes reales, de modo que la matriz traspuesta de las rutinas es matriz[x,y].
+"""
+
+from astropy.io import fits
+import numpy as np
+import os.path
+
+"""
+Directorio donde se encuentran las rutinas y sus ficheros de entrada (spots.txt y ordenes_input.txt)
+"""
+DIR_RUTINAS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Tamaño de las imágenes en píxeles
+"""
+TAM_IMAGEN=2048
+
+"""
+Nivel de bias (ADUs) y ruido de lectura (ADUs) por defecto
+"""
+NIVEL_BIAS=816.0
+RUIDO_LECTURA=3.0
+
+"""
+Semilla con la que se generan las propiedades fijas de la lámpara de arco (posición exacta,
+flujo y anchura de cada spot), comunes a todos los arcos
+"""
+SEMILLA_LAMPARA=7
+
+"""
+Funcion que lee las coordenadas aproximadas de los spots del fichero spots.txt
+"""
+def getSpots():
+    return np.loadtxt(os.path.join(DIR_RUTINAS,"spots.txt"),delimiter=",",comments="@")[:,1:3]
+
+"""
+Funcion que lee las posiciones de los ordenes en la columna central del fichero ordenes_input.txt
+"""
+def getOrdenes():
+    return np.loadtxt(os.path.join(DIR_RUTINAS,"ordenes_input.txt"),delimiter=",",comments="@")[:,1]
+
+"""
+Funcion que escribe la matriz traspuesta (matriz[x,y]) en un fichero .fits con las cabeceras de CAFE
+"""
+def escribirFrame(ruta, matriz, objeto, fecha, exptime):
+    hdu=fits.PrimaryHDU(matriz.T)
+    hdu.header['OBJECT']=objeto
+    hdu.header['DATE']=fecha
+    hdu.header['EXPTIME']=exptime
+    hdu.writeto(ruta,overwrite=True)
+
+"""
+Funcion que genera el fondo de una imagen: nivel de bias más ruido de lectura
+"""
+def getFondo(rng, nivel=NIVEL_BIAS, ruido=RUIDO_LECTURA):
+    return nivel+rng.normal(0,ruido,(TAM_IMAGEN,TAM_IMAGEN))
+
+"""
+Funcion que genera un arco con los spots desplazados (desplX, desplY) píxeles.
+La posición exacta, el flujo y la anchura de cada spot son siempre los mismos (SEMILLA_LAMPARA),
+y la semilla solo cambia el ruido. Los datos se almacenan como enteros sin signo de 16 bits.
+"""
+def generarArco(ruta, desplX=0.0, desplY=0.0, fecha="2016-07-22T21:00:00", exptime=5.0, semilla=1):
+    rng=np.random.RandomState(semilla)
+    lampara=np.random.RandomState(SEMILLA_LAMPARA)
+    matriz=getFondo(rng)
+    pixeles=np.arange(TAM_IMAGEN)
+    for posX,posY in getSpots():
+        # Las coordenadas de spots.txt son aproximadas: el centro real está a menos de un píxel
+        cenX=posX+lampara.uniform(-1,1)+desplX
+        cenY=posY+lampara.uniform(-1,1)+desplY
+        flujo=lampara.uniform(5000,50000)
+        sigma=lampara.uniform(1.2,2.5)
+        rangoX=slice(int(cenX)-15,int(cenX)+15)
+        rangoY=slice(int(cenY)-15,int(cenY)+15)
+        perfilX=np.exp(-(pixeles[rangoX]-cenX)**2/(2*sigma**2))
+        perfilY=np.exp(-(pixeles[rangoY]-cenY)**2/(2*sigma**2))
+        spot=flujo/(2*np.pi*sigma**2)*np.outer(perfilX,perfilY)
+        # Ruido fotónico aproximado
+        matriz[rangoX,rangoY]+=spot+rng.normal(0,1,spot.shape)*np.sqrt(spot)
+    escribirFrame(ruta,np.clip(np.round(matriz),0,65535).astype(np.uint16),"[arc] ThAr",fecha,exptime)
+
+"""
+Funcion que devuelve la posición de un orden en cada columna de la imagen a partir de su posición
+en la columna central. Se sigue la deriva que supone la rutina 02 (4/2048 por cada 60 columnas)
+más una ligera curvatura.
+"""
+def getTraza(posicion, columnas):
+    return posicion*(1+4./2048.)**((columnas-1024)/60.)+2e-7*(columnas-1024)**2
+
+"""
+Funcion que genera un flat con los ordenes desplazados desplY píxeles en la dirección perpendicular
+a los ordenes. Los datos se almacenan como reales de 32 bits.
+"""
+def generarFlat(ruta, desplY=0.0, fecha="2016-07-22T20:00:00", exptime=10.0, semilla=3, intensidad=3000., sigma=1.8):
+    rng=np.random.RandomState(semilla)
+    matriz=np.empty((TAM_IMAGEN,TAM_IMAGEN))
+    matriz.fill(800.)
+    columnas=np.arange(TAM_IMAGEN,dtype=np.float64)
+    filas=np.arange(TAM_IMAGEN,dtype=np.float64)
+    for posicion in getOrdenes():
+        traza=getTraza(posicion+desplY,columnas)
+        # Solo calculamos el perfil en la banda de filas que ocupa el orden
+        ini=max(int(np.min(traza))-12,0)
+        fin=min(int(np.max(traza))+13,TAM_IMAGEN)
+        if ini<fin:
+            matriz[:,ini:fin]+=intensidad*np.exp(-(filas[None,ini:fin]-traza[:,None])**2/(2*sigma**2))
+    matriz+=rng.normal(0,10,matriz.shape)
+    escribirFrame(ruta,np.round(matriz).astype(np.float32),"[flat]",fecha,exptime)
+
+"""
+Funcion que genera un bias con el nivel y el ruido de lectura indicados.
+Los datos se almacenan como enteros de 16 bits.
+"""
+def generarBias(ruta, nivel=NIVEL_BIAS, ruido=RUIDO_LECTURA, fecha="2016-07-22T19:00:00", semilla=5):
+    rng=np.random.RandomState(semilla)
+    escribirFrame(ruta,np.round(getFondo(rng,nivel,ruido)).astype(np.int16),"[Bias]",fecha,0.0)
+
+"""
+Funcion que genera una imagen de ciencia con el tiempo de exposición indicado
+"""
+def generarCiencia(ruta, exptime=1800.0, fecha="2016-07-22T22:00:00", semilla=11, objeto="HD000000"):
+    rng=np.random.RandomState(semilla)
+    escribirFrame(ruta,np.round(getFondo(rng)).astype(np.int16),objeto,fecha,exptime)
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Rutina de pruebas de rendimiento.
+Objetivo: Medir el tiempo de generarEstadisticas (rutina 01), generarAjuste (rutina 02), runRutina04
+          y runRutina05 sobre noches sintéticas de distintos tamaños, y comprobar la precisión de las
+          rutinas: los desplazamientos introducidos en cada arco y en cada flat, y el nivel y el ruido
+          de lectura de los bias, deben recuperarse dentro de una tolerancia.
+          En cada arco se compara además el desplazamiento global estimado por correlación de fase (modo
+          rápido de la rutina 01) con la media de los spots ajustados uno a uno, y se comprueba que el ajuste de
+          los flats repartiendo sus barridos entre varios procesos es idéntico al de un único proceso.
+          En cada flat se trazan además los ordenes en todas las columnas (trazarFlat), se comparan las trazas
+          con las que se generó el flat y se comprueba que el trazado no tarda más que generarAjuste.
+          Los flats de cada noche se combinan también en un flat master con cada método (ver CombinacionFrames):
+          se comprueba el desplazamiento medido en el flat master y que la combinación por bloques pequeños es
+          idéntica, y se compara el tiempo con el del ajuste de cada flat por separado.
+          En cada noche se comprueban también el nivel y el ruido de lectura de cada región del CCD obtenidos
+          del bias master y del mapa de ruido de la rutina 04.
+          También se mide el rendimiento (frames por segundo) de los bucles de cada rutina sobre la lista de
+          ficheros de la noche, sin lectura anticipada y con ella (ver LecturaAnticipada).
+          Todo se ejecuta en un directorio de trabajo nuevo (por defecto, un directorio temporal), donde
+          quedan los resultados de las rutinas y el informe informe_benchmark.json con las medidas de
+          cada fichero. Las imágenes de cada noche se borran al terminar de medirla.
+SINTAXIS (desde el directorio check_CAFE): python -m benchmark.RutinaBenchmark [-d directorio] [numFrames1 numFrames2 ...]
+          Cada numFrames es el número de arcos, flats, bias e imágenes de ciencia de una noche.
+"""
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+import datetime
+import time
+import multiprocessing
+import numpy as np
+
+"""
+Directorio donde se encuentran las rutinas. Se añade a la ruta de búsqueda de módulos para poder
+importarlas después de cambiar al directorio de trabajo.
+"""
+DIR_RUTINAS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if DIR_RUTINAS not in sys.path:
+    sys.path.insert(0,DIR_RUTINAS)
+
+from benchmark import GeneradorFrames
+import CacheResultados
+import CatalogoCabeceras
+import CombinacionFrames
+import Instrumentacion
+import LecturaAnticipada
+import Rutina01_v01
+import Rutina02_v01
+import Rutina04_v01
+import Rutina05_v01
+
+"""
+Número de frames de cada tipo de las noches que se miden si no se indica por parámetros
+"""
+TAMANIOS=[2,5,10]
+
+"""
+Desplazamiento máximo (en píxeles) que se introduce en cada arco y en cada flat
+"""
+DESPL_MAXIMO=0.2
+
+"""
+Diferencia máxima (en píxeles) entre el desplazamiento introducido y el medido por la rutina 01 en cada
+arco, y por la rutina 02 en cada orden de cada flat. La de los flats es mayor porque se comparan dos
+ajustes con ruido de un único orden, mientras que en los arcos se promedian 200 spots.
+"""
+TOLERANCIA_ARCO=0.01
+TOLERANCIA_FLAT=0.02
+
+"""
+Diferencia máxima (en píxeles) entre el desplazamiento global de cada arco estimado por correlación de fase
+(modo rápido de la rutina 01) y la media de los desplazamientos de los spots ajustados uno a uno
+"""
+TOLERANCIA_RAPIDO=0.005
+
+"""
+Diferencia máxima (en píxeles) entre las trazas de los ordenes (ver Rutina02_v01.trazarFlat) y la traza
+con la que se generó cada flat, en las columnas en las que el orden está dentro de la imagen
+"""
+TOLERANCIA_TRAZA=0.02
+
+"""
+Diferencia máxima (en ADUs) entre el nivel de bias introducido y el medido, y diferencia relativa
+máxima entre el ruido de lectura introducido y el medido
+"""
+TOLERANCIA_NIVEL=0.05
+TOLERANCIA_RUIDO=0.02
+
+"""
+Fichero Master de la rutina 04 para las noches sintéticas
+"""
+FICH_MASTER_BIAS="./Rut04_dat/bias_master_benchmark.txt"
+
+"""
+Funcion que prepara el directorio de trabajo con los directorios de resultados y los ficheros
+de entrada de las rutinas, y cambia a dicho directorio
+"""
+def prepararDirectorio(directorio):
+    if not os.path.isdir(directorio):
+        os.makedirs(directorio)
+    for datos in ("Rut01_dat","Rut02_dat","Rut04_dat","Rut05_dat"):
+        if not os.path.isdir(os.path.join(directorio,datos)):
+            os.makedirs(os.path.join(directorio,datos))
+    for entrada in ("spots.txt","ordenes_input.txt"):
+        shutil.copy(os.path.join(DIR_RUTINAS,entrada),directorio)
+    os.chdir(directorio)
+
+"""
+Funcion que genera el arco y el flat de referencia (sin desplazamiento) y los ficheros de referencia
+de las rutinas 01 y 02
+"""
+def generarReferencias():
+    GeneradorFrames.generarArco("./arco_ref.fits",semilla=9)
+    GeneradorFrames.generarFlat("./flat_ref.fits",semilla=8)
+    Rutina01_v01.cargarSpots("./arco_ref.fits","./spots.txt")
+    Rutina01_v01.generarFFTReferencia("./arco_ref.fits")
+    Rutina02_v01.cargarAjustes("./flat_ref.fits")
+
+"""
+Funcion que genera una noche sintética con numFrames arcos, flats, bias e imágenes de ciencia.
+Cada arco y cada flat tiene un desplazamiento aleatorio distinto. Devuelve las listas
+(fichero, desplazamiento) de los arcos y de los flats, y la lista de bias.
+"""
+def generarNoche(noche, fecha, numFrames, ruido):
+    os.makedirs(noche)
+    rng=np.random.RandomState(numFrames)
+    arcos=[]
+    flats=[]
+    bias=[]
+    numero=1
+    # Repartimos las imágenes a lo largo de la noche, una cada 10 minutos a partir de las 20:00
+    for k in range(numFrames):
+        for tipo in ("bias","flat","arco","ciencia"):
+            ruta=noche+"/cali_%04d.fits"%(numero)
+            hora=(fecha+datetime.timedelta(minutes=10*numero)).strftime("%Y-%m-%dT%H:%M:%S")
+            if tipo=="bias":
+                GeneradorFrames.generarBias(ruta,ruido=ruido,fecha=hora,semilla=numero)
+                bias.append(ruta)
+            elif tipo=="flat":
+                desplY=rng.uniform(-DESPL_MAXIMO,DESPL_MAXIMO)
+                GeneradorFrames.generarFlat(ruta,desplY,fecha=hora,semilla=numero)
+                flats.append((ruta,desplY))
+            elif tipo=="arco":
+                despl=rng.uniform(-DESPL_MAXIMO,DESPL_MAXIMO,2)
+                GeneradorFrames.generarArco(ruta,despl[0],despl[1],fecha=hora,semilla=numero)
+                arcos.append((ruta,despl))
+            else:
+                GeneradorFrames.generarCiencia(ruta,fecha=hora,semilla=numero)
+            numero=numero+1
+    return arcos,flats,bias
+
+"""
+Funcion que escribe el resultado de una comprobación con el mismo formato que las rutinas.
+Devuelve True si la comprobación es correcta.
+"""
+def comprobar(texto, correcto):
+    if correcto:
+        print "... "+texto+" ... OK"
+    else:
+        print "... "+texto+" ... NO OK! - CHECK"
+    return correcto
+
+"""
+Funcion que ejecuta la función indicada midiendo su tiempo con Instrumentacion.
+Se acumula el tiempo en el diccionario de tiempos de la noche y se devuelve el resultado de la función.
+"""
+def medirFuncion(tiempos, nombre, fichero, funcion, *args):
+    with Instrumentacion.medir('ficheros',fichero,funcion=nombre) as medida:
+        resultado=funcion(*args)
+    tiempos[nombre]=tiempos.get(nombre,0.0)+medida['tiempo']
+    return resultado
+
+"""
+Funcion que devuelve la diferencia máxima (en píxeles) entre las trazas de un flat y la traza con la que
+se generó cada orden, en las columnas en las que el orden está a más de RADIO_TRAZA píxeles del borde
+"""
+def getDiferenciaTrazas(trazas, desplY):
+    columnas=np.arange(GeneradorFrames.TAM_IMAGEN,dtype=np.float64)
+    reales=np.array([GeneradorFrames.getTraza(posicion+desplY,columnas) for posicion in GeneradorFrames.getOrdenes()])
+    dentro=(reales>=Rutina02_v01.RADIO_TRAZA)&(reales<GeneradorFrames.TAM_IMAGEN-Rutina02_v01.RADIO_TRAZA)
+    return np.max(np.abs(Rutina02_v01.evaluarTrazas(trazas,columnas)-reales)[dentro])
+
+"""
+Funcion que mide las rutinas sobre una noche y comprueba que se recuperan los desplazamientos,
+el nivel de bias y el ruido de lectura. Devuelve el diccionario con el tiempo total de cada función,
+el número de comprobaciones incorrectas, la diferencia máxima en cada eje entre el modo rápido y el ajuste
+de los spots de la rutina 01 y la diferencia máxima entre las trazas de los ordenes y las reales.
+"""
+def medirNoche(noche, arcos, flats, bias, ruido):
+    tiempos={}
+    errores=0
+    medirFuncion(tiempos,"getCatalogo",noche,CatalogoCabeceras.getCatalogo,noche)
+    # Rutina 01: el desplazamiento medido de los spots es el contrario al introducido
+    referencia=Rutina01_v01.leerInputSpot(Rutina01_v01.INPUT_SPOT)
+    diferenciaRapido=np.zeros(2)
+    for ruta,despl in arcos:
+        medirFuncion(tiempos,"generarEstadisticas",ruta,Rutina01_v01.generarEstadisticas,Rutina01_v01.INPUT_SPOT,ruta,True,None,False)
+        desvX,desvY,intensidad=Rutina01_v01.getPromedioDesv(ruta[0:len(ruta)-5]+"_"+ruta[0:6]+".spot")
+        correcto=abs(desvX+despl[0])<TOLERANCIA_ARCO and abs(desvY+despl[1])<TOLERANCIA_ARCO
+        if not comprobar("Arco %s: desplazamiento (%.4f, %.4f) pix, medido (%.4f, %.4f) pix"
+                         %(ruta,despl[0],despl[1],-desvX,-desvY),correcto):
+            errores=errores+1
+        # Modo rápido: desplazamiento global por correlación de fase, leyendo también las ventanas
+        rapido=medirFuncion(tiempos,"estimarDesplazamiento",ruta,
+                            lambda r: Rutina01_v01.estimarDesplazamiento(Rutina01_v01.leerVentanasArco(referencia,r)),ruta)
+        diferencia=np.abs(rapido+np.array([desvX,desvY]))
+        diferenciaRapido=np.maximum(diferenciaRapido,diferencia)
+        if not comprobar("Arco %s (modo rápido): correlación de fase (%.4f, %.4f) pix, diferencia con el ajuste (%.4f, %.4f) pix"
+                         %(ruta,rapido[0],rapido[1],diferencia[0],diferencia[1]),np.all(diferencia<TOLERANCIA_RAPIDO)):
+            errores=errores+1
+    # Rutina 02: la desviación de los ordenes respecto al flat de referencia es la contraria al desplazamiento
+    ajusteInicial=Rutina02_v01.getAjusteInicial()
+    diferenciaTrazas=0.
+    for ruta,desplY in flats:
+        matPos,matSigma,matUmbral,matPosX=medirFuncion(tiempos,"generarAjuste",ruta,Rutina02_v01.generarAjuste,
+                                                       ruta,Rutina02_v01.INPUT_ORDEN)
+        desviaciones=Rutina02_v01.getDesviacionOrdenes(np.array(matPos),ajusteInicial)
+        correcto=all(abs(desv+desplY)<TOLERANCIA_FLAT for desv in desviaciones)
+        if not comprobar("Flat %s: desplazamiento %.4f pix, medido ordenes 10/40/70 %.4f / %.4f / %.4f pix"
+                         %(ruta,desplY,-desviaciones[0],-desviaciones[1],-desviaciones[2]),correcto):
+            errores=errores+1
+        # Trazado de los ordenes en todas las columnas, leyendo también el flat igual que generarAjuste
+        trazas=medirFuncion(tiempos,"trazarFlat",ruta,Rutina02_v01.trazarFlat,ruta)
+        diferencia=getDiferenciaTrazas(trazas,desplY)
+        diferenciaTrazas=max(diferenciaTrazas,diferencia)
+        if not comprobar("Flat %s (trazas): diferencia máxima con las trazas reales %.4f pix"%(ruta,diferencia),
+                         diferencia<TOLERANCIA_TRAZA):
+            errores=errores+1
+    # El trazado de todas las columnas no debe tardar más que el ajuste de las 34 columnas
+    if not comprobar("Trazas: %.4f s por flat, ajuste %.4f s por flat"%(tiempos["trazarFlat"]/len(flats),tiempos["generarAjuste"]/len(flats)),
+                     tiempos["trazarFlat"]<=tiempos["generarAjuste"]):
+        errores=errores+1
+    # Rutina 04: comprobamos el nivel y el ruido de lectura de cada bias
+    listaBias="./biasFits_"+noche+".txt"
+    outfile=open(listaBias,"w")
+    for ruta in bias:
+        outfile.write(ruta+"\n")
+    outfile.close()
+    medirFuncion(tiempos,"runRutina04",noche,Rutina04_v01.runRutina04,noche,listaBias,FICH_MASTER_BIAS)
+    estadisticas=np.loadtxt("./Rut04_dat/nivel_bias_"+noche+".txt",delimiter=",",comments="@",usecols=(1,3),ndmin=2)
+    correcto=(np.all(np.abs(estadisticas[:,0]-GeneradorFrames.NIVEL_BIAS)<TOLERANCIA_NIVEL) and
+              np.all(np.abs(estadisticas[:,1]/ruido-1)<TOLERANCIA_RUIDO))
+    if not comprobar("Bias: nivel %.2f ADUs y ruido %.2f ADUs, medidos %.4f ADUs y %.4f ADUs"
+                     %(GeneradorFrames.NIVEL_BIAS,ruido,np.mean(estadisticas[:,0]),np.mean(estadisticas[:,1])),correcto):
+        errores=errores+1
+    # El bias master y el mapa de ruido de lectura deben dar el mismo nivel y ruido en cada región del CCD
+    if Rutina04_v01.MAPAS_BIAS and len(bias)>=2:
+        regiones=np.loadtxt(Rutina04_v01.getFicheroRegionesBias(noche),delimiter=",",comments="@",usecols=(2,4,5),ndmin=2)
+        correcto=(np.all(np.abs(regiones[:,0]-GeneradorFrames.NIVEL_BIAS)<TOLERANCIA_NIVEL) and
+                  np.all(np.abs(regiones[:,1]/ruido-1)<TOLERANCIA_RUIDO) and np.all(regiones[:,2]==0))
+        if not comprobar("Mapas de bias: nivel %.4f - %.4f ADUs y ruido %.4f - %.4f ADUs en las regiones, %d columnas calientes"
+                         %(np.min(regiones[:,0]),np.max(regiones[:,0]),np.min(regiones[:,1]),np.max(regiones[:,1]),np.sum(regiones[:,2])),correcto):
+            errores=errores+1
+    # Rutina 05: solo se mide el tiempo
+    medirFuncion(tiempos,"runRutina05",noche,Rutina05_v01.runRutina05,noche)
+    return tiempos,errores,diferenciaRapido,diferenciaTrazas
+
+"""
+Funcion que mide el procesado de la lista de arcos (rutina01Run), de flats (procesarListaFlats) y de bias
+(runRutina04) de una noche, primero sin lectura anticipada y después con ella. Debe ejecutarse después de
+medirNoche, que escribe la lista de bias. Devuelve una lista con el número de frames por segundo de cada bucle
+sin lectura anticipada y con ella.
+"""
+def medirLecturaAnticipada(noche, arcos, flats, bias):
+    listaArcos="./arcoFits_"+noche+".txt"
+    outfile=open(listaArcos,"w")
+    for ruta,despl in arcos:
+        outfile.write(ruta+"\n")
+    outfile.close()
+    listaBias="./biasFits_"+noche+".txt"
+    bucles=[("rutina01Run",lambda: Rutina01_v01.rutina01Run(listaArcos),len(arcos)),
+            ("procesarListaFlats",lambda: Rutina02_v01.procesarListaFlats([ruta for ruta,desplY in flats]),len(flats)),
+            ("runRutina04",lambda: Rutina04_v01.runRutina04(noche,listaBias,FICH_MASTER_BIAS),len(bias))]
+    profundidad=LecturaAnticipada.PROFUNDIDAD
+    rendimiento=dict((nombre,{'bucle':nombre}) for nombre,bucle,numFrames in bucles)
+    try:
+        for modo,valor in (('sin',0),('con',max(profundidad,1))):
+            LecturaAnticipada.PROFUNDIDAD=valor
+            for nombre,bucle,numFrames in bucles:
+                with Instrumentacion.medir('tareas',nombre,profundidad=valor) as medida:
+                    bucle()
+                rendimiento[nombre][modo]=numFrames/max(medida['tiempo'],1e-6)
+    finally:
+        LecturaAnticipada.PROFUNDIDAD=profundidad
+    return [rendimiento[nombre] for nombre,bucle,numFrames in bucles]
+
+"""
+Número de procesos con los que se ajustan en paralelo los flats de cada noche
+"""
+PROCESOS_FLATS=max(multiprocessing.cpu_count(),2)
+
+"""
+Funcion que ajusta los flats de una noche en un único proceso y repartiendo sus barridos entre PROCESOS_FLATS
+procesos (ver Rutina02_v01.procesarListaFlats), y comprueba que los ajustes son idénticos.
+Devuelve el número de frames por segundo en cada caso y si los ajustes son idénticos.
+"""
+def medirFlatsParalelo(flats):
+    rutas=[ruta for ruta,desplY in flats]
+    rendimiento={'procesos':PROCESOS_FLATS}
+    ajustes={}
+    for modo,numProcesos in (('serie',1),('paralelo',PROCESOS_FLATS)):
+        with Instrumentacion.medir('tareas',"procesarListaFlats",procesos=numProcesos) as medida:
+            ajustes[modo]=Rutina02_v01.procesarListaFlats(rutas,numProcesos)
+        rendimiento[modo]=len(rutas)/max(medida['tiempo'],1e-6)
+    rendimiento['identico']=all(a.tostring()==b.tostring() for a,b in zip(ajustes['serie'],ajustes['paralelo']))
+    return rendimiento
+
+"""
+Funcion que combina los flats de una noche en un flat master con cada método y ajusta el flat master
+(ver Rutina02_v01.getFlatsAjuste), y ajusta también cada flat por separado. Se comprueba que el desplazamiento
+medido en el flat master es el contrario a la mediana (o a la media) de los desplazamientos de los flats, y
+que la combinación es idéntica al leer los flats en bloques de 1 MB. Devuelve una lista con el número de
+frames por segundo de cada modo y el número de comprobaciones incorrectas.
+"""
+def medirMasterFlat(flats):
+    rutas=[ruta for ruta,desplY in flats]
+    ajusteInicial=Rutina02_v01.getAjusteInicial()
+    rendimientos=[]
+    errores=0
+    esperados={'mediana':np.median([desplY for ruta,desplY in flats]), 'sigma':np.mean([desplY for ruta,desplY in flats])}
+    for metodo in ("",)+CombinacionFrames.METODOS:
+        with Instrumentacion.medir('tareas',"procesarListaFlats",combinacion=metodo) as medida:
+            listaAjustes=Rutina02_v01.procesarListaFlats(Rutina02_v01.getFlatsAjuste(rutas,metodo))
+        rendimientos.append({'combinacion':metodo or "por flat", 'rendimiento':len(rutas)/max(medida['tiempo'],1e-6)})
+        if metodo=="":
+            continue
+        desviaciones=Rutina02_v01.getDesviacionOrdenes(listaAjustes[0]['posY'],ajusteInicial)
+        if not comprobar("Flat master (%s): desplazamiento %.4f pix, medido ordenes 10/40/70 %.4f / %.4f / %.4f pix"
+                         %(metodo,esperados[metodo],-desviaciones[0],-desviaciones[1],-desviaciones[2]),
+                         all(abs(desv+esperados[metodo])<TOLERANCIA_FLAT for desv in desviaciones)):
+            errores=errores+1
+        identico=np.array_equal(CombinacionFrames.combinar(rutas,metodo),CombinacionFrames.combinar(rutas,metodo,1))
+        if not comprobar("Flat master (%s): combinación en bloques de 1 MB idéntica"%(metodo),identico):
+            errores=errores+1
+    return rendimientos,errores
+
+"""
+Funcion que ejecuta las pruebas para cada tamaño de noche y escribe el resumen de tiempos.
+Devuelve el número total de comprobaciones incorrectas.
+"""
+def runBenchmark(directorio, tamanios=TAMANIOS, ruido=GeneradorFrames.RUIDO_LECTURA):
+    inicio=time.time()
+    prepararDirectorio(directorio)
+    Instrumentacion.reiniciar()
+    # Medimos siempre el procesado completo, sin reutilizar resultados de ejecuciones anteriores
+    CacheResultados.USAR_CACHE=False
+    generarReferencias()
+    resumen=[]
+    rendimientos=[]
+    precisionRapido=[]
+    precisionTrazas=[]
+    flatsParalelo=[]
+    masterFlat=[]
+    errores=0
+    fecha=datetime.datetime(2016,8,1,20,0,0)
+    for numFrames in tamanios:
+        noche=fecha.strftime("%y%m%d")
+        print "NOCHE SINTÉTICA "+noche+": %d frames de cada tipo"%(numFrames)
+        arcos,flats,bias=generarNoche(noche,fecha,numFrames,ruido)
+        with Instrumentacion.medir('etapas',noche,numFrames=numFrames):
+            tiempos,erroresNoche,diferenciaRapido,diferenciaTrazas=medirNoche(noche,arcos,flats,bias,ruido)
+        resumen.append((numFrames,tiempos))
+        precisionRapido.append({'numFrames':numFrames, 'diferenciaX':round(diferenciaRapido[0],6),
+                                'diferenciaY':round(diferenciaRapido[1],6)})
+        precisionTrazas.append({'numFrames':numFrames, 'diferencia':round(diferenciaTrazas,6),
+                                'tiempoFlat':round(tiempos["trazarFlat"]/numFrames,6)})
+        for rendimiento in medirLecturaAnticipada(noche,arcos,flats,bias):
+            rendimiento['numFrames']=numFrames
+            rendimientos.append(rendimiento)
+        errores=errores+erroresNoche
+        rendimiento=medirFlatsParalelo(flats)
+        rendimiento['numFrames']=numFrames
+        flatsParalelo.append(rendimiento)
+        if not comprobar("Flats en paralelo (%d procesos): ajustes idénticos al ajuste en serie"%(PROCESOS_FLATS),rendimiento['identico']):
+            errores=errores+1
+        rendimientosMaster,erroresMaster=medirMasterFlat(flats)
+        for rendimiento in rendimientosMaster:
+            rendimiento['numFrames']=numFrames
+            masterFlat.append(rendimiento)
+        errores=errores+erroresMaster
+        # Borramos las imágenes de la noche para no ocupar espacio
+        shutil.rmtree(noche)
+        fecha=fecha+datetime.timedelta(days=1)
+    # Resumen de tiempos: tiempo total de cada función y tiempo por frame
+    print
+    print "%-22s %8s %12s %12s"%("Funcion","Frames","Total (s)","Frame (s)")
+    for numFrames,tiempos in resumen:
+        for nombre in ("getCatalogo","generarEstadisticas","estimarDesplazamiento","generarAjuste","trazarFlat","runRutina04","runRutina05"):
+            print "%-22s %8d %12.4f %12.4f"%(nombre,numFrames,tiempos[nombre],tiempos[nombre]/numFrames)
+    # Rendimiento de los bucles de cada rutina sin lectura anticipada y con ella
+    print
+    print "%-22s %8s %14s %14s"%("Bucle","Frames","Sin LA (fr/s)","Con LA (fr/s)")
+    for rendimiento in rendimientos:
+        print "%-22s %8d %14.3f %14.3f"%(rendimiento['bucle'],rendimiento['numFrames'],rendimiento['sin'],rendimiento['con'])
+    # Rendimiento del ajuste de los flats en un único proceso y en paralelo
+    print
+    print "%-22s %8s %14s %14s"%("Flats","Frames","Serie (fr/s)","Paral. (fr/s)")
+    for rendimiento in flatsParalelo:
+        print "%-22s %8d %14.3f %14.3f"%("procesarListaFlats",rendimiento['numFrames'],rendimiento['serie'],rendimiento['paralelo'])
+    # Rendimiento del ajuste de los flats por separado y del flat master de la noche
+    print
+    print "%-22s %8s %14s"%("Flat master","Frames","Flats (fr/s)")
+    for rendimiento in masterFlat:
+        print "%-22s %8d %14.3f"%(rendimiento['combinacion'],rendimiento['numFrames'],rendimiento['rendimiento'])
+    # Diferencia máxima entre el modo rápido de la rutina 01 y el ajuste de los spots
+    print
+    print "%-22s %8s %14s %14s"%("Modo rapido","Frames","Dif. X (pix)","Dif. Y (pix)")
+    for precision in precisionRapido:
+        print "%-22s %8d %14.5f %14.5f"%("estimarDesplazamiento",precision['numFrames'],precision['diferenciaX'],precision['diferenciaY'])
+    # Diferencia máxima entre las trazas de los ordenes y las reales
+    print
+    print "%-22s %8s %14s %14s"%("Trazas","Frames","Dif. (pix)","Flat (s)")
+    for precision in precisionTrazas:
+        print "%-22s %8d %14.5f %14.4f"%("trazarFlat",precision['numFrames'],precision['diferencia'],precision['tiempoFlat'])
+    print
+    print "Comprobaciones incorrectas: %d"%(errores)
+    informe=Instrumentacion.escribirInforme("benchmark",inicio,tamanios=list(tamanios),errores=errores,
+                                            lecturaAnticipada=rendimientos,precisionRapido=precisionRapido,
+                                            flatsParalelo=flatsParalelo,precisionTrazas=precisionTrazas,
+                                            masterFlat=masterFlat)
+    print "Informe: "+os.path.normpath(os.path.join(directorio,informe))
+    return errores
+
+
+if __name__=="__main__":
+    parametros=sys.argv[1:]
+    directorio=None
+    if len(parametros)>=2 and parametros[0]=="-d":
+        directorio=os.path.abspath(parametros[1])
+        parametros=parametros[2:]
+    if all(p.isdigit() and int(p)>0 for p in parametros):
+        if directorio is None:
+            directorio=tempfile.mkdtemp(prefix="benchmark_cafe_")
+        tamanios=[int(p) for p in parametros] or TAMANIOS
+        errores=runBenchmark(directorio,tamanios)
+        sys.exit(1 if errores>0 else 0)
+    else:
+        print "Los parámetros son incorrectos."
+        print "SINTAXIS: python -m benchmark.RutinaBenchmark [-d directorio] [numFrames1 numFrames2 ...]"
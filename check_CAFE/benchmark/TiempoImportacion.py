@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Presupuesto de tiempo de importación.
+Objetivo: Comprobar que importar la rutina master es rápido y que no carga ninguna de las dependencias
+          pesadas (matplotlib, lmfit, scipy, astroML, ephem, astropy...), que solo deben importarse
+          en las funciones que las utilizan. Cada medida se realiza en un intérprete nuevo, para que
+          no influyan los módulos ya cargados, y se toma la menor de todas las repeticiones.
+          Las rutinas de lotes y de vigilancia se miden también, pero solo a título informativo.
+SINTAXIS (desde el directorio check_CAFE): python -m benchmark.TiempoImportacion [repeticiones]
+"""
+
+import sys
+import os.path
+import json
+import subprocess
+
+"""
+Directorio donde se encuentran las rutinas
+"""
+DIR_RUTINAS=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Tiempo máximo (en segundos) para importar la rutina master. Importar numpy, que sí se carga
+siempre, supone en torno a 0.07 segundos.
+"""
+PRESUPUESTO_IMPORTACION=0.3
+
+"""
+Número de veces que se mide la importación de cada módulo si no se indica por parámetros
+"""
+REPETICIONES=5
+
+"""
+Dependencias pesadas que no deben cargarse al importar la rutina master
+"""
+MODULOS_PESADOS=['matplotlib','lmfit','scipy','astroML','ephem','astropy','dateutil','jdcal']
+
+"""
+Código que se ejecuta en el intérprete nuevo: importa el módulo y escribe en formato JSON
+el tiempo de importación y las dependencias pesadas que se han cargado
+"""
+CODIGO_MEDIDA="""
+import sys, time, json
+inicio=time.time()
+import %s
+tiempo=time.time()-inicio
+cargados=sorted(set(m.split('.')[0] for m in sys.modules if sys.modules[m] is not None))
+print json.dumps({'tiempo':tiempo, 'cargados':[m for m in cargados if m in %r]})
+"""
+
+"""
+Funcion que mide en un intérprete nuevo el tiempo de importación de un módulo de las rutinas.
+Devuelve el tiempo y la lista de dependencias pesadas cargadas.
+"""
+def medirImportacion(modulo):
+    salida=subprocess.check_output([sys.executable,"-c",CODIGO_MEDIDA%(modulo,MODULOS_PESADOS)],cwd=DIR_RUTINAS)
+    medida=json.loads(salida.strip().splitlines()[-1])
+    return medida['tiempo'],[str(m) for m in medida['cargados']]
+
+"""
+Funcion que mide la importación de la rutina master y de las rutinas de lotes y de vigilancia,
+y comprueba el presupuesto de la rutina master. Devuelve True si se cumple.
+"""
+def comprobarPresupuesto(repeticiones=REPETICIONES):
+    correcto=True
+    for modulo in ("RutinaMaster","RutinaLotes","RutinaVigilancia"):
+        medidas=[medirImportacion(modulo) for i in range(repeticiones)]
+        tiempo=min(t for t,cargados in medidas)
+        cargados=medidas[0][1]
+        texto="Importación de %s: %.3f s, dependencias pesadas: %s"%(modulo,tiempo,", ".join(cargados) or "ninguna")
+        if modulo=="RutinaMaster":
+            if tiempo<=PRESUPUESTO_IMPORTACION and len(cargados)==0:
+                print "... "+texto+" ... OK"
+            else:
+                print "... "+texto+" ... NO OK! - CHECK (presupuesto %.3f s)"%(PRESUPUESTO_IMPORTACION)
+                correcto=False
+        else:
+            print "... "+texto
+    return correcto
+
+
+if __name__=="__main__":
+    if len(sys.argv)==1 or (len(sys.argv)==2 and sys.argv[1].isdigit() and int(sys.argv[1])>0):
+        repeticiones=REPETICIONES
+        if len(sys.argv)==2:
+            repeticiones=int(sys.argv[1])
+        sys.exit(0 if comprobarPresupuesto(repeticiones) else 1)
+    else:
+        print "SINTAXIS: python -m benchmark.TiempoImportacion [repeticiones]"
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jesús Rentero Bonilla
+Paquete de pruebas de rendimiento.
+Objetivo: Generar imágenes sintéticas de CAFE (arcos, flats, bias y ciencia) y medir el tiempo
+          de las rutinas sobre noches de distintos tamaños, comprobando que los desplazamientos
+          introducidos en las imágenes se recuperan correctamente.
+SINTAXIS (desde el directorio check_CAFE): python -m benchmark.RutinaBenchmark [numFrames1 numFrames2 ...]
+"""